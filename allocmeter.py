@@ -0,0 +1,78 @@
+"""
+measuring heap allocations per main loop iteration
+"""
+
+import gc
+
+try:
+    # CircuitPython: bytes currently allocated on the heap. The garbage stays
+    # allocated until the next collection, so the difference between two points
+    # is the number of bytes allocated in between.
+    from gc import mem_alloc  # pylint: disable=no-name-in-module
+except ImportError:
+    mem_alloc = None  # pylint: disable=invalid-name
+
+
+class AllocMeter:
+    """
+    Measures bytes allocated between the calls of lap().
+
+    On CircuitPython this uses the gc.mem_alloc() deltas. If garbage collection
+    happened in between, the delta is not valid and the lap is not counted.
+
+    On CPython the memory is freed as soon as it is not referenced, so tracemalloc
+    (which has to be started beforehand) is used to get the peak of memory
+    allocated since the previous lap instead. This makes the result lower bound
+    of the allocated bytes, still good enough to spot the allocations.
+    """
+
+    def __init__(self):
+        self.last = None
+        self.max = 0
+        self.laps = 0
+        self._tracemalloc = None
+        if mem_alloc is None:
+            # pylint: disable=import-outside-toplevel
+            import tracemalloc
+
+            self._tracemalloc = tracemalloc
+        self._base = self._current()
+
+    def _current(self):
+        if self._tracemalloc is not None:
+            # Reset last so that the peak does not include the tuple returned.
+            current = self._tracemalloc.get_traced_memory()[0]
+            self._tracemalloc.reset_peak()
+            return current
+        return mem_alloc()
+
+    def _allocated(self):
+        if self._tracemalloc is not None:
+            return self._tracemalloc.get_traced_memory()[1] - self._base
+        return mem_alloc() - self._base
+
+    def lap(self):
+        """
+        :return: number of bytes allocated since the previous lap
+        or None if it cannot be determined
+        """
+        allocated = self._allocated()
+        if allocated < 0:
+            # Garbage collection in between.
+            allocated = None
+        else:
+            self.last = allocated
+            self.max = max(self.max, allocated)
+            self.laps += 1
+        # Release the previous base before the peak is reset.
+        self._base = None
+        self._base = self._current()
+        return allocated
+
+    def collect(self):
+        """
+        Perform garbage collection without spoiling the current lap.
+        """
+        allocated = self._allocated()
+        gc.collect()
+        self._base = self._current() - allocated
@@ -2,10 +2,11 @@
 generic binary state tracking class
 """
 
-import time
-
 import adafruit_logging as logging
 
+from clock import CLOCK
+from logutil import debug_enabled
+
 
 class BinaryState:
     """
@@ -14,15 +15,15 @@ class BinaryState:
     This in turn can lead to lose of precision over time.
     """
 
-    def __init__(
-        self,
-    ):
+    def __init__(self, clock=CLOCK):
         """
         set the initial state
+        :param clock: clock object providing monotonic_ns()
         """
+        self.clock = clock
         self.prev_state = None
         self.state_duration = 0
-        self.stamp = time.monotonic_ns()  # use _ns() to avoid losing precision
+        self.stamp = clock.monotonic_ns()  # use _ns() to avoid losing precision
 
     def update(self, cur_state) -> float:
         """
@@ -35,17 +36,18 @@ class BinaryState:
         if self.prev_state is not None:
             if self.prev_state == cur_state:
                 self.state_duration += (
-                    time.monotonic_ns() - self.stamp
+                    self.clock.monotonic_ns() - self.stamp
                 ) / 1_000_000_000
-                logger.debug(
-                    f"state '{cur_state}' preserved (for {self.state_duration} sec)"
-                )
+                if debug_enabled(logger):
+                    logger.debug(
+                        f"state '{cur_state}' preserved (for {self.state_duration} sec)"
+                    )
             else:
                 logger.debug(f"state changed {self.prev_state} -> {cur_state}")
                 self.state_duration = 0
 
         self.prev_state = cur_state
-        self.stamp = time.monotonic_ns()
+        self.stamp = self.clock.monotonic_ns()
 
         return self.state_duration
 
@@ -55,3 +57,12 @@ class BinaryState:
         """
         self.prev_state = None
         self.state_duration = 0
+
+    def restore(self, cur_state, duration):
+        """
+        Restore the state, e.g. after reset.
+        :param duration: duration of the state in seconds
+        """
+        self.prev_state = cur_state
+        self.state_duration = duration
+        self.stamp = self.clock.monotonic_ns()
@@ -4,61 +4,164 @@ module that contains the Blinker class
 
 import adafruit_logging as logging
 
-from binarystate import BinaryState
+from clock import CLOCK
 
 
-# pylint: disable=too-few-public-methods
+# pylint: disable=too-many-instance-attributes
 class Blinker:
     """
-    Encapsulates a method to blink a neopixel from within a tight loop.
+    Blinks a neopixel according to the set of active alerts.
 
-    The class is not ready to be used in multiple instances for the same neopixel.
-    Assumes that update() will be called more frequently than the value of the duration parameter.
+    Each alert is identified by its color and has a pattern, i.e. sequence of on/off
+    durations in seconds (by default on and off for the duration from the init function).
+    The alert with the highest priority wins. If time sharing is enabled,
+    the patterns of all active alerts are played one after another
+    in the order of priority.
+
+    The pixel is advanced in tick() which is cheap and should be called from within
+    a tight loop more frequently than the shortest step of the patterns.
+    The pixel is written only when its state actually changes.
 
+    The class is not ready to be used in multiple instances for the same neopixel.
     Not thread safe.
     """
 
-    def __init__(self, pixel, brightness=0.5, duration=0.5):
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    def __init__(
+        self,
+        pixel,
+        brightness=0.5,
+        duration=0.5,
+        priorities=None,
+        time_share=False,
+        clock=CLOCK,
+    ):
         """
         initialize the Blinker object
+        :param priorities: dictionary of color to priority (higher number means
+        higher priority), colors not present have priority 0
+        :param time_share: whether the concurrent alerts should take turns
         """
         self.pixel = pixel
         self.brightness = brightness
         self.duration = duration
+        self.priorities = priorities if priorities is not None else {}
+        self.time_share = time_share
+        self._clock = clock
+
+        self._alerts = {}
+        # Sequence of (color or None for off, duration in nanoseconds) tuples.
+        self._steps = ()
+        self._index = 0
+        self._deadline = 0
+        self._lit = None
+
+    @property
+    def is_blinking(self):
+        """
+        :return: whether any alert is active
+        """
+        return len(self._alerts) > 0
+
+    @property
+    def color(self):
+        """
+        :return: color of the highest priority alert or None
+        """
+        if not self._steps:
+            return None
+        return self._steps[0][0]
+
+    def set_alert(self, color, active=True, pattern=None):
+        """
+        Activate or deactivate alert. Cheap if the state of the alert does not change.
+        :param pattern: tuple of alternating on/off durations in seconds
+        :raises ValueError: if the pattern contains non-positive duration
+        """
+        if pattern is not None and min(pattern) <= 0:
+            raise ValueError(f"pattern durations have to be positive: {pattern}")
+
+        if active:
+            if color in self._alerts and self._alerts[color] == pattern:
+                return
+            self._alerts[color] = pattern
+        else:
+            if color not in self._alerts:
+                return
+            del self._alerts[color]
 
-        self._binary_state = BinaryState()
-        self._is_on = False
+        self._rebuild()
 
-        self.is_blinking = False
-        self.color = None
+    def clear(self):
+        """
+        deactivate all alerts
+        """
+        if self._alerts:
+            self._alerts.clear()
+            self._rebuild()
 
-    def set_blinking(self, is_blinking: bool, color=None):
+    def _rebuild(self):
         """
-        Let the Neo pixel be on in color and the duration specified in the init function.
+        Arbitrate the active alerts and compute the sequence of steps.
+        The sequence is restarted only if it changed.
         """
         logger = logging.getLogger(__name__)
 
-        logger.debug(f"blinking -> {is_blinking}")
-        self.is_blinking = is_blinking
-
-        if self.is_blinking:
-            self.color = color
-            duration = self._binary_state.update(self._is_on)
-            logger.debug(f"state {self._is_on} duration {duration}")
-            if duration > self.duration:
-                logger.debug(
-                    f"duration {duration} exceeded {self.duration}, switching state"
-                )
-                self._is_on = not self._is_on
-                if self._is_on:
-                    self.pixel.brightness = self.brightness
-                    self.pixel.fill(self.color)
-                else:
-                    self.pixel.brightness = 0
+        colors = sorted(
+            self._alerts, key=lambda c: self.priorities.get(c, 0), reverse=True
+        )
+        if not self.time_share:
+            colors = colors[:1]
+
+        steps = []
+        for color in colors:
+            pattern = self._alerts[color]
+            if pattern is None:
+                pattern = (self.duration, self.duration)
+            for i, duration in enumerate(pattern):
+                steps.append((color if i % 2 == 0 else None, int(duration * 1e9)))
+        steps = tuple(steps)
+
+        if steps == self._steps:
+            return
+
+        logger.debug(f"blinking sequence: {steps}")
+        self._steps = steps
+        self._index = 0
+        self._deadline = self._clock.monotonic_ns()
+        if steps:
+            self._deadline += steps[0][1]
+            self._write(steps[0][0])
+        else:
+            self._write(None)
+
+    def tick(self, now_ns=None):
+        """
+        Advance the pixel if the deadline of the current step passed.
+        :param now_ns: current monotonic time in nanoseconds, if already known
+        """
+        if not self._steps:
+            return
+
+        now = self._clock.monotonic_ns() if now_ns is None else now_ns
+        if now < self._deadline:
+            return
+
+        while self._deadline <= now:
+            self._index = (self._index + 1) % len(self._steps)
+            self._deadline += self._steps[self._index][1]
+            if self._deadline <= now - 1_000_000_000:
+                # Too late (the loop was blocked), do not try to catch up.
+                self._deadline = now + self._steps[self._index][1]
+        self._write(self._steps[self._index][0])
+
+    def _write(self, color):
+        if color == self._lit:
+            return
+
+        self._lit = color
+        if color is None:
+            self.pixel.brightness = 0
         else:
-            # If the color argument is specified, it has to match the current color.
-            if color is None or self.color == color:
-                self.pixel.brightness = 0
-                self._is_on = False
-                self.color = None
-                self._binary_state.reset()
+            self.pixel.brightness = self.brightness
+            self.pixel.fill(color)
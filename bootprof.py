@@ -0,0 +1,126 @@
+"""
+boot time instrumentation and staged startup
+"""
+
+import time
+
+import adafruit_logging as logging
+
+TIME_TO_FIRST_FRAME = "time_to_first_frame_ms"
+TIME_TO_CONNECTED = "time_to_connected_ms"
+
+
+class _Phase:
+    """
+    context manager recording duration of a boot phase
+    """
+
+    def __init__(self, profiler, name):
+        self._profiler = profiler
+        self._name = name
+        self._stamp = 0
+
+    def __enter__(self):
+        self._stamp = time.monotonic_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        duration_ms = (time.monotonic_ns() - self._stamp) // 1_000_000
+        self._profiler.phases[self._name] = duration_ms
+        logging.getLogger(__name__).info(
+            f"boot phase {self._name} took {duration_ms} ms"
+        )
+        return False
+
+
+class BootProfiler:
+    """
+    Records time spent in boot phases and milestones (time since creation
+    of the object) such as time to first frame.
+    """
+
+    def __init__(self):
+        self.start = time.monotonic_ns()
+        self.phases = {}
+        self.milestones = {}
+
+    def phase(self, name):
+        """
+        :return: context manager measuring the duration of the block as the named phase
+        """
+        return _Phase(self, name)
+
+    def mark(self, name):
+        """
+        Record a milestone, only the first occurrence counts.
+        """
+        if name in self.milestones:
+            return
+
+        elapsed_ms = (time.monotonic_ns() - self.start) // 1_000_000
+        self.milestones[name] = elapsed_ms
+        logging.getLogger(__name__).info(f"{name}: {elapsed_ms}")
+
+    def metrics(self):
+        """
+        :return: dictionary with the milestones and phase durations,
+        suitable for publishing
+        """
+        metrics = dict(self.milestones)
+        for name, duration_ms in self.phases.items():
+            metrics["boot_" + name + "_ms"] = duration_ms
+        return metrics
+
+
+class StagedStartup:
+    """
+    Runs startup stages one at a time so that the main loop can keep running
+    (e.g. to refresh the display and sample buttons) while the stages
+    that take long (such as network setup) are being performed.
+    """
+
+    def __init__(self, profiler, stages):
+        """
+        :param profiler: BootProfiler instance
+        :param stages: list of (name, function) tuples
+        """
+        self._profiler = profiler
+        self._stages = stages
+        self._index = 0
+        # Number of consecutive failures of the pending stage.
+        self.failures = 0
+
+    @property
+    def done(self):
+        """
+        :return: True if all stages were performed
+        """
+        return self._index >= len(self._stages)
+
+    @property
+    def pending(self):
+        """
+        :return: name of the stage to be performed next or None
+        """
+        if self.done:
+            return None
+        return self._stages[self._index][0]
+
+    def step(self) -> bool:
+        """
+        Perform the next stage. If it raises exception, the stage is not
+        considered performed.
+        :return: True if all stages were performed
+        """
+        if self.done:
+            return True
+
+        name, func = self._stages[self._index]
+        # Counted upfront so that the exception can pass through.
+        self.failures += 1
+        with self._profiler.phase(name):
+            func()
+        self.failures = 0
+        self._index += 1
+
+        return self.done
@@ -0,0 +1,66 @@
+"""
+clock abstraction so that the state logic can be run in simulated time
+"""
+
+import time
+
+
+# pylint: disable=too-few-public-methods
+class Clock:
+    """
+    Real time clock. The datetime property is not provided,
+    the wall clock time is obtained from NTP.
+    """
+
+    def monotonic_ns(self) -> int:
+        """
+        :return: monotonic time in nanoseconds
+        """
+        return time.monotonic_ns()
+
+
+# Shared instance used as default.
+CLOCK = Clock()
+
+
+class VirtualClock:
+    """
+    Clock that moves only when told to. Can be used in place of the NTP object
+    as it provides the datetime property.
+    """
+
+    def __init__(self, epoch=0):
+        """
+        :param epoch: wall clock time (in seconds since the Epoch) corresponding
+        to the zero monotonic time
+        """
+        self._epoch = epoch
+        self._now_ns = 0
+
+    def monotonic_ns(self) -> int:
+        """
+        :return: monotonic time in nanoseconds
+        """
+        return self._now_ns
+
+    def advance(self, seconds):
+        """
+        Move the time forward.
+        """
+        if seconds < 0:
+            raise ValueError("time cannot go backwards")
+        self._now_ns += int(seconds * 1_000_000_000)
+
+    @property
+    def datetime(self):
+        """
+        :return: the wall clock time as time.struct_time (like NTP with tz_offset applied)
+        """
+        return time.gmtime(self._epoch + self._now_ns // 1_000_000_000)
+
+    @property
+    def utc_ns(self):
+        """
+        :return: the wall clock time in nanoseconds since the Epoch (like NTP)
+        """
+        return self._epoch * 1_000_000_000 + self._now_ns
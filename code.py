@@ -2,7 +2,7 @@
 workmon main code
 """
 
-import json
+import gc
 import time
 import traceback
 
@@ -23,15 +23,100 @@ import neopixel
 import socketpool
 import supervisor
 import terminalio
+
+# pylint: disable=import-error
+import watchdog
 from adafruit_bitmap_font import bitmap_font
 from adafruit_display_text import label
 
+from allocmeter import AllocMeter
 from binarystate import BinaryState
 from blinker import Blinker
+from bootprof import TIME_TO_CONNECTED, TIME_TO_FIRST_FRAME, BootProfiler, StagedStartup
 from button import Button
-from logutil import get_log_level
-from mqtt import mqtt_client_setup, mqtt_publish_robust
-from timeutil import get_time
+from clock import Clock
+from config import Config, ConfigError
+from events import MQTT_RECONNECT, EventBus
+from fontatlas import CHARACTERS, AtlasFont, atlas_path
+from frame import Frame, TextCache
+from handlers import (
+    CO2,
+    CO2_SLOPE,
+    COLOR_PRIORITY,
+    EVENT_BUS,
+    HUM_PREFIX,
+    HUMIDITY,
+    ICON_PATH,
+    POWER,
+    TABLE_STATE_DURATION,
+    TBL_PREFIX,
+    TEMP_PREFIX,
+    TEMPERATURE,
+    TEXT_COLOR_BASE,
+    display_icon,
+    handle_distance,
+    handle_power,
+    on_message_with_config,
+    on_message_with_env_metrics,
+    on_message_with_power,
+    refresh_text,
+)
+from logutil import debug_enabled, set_log_level
+from metricserver import COUNTER, GAUGE, MetricServer
+from mqtt import (
+    CONNECT_STATS,
+    ConnectStats,
+    mqtt_client_setup,
+    mqtt_connect,
+    mqtt_publish_robust,
+    mqtt_reconnect,
+)
+from pages import (
+    BORDER,
+    CHART_PAGE,
+    CO2_SERIES,
+    DISTANCE_SERIES,
+    WEEK_PAGE,
+    Pages,
+    chart_page,
+    refresh_week,
+    week_page,
+)
+from payload import encode_message
+from plugpoll import PowerPoller
+from session import SessionTracker, WeekLog
+from snapshot import (
+    RETAINED_STATE,
+    TIME,
+    SnapshotStore,
+    WarmStart,
+    capture,
+    ignore_state_messages,
+    on_message_with_state,
+    to_message,
+)
+from stallwatch import NVM_SIZE as STALL_NVM_SIZE
+from stallwatch import (
+    STAGE_BUTTONS,
+    STAGE_DISPLAY,
+    STAGE_DISTANCE,
+    STAGE_LOOP,
+    STAGE_METRICS,
+    STAGE_MQTT,
+    STAGE_NTP,
+    STAGE_PLUG,
+    STAGE_SNAPSHOT,
+    STAGES,
+    StallWatch,
+)
+from timeutil import HourCache
+from tracelog import MQTTTraceSink, TraceRecorder
+
+# Seconds to wait before retrying failed startup stage.
+STARTUP_RETRY_INTERVAL = 5
+# Consecutive failures of startup stage after which the error is left
+# to the top level exception handler (e.g. hard reset for ConnectionError).
+STARTUP_MAX_FAILURES = 5
 
 # For storing import exceptions so that they can be raised from main().
 IMPORT_EXCEPTION = None  # pylint: disable=invalid-name
@@ -48,212 +133,121 @@ except ImportError:
     print("WiFi credentials are kept in secrets.py, please add them there!")
     raise
 
-# First set some parameters used for shapes and text
-BORDER = 5
-TEXT_COLOR_BASE = 0xFFFF00
-TEXT_COLOR_ALERT = 0xFF0000
-
-BROKER_PORT = "broker_port"
-LOG_TOPIC = "log_topic"
-MQTT_TOPIC = "mqtt_topic"
-MQTT_TOPIC_ENV = "mqtt_topic_env"
-MQTT_TOPIC_POWER = "mqtt_topic_power"
-BROKER = "broker"
-PASSWORD = "password"
-SSID = "SSID"
-LOG_LEVEL = "log_level"
-ICON_PATHS = "icon_paths"
-POWER_THRESH = "power_threshold_watts"
-BREAK_THRESH = "break_threshold_seconds"
-LAST_UPDATE_THRESH = "last_update_threshold"
-CO2_THRESH = "co2_threshold"
-TABLE_STATE_DUR_THRESH = "table_state_dur_threshold"
-FONT_FILE_NAME = "font_file_name"
-NTP_SERVER = "ntp_server"
-TZ_OFFSET = "tz_offset"
-
-MANDATORY_SECRETS = [
-    BROKER,
-    BROKER_PORT,
-    MQTT_TOPIC,
-    MQTT_TOPIC_POWER,
-    MQTT_TOPIC_ENV,
-    PASSWORD,
-    SSID,
-    ICON_PATHS,
-    POWER_THRESH,
-    LAST_UPDATE_THRESH,
-    CO2_THRESH,
-    TABLE_STATE_DUR_THRESH,
-    FONT_FILE_NAME,
-    BREAK_THRESH,
-]
-
-CO2 = "co2"
-TEMPERATURE = "temp"
-HUMIDITY = "humidity"
-POWER = "power"
-LAST_UPDATE = "time"
-TABLE_STATE_DURATION = "table_state_duration"
-
-TEMP_PREFIX = "Temp: "
-HUM_PREFIX = "Hum: "
-TBL_PREFIX = "Tbl: "
-
-RED = (255, 0, 0)  # CO2 alert
-GREEN = (0, 255, 0)  # break alert
-BLUE = (0, 0, 255)  # table alert
-
-# Higher number means higher priority.
-COLOR_PRIORITY = {RED: 30, GREEN: 20, BLUE: 10}
-
-
-def on_message_with_env_metrics(mqtt, topic, msg):
-    """
-    handle messages with environment sensor metrics
-    """
-    logger = logging.getLogger(__name__)
-
-    logger.debug(f"got MQTT message on {topic}: {msg}")
-    try:
-        metrics = json.loads(msg)
-        mqtt.user_data[CO2] = metrics.get("co2_ppm")
-        mqtt.user_data[TEMPERATURE] = metrics.get("temperature")
-        mqtt.user_data[HUMIDITY] = metrics.get("humidity")
-        mqtt.user_data[LAST_UPDATE] = time.monotonic_ns()
-    except json.decoder.JSONDecodeError as json_error:
-        logger.error(f"failed to parse {msg}: {json_error}")
+# Created upfront so that the stall can be recorded from the top level exception handler.
+STALL_WATCH = StallWatch(microcontroller.nvm)  # pylint: disable=no-member
+# The snapshot is kept in the NVM right after the stall record.
+SNAPSHOT = SnapshotStore(
+    microcontroller.nvm, STALL_NVM_SIZE  # pylint: disable=no-member
+)
 
 
-# pylint: disable=unused-argument
-def on_message_with_power(mqtt, topic, msg):
+def save_snapshot():
     """
-    handle messages with environment sensor metrics
+    Save the live state before reset so that it can be restored after that.
     """
-    logger = logging.getLogger(__name__)
-
-    logger.debug(f"got MQTT message on {topic}: {msg}")
     try:
-        metrics = json.loads(msg)
-        mqtt.user_data[POWER] = metrics.get("current_power")
-    except json.decoder.JSONDecodeError as json_error:
-        logger.error(f"failed to parse {msg}: {json_error}")
+        SNAPSHOT.save()
+    except Exception as e:  # pylint: disable=broad-except
+        print(f"Failed to save snapshot: {e}")
 
 
-def has_priority(color_current, color_new):
+def hard_reset(exception):
     """
-    Check whether new color has precedence over the current color.
+    Sometimes soft reset is not enough. Perform hard reset.
     """
-    if color_current == color_new:
-        return True
-
-    return COLOR_PRIORITY.get(color_new) > COLOR_PRIORITY.get(color_current)
+    print(f"Got exception: {exception}")
+    STALL_WATCH.stop()
+    save_snapshot()
+    reset_time = 15
+    print(f"Performing hard reset in {reset_time} seconds")
+    time.sleep(reset_time)
+    microcontroller.reset()  # pylint: disable=no-member
 
 
-def can_blink(blinker, color):
-    """
-    Check whether the blinker can blink with given color based on its state
-    and color priority.
+def traced(callback, recorder):
     """
-    if not blinker.is_blinking:
-        return True
-
-    return has_priority(blinker.color, color)
-
-
-# pylint: disable=too-many-locals,too-many-branches,too-many-arguments,too-many-positional-arguments
-def refresh_text(
-    co2_value_area,
-    temp_area,
-    hum_area,
-    tbl_area,
-    user_data,
-    last_update_threshold,
-    co2_threshold,
-    blinker,
-):
-    """
-    change the contents of the text label used to draw on the display
+    :return: MQTT message callback that records the message before handling it
     """
 
-    logger = logging.getLogger(__name__)
+    def wrapper(client, topic, msg):
+        recorder.record_message(topic, msg)
+        callback(client, topic, msg)
 
-    # Multiply in order to preserve precision over time ?
-    # (time.monotonic() is float so not a good fit for long-running programs)
-    if user_data.get(LAST_UPDATE) is None or (
-        time.monotonic_ns() - user_data.get(LAST_UPDATE)
-        > last_update_threshold * 1_000_000_000
-    ):
-        logger.warning(f"last update was before {last_update_threshold} seconds")
-        user_data[CO2] = None
-        user_data[TEMPERATURE] = None
-        user_data[HUMIDITY] = None
-
-    co2_value = user_data.get(CO2)
-    if co2_value:
-        co2_value_area.text = f"{co2_value} ppm"
-        # Draw with different color when above certain threshold.
-        if int(co2_value) > co2_threshold:
-            logger.debug(f"CO2 above threshold ({co2_value} > {co2_threshold})")
-            co2_value_area.color = TEXT_COLOR_ALERT
-            if can_blink(blinker, RED):
-                blinker.set_blinking(True, color=RED)
-        else:
-            co2_value_area.color = TEXT_COLOR_BASE
-            blinker.set_blinking(False, color=RED)
-    else:
-        co2_value_area.text = "N/A"
-
-    prefix = TEMP_PREFIX
-    temp = user_data.get(TEMPERATURE)
-    if temp:
-        temp_text = prefix + f"{temp}°C"
-    else:
-        temp_text = prefix + "N/A"
-    temp_area.text = temp_text
+    return wrapper
 
-    prefix = HUM_PREFIX
-    val = user_data.get(HUMIDITY)
-    if val:
-        hum_text = prefix + f"{val}%"
-    else:
-        hum_text = prefix + "N/A"
-    hum_area.text = hum_text
-
-    prefix = TBL_PREFIX
-    val = user_data.get(TABLE_STATE_DURATION)
-    if val:
-        hours = val // 3600
-        minutes = (val % 3600) // 60
-        if hours > 24:
-            time_val = f"{hours // 24} days"
-        else:
-            time_val = f"{hours:02}:{minutes:02}"
-        table_text = prefix + f"{time_val}"
-    else:
-        table_text = prefix + "N/A"
-    tbl_area.text = table_text
 
-
-def hard_reset(exception):
+def metric_server_setup(pool, config, user_data, stats, clock):
     """
-    Sometimes soft reset is not enough. Perform hard reset.
+    :param stats: dictionary with the values maintained by the main loop
+    :return: MetricServer instance serving the current values
     """
-    print(f"Got exception: {exception}")
-    reset_time = 15
-    print(f"Performing hard reset in {reset_time} seconds")
-    time.sleep(reset_time)
-    microcontroller.reset()  # pylint: disable=no-member
+    start = clock.monotonic_ns()
+    plug_metrics = []
+    if stats["plug"]:
+        plug_metrics = [
+            ("workmon_plug_polls_total", COUNTER, lambda: stats["plug"].polls),
+            (
+                "workmon_plug_poll_failures_total",
+                COUNTER,
+                lambda: stats["plug"].failures,
+            ),
+            ("workmon_plug_poll_ms", GAUGE, lambda: stats["plug"].last_ms),
+            ("workmon_plug_poll_max_ms", GAUGE, lambda: stats["plug"].max_ms),
+        ]
+    return MetricServer(
+        pool,
+        [
+            ("workmon_distance_cm", GAUGE, lambda: stats["distance"]),
+            ("workmon_table_up", GAUGE, lambda: stats["table_up"]),
+            (
+                "workmon_table_state_duration_seconds",
+                GAUGE,
+                lambda: user_data.get(TABLE_STATE_DURATION),
+            ),
+            ("workmon_power_watts", GAUGE, lambda: user_data.get(POWER)),
+            ("workmon_co2_ppm", GAUGE, lambda: user_data.get(CO2)),
+            (
+                "workmon_co2_slope_ppm_per_minute",
+                GAUGE,
+                lambda: user_data.get(CO2_SLOPE),
+            ),
+            ("workmon_temperature_celsius", GAUGE, lambda: user_data.get(TEMPERATURE)),
+            ("workmon_humidity_percent", GAUGE, lambda: user_data.get(HUMIDITY)),
+            ("workmon_loop_iterations_total", COUNTER, lambda: stats["loops"]),
+            ("workmon_loop_alloc_bytes", GAUGE, lambda: stats["alloc"].last),
+            ("workmon_loop_alloc_max_bytes", GAUGE, lambda: stats["alloc"].max),
+            ("workmon_mqtt_connects_total", COUNTER, lambda: stats["connect"].connects),
+            (
+                "workmon_mqtt_connect_failures_total",
+                COUNTER,
+                lambda: stats["connect"].failures,
+            ),
+            ("workmon_mqtt_connect_ms", GAUGE, lambda: stats["connect"].last_ms),
+            ("workmon_mqtt_connect_max_ms", GAUGE, lambda: stats["connect"].max_ms),
+            # pylint: disable=no-member
+            ("workmon_heap_free_bytes", GAUGE, gc.mem_free),
+            (
+                "workmon_uptime_seconds",
+                GAUGE,
+                lambda: (clock.monotonic_ns() - start) // 1_000_000_000,
+            ),
+        ]
+        + plug_metrics,
+        port=config.metrics_port,
+        clock=clock,
+    )
 
 
-def mqtt_setup(pool, user_data, mqtt_log_level, socket_timeout):
+# pylint: disable=too-many-arguments,too-many-positional-arguments
+def mqtt_setup(pool, user_data, config, mqtt_log_level, socket_timeout, recorder=None):
     """
     connect to MQTT server, subscribe to the topics and setup callbacks
+    :param recorder: optional TraceRecorder to record the received messages
     """
     logger = logging.getLogger(__name__)
 
-    broker_addr = secrets[BROKER]
-    broker_port = secrets[BROKER_PORT]
+    broker_addr = config.broker
+    broker_port = config.broker_port
     mqtt_client = mqtt_client_setup(
         pool,
         broker_addr,
@@ -261,40 +255,75 @@ def mqtt_setup(pool, user_data, mqtt_log_level, socket_timeout):
         mqtt_log_level,
         user_data=user_data,
         socket_timeout=socket_timeout,
+        # Receive the payloads as bytes so that these can be scanned without decoding.
+        use_binary_mode=True,
+        transport=config.mqtt_transport,
+        ca_file=config.mqtt_ca_file,
+        keep_alive=config.mqtt_keep_alive,
     )
-    logger.info(f"Connecting to MQTT broker {broker_addr}:{broker_port}")
-    mqtt_client.connect()
-    topic = secrets[MQTT_TOPIC_ENV]
-    mqtt_client.add_topic_callback(topic, on_message_with_env_metrics)
-    logger.info(f"subscribing to {topic}")
-    mqtt_client.subscribe(topic)
-    topic = secrets[MQTT_TOPIC_POWER]
-    mqtt_client.add_topic_callback(topic, on_message_with_power)
-    logger.info(f"subscribing to {topic}")
-    mqtt_client.subscribe(topic)
+    logger.info(
+        f"Connecting to MQTT broker {broker_addr}:{broker_port} ({config.mqtt_transport})"
+    )
+    mqtt_connect(mqtt_client)
+    for topic, callback in [
+        (config.mqtt_topic_env, on_message_with_env_metrics),
+        (config.mqtt_topic_power, on_message_with_power),
+    ]:
+        if recorder:
+            callback = traced(callback, recorder)
+        mqtt_client.add_topic_callback(topic, callback)
+        logger.info(f"subscribing to {topic}")
+        mqtt_client.subscribe(topic)
+    topic = config.mqtt_topic_config
+    if topic:
+        # The configuration is expected to be published as retained message
+        # so it will be received right after subscribing.
+        mqtt_client.add_topic_callback(
+            topic,
+            lambda client, topic, msg: on_message_with_config(
+                client, topic, msg, config
+            ),
+        )
+        logger.info(f"subscribing to {topic}")
+        mqtt_client.subscribe(topic)
+    topic = config.mqtt_topic_state
+    if topic:
+        # The last snapshot is published as retained message so it will be received
+        # right after subscribing, possibly restoring the state after power loss.
+        mqtt_client.add_topic_callback(topic, on_message_with_state)
+        logger.info(f"subscribing to {topic}")
+        mqtt_client.subscribe(topic)
     return mqtt_client
 
 
 def get_font(file_name):
     """
-    Try to load a bitmap font. If not successful, fall back to terminal font.
+    Try to load glyph atlas generated for the font or the bitmap font itself.
+    If not successful, fall back to terminal font.
     Return font and font and border scale factor.
     """
 
     logger = logging.getLogger(__name__)
 
+    font_scale = 1
+    border_scale = 2
+
+    # The atlas is much faster to load than the bitmap font.
+    try:
+        return AtlasFont(atlas_path(file_name)), font_scale, border_scale
+    except (OSError, ValueError) as exception:
+        logger.info(f"Cannot load glyph atlas, will use the bitmap font: {exception}")
+
     font = terminalio.FONT
     try:
-        font_scale = 1
-        border_scale = 2
         font_file = file_name
         logger.debug(f"loading font from {font_file}")
         font = bitmap_font.load_font(font_file)
-        font.load_glyphs(
-            # pylint: disable=line-too-long
-            code_points="ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz1234567890- ().,:!?/\\%+@~"
-        )
-        font.load_glyphs("°³µ₂")  # preload glyphs for fast printing
+        font.load_glyphs(CHARACTERS)  # preload glyphs for fast printing
+    except watchdog.WatchDogTimeout:
+        # The stall has to reach the top level handler to be recorded.
+        raise
+    # The font library can raise pretty much anything for malformed font.
     # pylint: disable=broad-exception-caught
     except Exception as exception:
         border_scale = 1
@@ -304,7 +333,7 @@ def get_font(file_name):
     return font, font_scale, border_scale
 
 
-# pylint: disable=too-many-locals,too-many-statements
+# pylint: disable=too-many-locals,too-many-statements,too-many-branches
 def main():
     """
     setup and main loop
@@ -312,63 +341,51 @@ def main():
     if IMPORT_EXCEPTION:
         raise IMPORT_EXCEPTION
 
+    profiler = BootProfiler()
+    clock = Clock()
+
     logger = logging.getLogger(__name__)
 
-    # Check all mandatory secrets are present.
-    for secret in MANDATORY_SECRETS:
-        if secrets.get(secret) is None:
-            logger.error(f"secret {secret} is missing")
-            return
+    # Check all mandatory secrets are present and valid.
+    try:
+        config = Config(secrets)
+    except ConfigError as config_error:
+        logger.error(f"invalid configuration: {config_error}")
+        return
 
-    log_level = get_log_level(secrets[LOG_LEVEL])
     logger = logging.getLogger(__name__)
-    logger.setLevel(log_level)
+    set_log_level(config.log_level)
+
+    # Retrieve the stall recorded before the last reset (if any) to be published later.
+    stall = STALL_WATCH.load_stall()
+    if config.watchdog_timeout:
+        STALL_WATCH.start(
+            microcontroller.watchdog,  # pylint: disable=no-member
+            config.watchdog_timeout,
+            watchdog.WatchDogMode.RAISE,
+        )
 
     # pylint: disable=no-member
     pixel = neopixel.NeoPixel(board.NEOPIXEL, 1)
-    blinker = Blinker(pixel)
+    blinker = Blinker(pixel, priorities=COLOR_PRIORITY, clock=clock)
 
     logger.info("Running")
 
-    logger.debug(f"MAC address: {wifi.radio.mac_address}")
-
-    # Connect to Wi-Fi
-    logger.info("Connecting to wifi")
-    wifi.radio.connect(secrets[SSID], secrets[PASSWORD], timeout=10)
-    logger.info(f"Connected to {secrets[SSID]}")
-    logger.debug(f"IP: {wifi.radio.ipv4_address}")
-
-    # Create a socket pool
-    pool = socketpool.SocketPool(wifi.radio)  # pylint: disable=no-member
-
-    user_data = {}
-    # The timeout has to be so low for the main loop to record button presses.
-    mqtt_loop_timeout = 0.01
-    # pylint: disable=no-member
-    mqtt_client = mqtt_setup(pool, user_data, logging.ERROR, mqtt_loop_timeout)
-    mqtt_topic = secrets.get(MQTT_TOPIC)
-
-    logger.debug("setting NTP up")
-    # The code is supposed to be running in specific time zone
-    # with NTP server running on the default router.
-    # Use minimum socket timeout (its type is int) to allow for tight loop.
-    ntp_server = secrets.get(NTP_SERVER)
-    if ntp_server is None:
-        ntp_server = str(wifi.radio.ipv4_gateway)
-    tz_offset = secrets.get(TZ_OFFSET)
-    if tz_offset is None:
-        tz_offset = 1
-    ntp = adafruit_ntp.NTP(
-        pool, server=ntp_server, tz_offset=tz_offset, socket_timeout=1
-    )
-
-    logger.debug("setting up US100")
-    uart = busio.UART(board.TX, board.RX, baudrate=9600)
-    us100 = adafruit_us100.US100(uart)
+    #
+    # The display and local sensors are set up first so that the display
+    # shows something while the network setup (which takes long) is performed
+    # in stages from within the main loop.
+    #
+    with profiler.phase("sensors"):
+        logger.debug("setting up US100")
+        uart = busio.UART(board.TX, board.RX, baudrate=9600)
+        us100 = adafruit_us100.US100(uart)
 
     # pylint: disable=no-member
     display = board.DISPLAY
     logger.debug(f"display resolution: w: {display.width} h: {display.height}")
+    # The display is refreshed explicitly (at most once per frame) once the changes are done.
+    frame = Frame(display, config.display_fps, clock)
 
     logger.debug("setting display elements")
     grp = displayio.Group()
@@ -379,11 +396,12 @@ def main():
 
     # The images should have transparent background, however that does not seem
     # to work with BMPs, so display the icon first so that the text can be displayed on the top.
-    image_tile_grid = display_icon(display, None, secrets.get(ICON_PATHS)[0])
+    image_tile_grid = display_icon(display, None, config.icon_paths[0])
     if image_tile_grid:
         splash.append(image_tile_grid)
 
-    font, font_scale, border_scale = get_font(secrets.get(FONT_FILE_NAME))
+    with profiler.phase("font"):
+        font, font_scale, border_scale = get_font(config.font_file_name)
 
     # Subgroup for text scaling can be created only once a font is determined,
     # because scaling depends on the chosen font.
@@ -434,12 +452,23 @@ def main():
     tbl_area.anchored_position = (BORDER, BORDER * border_scale + y_offset)
     text_group.append(tbl_area)
 
-    start_hr = secrets.get("start_hr")
-    end_hr = secrets.get("end_hr")
-
-    distance_threshold = secrets.get("distance_threshold")
-    table_state = BinaryState()
-    power_state = BinaryState()
+    # The other pages are built upfront as well so that switching is instant.
+    week_group, week_labels = week_page(terminalio.FONT, 2, TEXT_COLOR_BASE)
+    grp.append(week_group)
+    chart_group, sparkline = chart_page(
+        terminalio.FONT, display.width, display.height, TEXT_COLOR_BASE
+    )
+    grp.append(chart_group)
+    pages = Pages([splash, week_group, chart_group])
+    week_log = WeekLog(clock)
+    week_cache = TextCache()
+    # The chart spans the last hour.
+    chart_interval_ns = 3600 * 1_000_000_000 // sparkline.width
+    chart_deadline = 0
+    frame.invalidate()
+
+    table_state = BinaryState(clock)
+    session = SessionTracker(clock)
 
     logger.info("Setting up buttons")
     buttons = []
@@ -452,18 +481,180 @@ def main():
         button = Button(pin, pull)
         buttons.append(button)
     button_pressed_stamp = 0
-    display_update_stamp = time.monotonic_ns() // 1_000_000_000 - 1
+    display_update_stamp = clock.monotonic_ns() // 1_000_000_000 - 1
 
-    distance_stamp = 0
+    user_data = {}
+    event_bus = EventBus(clock)
+    user_data[EVENT_BUS] = event_bus
+    connect_stats = ConnectStats(clock)
+    user_data[CONNECT_STATS] = connect_stats
+    if image_tile_grid:
+        user_data[ICON_PATH] = config.icon_paths[0]
+    # The timeout has to be so low for the main loop to record button presses.
+    mqtt_loop_timeout = 0.01
+    mqtt_client = None
+    mqtt_topic = config.mqtt_topic
+    network = {}
+
+    power_poller = None
+    if config.power_plug_url:
+        # Polls the plug directly, in addition to the power received via MQTT.
+        # The socket pool is set once the network is up.
+        power_poller = PowerPoller(
+            None,
+            config.power_plug_url,
+            config.power_plug_key,
+            interval=config.power_poll_interval,
+            clock=clock,
+        )
+
+    recorder = None
+    trace_sink = None
+    if config.trace_file:
+        # Requires the filesystem to be writable from the code (see boot.py).
+        # Appended to so that the trace leading to reset is kept.
+        # pylint: disable=consider-using-with
+        recorder = TraceRecorder(open(config.trace_file, "ab"), clock)
+    elif config.mqtt_topic_trace:
+        trace_sink = MQTTTraceSink(None, config.mqtt_topic_trace)
+        recorder = TraceRecorder(trace_sink, clock)
+
+    def connect_wifi():
+        logger.debug(f"MAC address: {wifi.radio.mac_address}")
+        logger.info("Connecting to wifi")
+        wifi.radio.connect(config.ssid, config.password, timeout=10)
+        logger.info(f"Connected to {config.ssid}")
+        logger.debug(f"IP: {wifi.radio.ipv4_address}")
+
+    def connect_mqtt():
+        # Create a socket pool
+        network["pool"] = socketpool.SocketPool(wifi.radio)
+        network["mqtt_client"] = mqtt_setup(
+            network["pool"],
+            user_data,
+            config,
+            logging.ERROR,
+            mqtt_loop_timeout,
+            recorder=recorder,
+        )
+        if trace_sink:
+            trace_sink.mqtt_client = network["mqtt_client"]
+        if power_poller:
+            power_poller.pool = network["pool"]
+
+    def setup_ntp():
+        logger.debug("setting NTP up")
+        # The code is supposed to be running in specific time zone
+        # with NTP server running on the default router.
+        # Use minimum socket timeout (its type is int) to allow for tight loop.
+        ntp_server = config.ntp_server
+        if ntp_server is None:
+            ntp_server = str(wifi.radio.ipv4_gateway)
+        network["ntp"] = adafruit_ntp.NTP(
+            network["pool"],
+            server=ntp_server,
+            tz_offset=config.tz_offset,
+            socket_timeout=1,
+        )
+
+    # Measures allocations per loop iteration, should be zero most of the time.
+    alloc_meter = AllocMeter()
+    stats = {
+        "loops": 0,
+        "distance": None,
+        "table_up": None,
+        "alloc": alloc_meter,
+        "connect": connect_stats,
+        "plug": power_poller,
+    }
+    # Until the time is known, assume working hours.
+    hours = HourCache(config.start_hr, clock=clock)
+    # Preallocated so that the buttons can be sampled without allocations.
+    button_values = [False] * len(buttons)
+
+    def wall_time():
+        if hours.ntp is None:
+            return 0
+        return hours.ntp.utc_ns // 1_000_000_000
+
+    SNAPSHOT.source = lambda: capture(
+        table_state, session, user_data, wall_time(), clock
+    )
+    warm_start = WarmStart(table_state, session, user_data, clock)
+    saved_state = SNAPSHOT.load()
+    # pylint: disable=no-member
+    if microcontroller.cpu.reset_reason in (
+        microcontroller.ResetReason.POWER_ON,
+        microcontroller.ResetReason.BROWNOUT,
+    ):
+        # The device might have been off for a long time,
+        # so the snapshot can be restored only once the time is known.
+        logger.debug("power on, deferring the warm start")
+    else:
+        # Reset or reload takes few seconds, assume no time has passed.
+        warm_start.offer(saved_state)
+        saved_state = None
+    snapshot_stamp = clock.monotonic_ns() // 1_000_000_000
+
+    def setup_metric_server():
+        network["metric_server"] = metric_server_setup(
+            network["pool"], config, user_data, stats, clock
+        )
+
+    stages = [("wifi", connect_wifi), ("mqtt", connect_mqtt), ("ntp", setup_ntp)]
+    if config.metrics_port:
+        stages.append(("metrics", setup_metric_server))
+    startup = StagedStartup(profiler, stages)
+    startup_stamp = 0
+    metric_server = None
+
+    distance_deadline = 0
+    # tools/simulator.py mirrors the input handling below for the tests, keep it in sync.
     logger.debug("entering main loop")
     table_state_val = None
     while True:
+        # Read once per iteration and passed around, as the big numbers are allocated
+        # on the heap. The periodic actions are compared with their deadlines
+        # so that no new big numbers are computed until they are due.
+        now_ns = clock.monotonic_ns()
+        now_s = now_ns // 1_000_000_000
+        STALL_WATCH.enter(STAGE_LOOP, now_ns)
+        stats["loops"] += 1
+        alloc_meter.lap()
+        blinker.tick(now_ns)
+        if metric_server:
+            STALL_WATCH.enter(STAGE_METRICS, now_ns)
+            metric_server.poll()
+
+        if power_poller:
+            STALL_WATCH.enter(STAGE_PLUG, now_ns)
+            power_poller.poll(user_data, now_ns)
+
+        STALL_WATCH.enter(STAGE_BUTTONS, now_ns)
         for b in buttons:
             b.update()
-        button_values = [b.pressed for b in buttons]
+        for i, b in enumerate(buttons):
+            button_values[i] = b.pressed
         if True in button_values:
-            logger.debug(f"button pressed: {button_values}")
-            button_pressed_stamp = time.monotonic_ns() // 1_000_000_000
+            if debug_enabled(logger):
+                logger.debug(f"button pressed: {button_values}")
+            if recorder:
+                for i, pressed in enumerate(button_values):
+                    if pressed:
+                        recorder.record_button(i)
+            # Each button selects a page.
+            if pages.show(button_values.index(True)):
+                frame.invalidate()
+            button_pressed_stamp = now_s
+
+        if chart_deadline <= now_ns:
+            STALL_WATCH.enter(STAGE_DISPLAY, now_ns)
+            sparkline.set(CO2_SERIES, user_data.get(CO2))
+            sparkline.set(DISTANCE_SERIES, stats["distance"])
+            sparkline.advance()
+            if pages.current == CHART_PAGE:
+                frame.invalidate()
+            chart_deadline = now_ns + chart_interval_ns
 
         #
         # Getting distance from us100 makes the code sleep for up to 2 * 2 * 0.1 seconds,
@@ -472,244 +663,177 @@ def main():
         # Therefore, get the distance only every 10 seconds,
         # to increase the probability of getting the button presses.
         #
-        if distance_stamp < time.monotonic_ns() - 10 * 1_000_000_000:
-            logger.debug("getting distance value")
+        if distance_deadline <= now_ns:
+            STALL_WATCH.enter(STAGE_DISTANCE, now_ns)
             distance = us100.distance
-            logger.debug(f"got distance value: {distance}")
+            if debug_enabled(logger):
+                logger.debug(f"got distance value: {distance}")
+            if recorder:
+                recorder.record_distance(distance)
+                recorder.flush()
             table_state_val = handle_distance(
-                distance, distance_threshold, mqtt_client, mqtt_topic
+                distance, config, mqtt_client, mqtt_topic, user_data
             )
-            distance_stamp = time.monotonic_ns()
+            distance_deadline = clock.monotonic_ns() + 10 * 1_000_000_000
+            stats["distance"] = distance
+            stats["table_up"] = 1 if table_state_val == "up" else 0
+
+            # The loop was blocked anyway, so this is good time to collect
+            # the garbage (e.g. the published message) in a predictable way.
+            alloc_meter.collect()
 
         #
         # Leave the display on during certain hours unless a button is pressed.
         # Then leave it on for a minute.
         #
-        cur_hr, _ = get_time(ntp)
+        STALL_WATCH.enter(STAGE_NTP, now_ns)
+        cur_hr = hours.update(now_ns)
         if (
-            start_hr <= cur_hr < end_hr
-            or button_pressed_stamp >= time.monotonic_ns() // 1_000_000_000 - 60
+            config.start_hr <= cur_hr < config.end_hr
+            or button_pressed_stamp >= now_s - 60
         ):
             #
             # Update the display/blinker only once a second to increase the probability
             # of capturing button presses.
             #
-            if display_update_stamp <= time.monotonic_ns() // 1_000_000_000 - 1:
+            if display_update_stamp <= now_s - 1:
+                STALL_WATCH.enter(STAGE_DISPLAY, now_ns)
                 display.brightness = 1
-                refresh_text(
+                if refresh_text(
                     co2_value_area,
                     temp_area,
                     hum_area,
                     tbl_area,
                     user_data,
-                    secrets.get(LAST_UPDATE_THRESH),
-                    secrets.get(CO2_THRESH),
+                    config,
                     blinker,
-                )
-                logger.debug(f"user data = {user_data}")
+                    clock,
+                ):
+                    frame.invalidate()
+                if debug_enabled(logger):
+                    logger.debug(f"user data = {user_data}")
 
-                handle_power(
+                if handle_power(
                     blinker,
                     display,
                     image_tile_grid,
                     table_state,
                     table_state_val,
-                    power_state,
+                    session,
                     user_data,
-                    mqtt_client,
-                    mqtt_topic,
-                )
+                    config,
+                ):
+                    frame.invalidate()
+
+                week_log.update(session.in_session, hours.weekday)
+                if pages.current == WEEK_PAGE and refresh_week(
+                    week_labels, week_log, week_cache
+                ):
+                    frame.invalidate()
 
-                display_update_stamp = time.monotonic_ns() // 1_000_000_000
+                display_update_stamp = now_s
         else:
-            logger.debug("outside of working hours, setting the display off")
+            if debug_enabled(logger):
+                logger.debug("outside of working hours, setting the display off")
             display.brightness = 0
+            week_log.update(False, hours.weekday)
 
             # Deals with start of work in the morning.
             table_state.reset()
             user_data[TABLE_STATE_DURATION] = None
 
-            blinker.set_blinking(False)
+            blinker.clear()
+
+        # The retained state arrives some time after subscribing.
+        if hours.ntp is not None and RETAINED_STATE in user_data:
+            if warm_start.offer(user_data.pop(RETAINED_STATE), wall_time()):
+                frame.invalidate()
+
+        # The NVM is backed by flash memory, so the snapshots are taken sparingly.
+        if snapshot_stamp <= now_s - config.snapshot_interval:
+            STALL_WATCH.enter(STAGE_SNAPSHOT, now_ns)
+            state = SNAPSHOT.save()
+            # The snapshot without time cannot be restored after power on.
+            if mqtt_client and config.mqtt_topic_state and state[TIME]:
+                # Whatever arrives from now on might be the echo of this snapshot.
+                ignore_state_messages(user_data)
+                mqtt_publish_robust(
+                    mqtt_client, config.mqtt_topic_state, to_message(state), retain=True
+                )
+            snapshot_stamp = now_s
+
+        # All the changes of this iteration are drawn at once.
+        STALL_WATCH.enter(STAGE_DISPLAY, now_ns)
+        if frame.refresh(now_ns):
+            profiler.mark(TIME_TO_FIRST_FRAME)
 
+        #
+        # The network is set up one stage per iteration, after the frame was drawn,
+        # so that the display shows something while the stages are performed.
+        # Failed stage is retried later on, up to STARTUP_MAX_FAILURES times.
+        #
+        if not startup.done and startup_stamp <= now_s:
+            stage = startup.pending
+            STALL_WATCH.enter(STAGES.index(stage), now_ns)
+            try:
+                startup_done = startup.step()
+            except (OSError, MQTT.MMQTTException) as startup_error:
+                logger.error(f"startup stage {stage} failed: {startup_error}")
+                if startup.failures >= STARTUP_MAX_FAILURES:
+                    raise
+                startup_done = False
+                startup_stamp = now_s + STARTUP_RETRY_INTERVAL
+            if startup_done:
+                profiler.mark(TIME_TO_CONNECTED)
+                mqtt_client = network["mqtt_client"]
+                hours.ntp = network["ntp"]
+                metric_server = network.get("metric_server")
+                mqtt_publish_robust(
+                    mqtt_client,
+                    mqtt_topic,
+                    encode_message(profiler.metrics(), config.publish_encoding),
+                )
+                if stall:
+                    mqtt_publish_robust(
+                        mqtt_client,
+                        mqtt_topic,
+                        encode_message(stall, config.publish_encoding),
+                    )
+                if warm_start.offer(saved_state, wall_time()):
+                    frame.invalidate()
+                saved_state = None
+
+        if mqtt_client is None:
+            continue
+
+        STALL_WATCH.enter(STAGE_MQTT, now_ns)
+        event_bus.publish(
+            mqtt_client,
+            config.mqtt_topic_annotation,
+            config.event_window_seconds,
+            config.publish_encoding,
+        )
         try:
             mqtt_client.loop(mqtt_loop_timeout)
         except OSError as os_error:
             logger.error(f"OS error during MQTT loop: {os_error}")
-            mqtt_client.reconnect()
+            event_bus.emit(MQTT_RECONNECT)
+            mqtt_reconnect(mqtt_client)
         except MQTT.MMQTTException as mqtt_exception:
             logger.error(f"MQTT error: {mqtt_exception}")
-            mqtt_client.reconnect()
+            event_bus.emit(MQTT_RECONNECT)
+            mqtt_reconnect(mqtt_client)
             mqtt_client.loop(mqtt_loop_timeout)
 
 
-# pylint: disable=too-many-arguments,too-many-positional-arguments
-def handle_power(
-    blinker,
-    display,
-    image_tile_grid,
-    table_state,
-    table_state_val,
-    power_state,
-    user_data,
-    mqtt_client,
-    topic,
-):
-    """
-    If power is on, handle the table state.
-    """
-
-    logger = logging.getLogger(__name__)
-
-    power = user_data.get(POWER)
-    if power is None:
-        logger.debug("power N/A")
-        return
-
-    if power > secrets.get(POWER_THRESH):
-        logger.debug("power on")
-
-        power_duration = power_state.update("on")
-        logger.debug(f"power has been on for {power_duration} seconds")
-        if power_duration > secrets.get(BREAK_THRESH):
-            blinker.set_blinking(True, GREEN)
-
-        # pylint: disable=too-many-function-args
-        handle_table_state(
-            blinker,
-            display,
-            image_tile_grid,
-            table_state,
-            table_state_val,
-            user_data,
-            mqtt_client,
-            topic,
-        )
-    else:
-        logger.debug("power off")
-        # Reset the table position tracking. If the display went off,
-        # there was likely a work pause.
-        # Do not set the user_data element to keep showing the last value.
-        table_state.reset()
-        power_state.update("off")
-        blinker.set_blinking(False, GREEN)
-        blinker.set_blinking(False, BLUE)
-
-
-# pylint: disable=too-many-arguments,too-many-positional-arguments
-def handle_table_state(
-    blinker,
-    display,
-    image_tile_grid,
-    table_state,
-    table_state_val,
-    user_data,
-    mqtt_client,
-    mqtt_topic,
-):
-    """
-    change the image based on table state duration
-    """
-    if table_state_val is None:
-        return
-
-    table_state_duration = table_state.update(table_state_val)
-    #
-    # Implementation note:
-    #   The table state is smuggled into the user_data
-    #   (used to stored metrics received from MQTT)
-    #   so that refresh_text() has more uniform argument types.
-    #
-    user_data.update({TABLE_STATE_DURATION: table_state_duration})
-
-    if user_data.get("annotation_sent") is None:
-        user_data["annotation_sent"] = 0
-
-    #
-    # Change the icon and set the neopixel to blinking
-    # if table state duration exceeded the threshold.
-    #
-    icon_path = secrets.get(ICON_PATHS)[0]
-    if table_state_duration > secrets.get(TABLE_STATE_DUR_THRESH):
-        icon_path = secrets.get(ICON_PATHS)[1]
-
-        if can_blink(blinker, BLUE):
-            blinker.set_blinking(True, color=BLUE)
-
-        if (
-            user_data.get("annotation_sent") // 1_000_000_000
-            < time.monotonic_ns() // 1_000_000_000 - table_state_duration
-        ):
-            mqtt_publish_robust(
-                mqtt_client,
-                mqtt_topic,
-                json.dumps({"annotation": True, "tags": ["table_duration"]}),
-            )
-            user_data["annotation_sent"] = time.monotonic_ns()
-    else:
-        blinker.set_blinking(False, color=BLUE)
-        user_data["annotation_sent"] = 0
-    display_icon(display, image_tile_grid, icon_path)
-
-
-def handle_distance(distance, distance_threshold, mqtt_client, mqtt_topic) -> str:
-    """
-    publish distance to MQTT, determine the state based on threshold
-    :return: new table state value ("up" or "down")
-    """
-
-    logger = logging.getLogger(__name__)
-
-    if distance > distance_threshold:
-        table_state_val = "up"
-    else:
-        table_state_val = "down"
-    logger.debug(f"distance: {distance} cm (table {table_state_val})")
-
-    mqtt_publish_robust(mqtt_client, mqtt_topic, json.dumps({"distance": distance}))
-
-    return table_state_val
-
-
-def display_icon(display, tile_grid, icon_path):
-    """
-    Display icon in the bottom right corner.
-    :return: TileGrid object (either new if the tile_grid argument was None or updated)
-    """
-
-    logger = logging.getLogger(__name__)
-
-    try:
-        with open(icon_path, "rb"):
-            #
-            # Technically the OnDiskBitmap should allow file object
-            # for file opened in binary mode (for backward compatibility),
-            # however this does not seem to be the case.
-            #
-            icon_bitmap = displayio.OnDiskBitmap(icon_path)
-            if not tile_grid:
-                tile_grid = displayio.TileGrid(
-                    icon_bitmap,
-                    pixel_shader=icon_bitmap.pixel_shader,
-                    x=display.width - icon_bitmap.width + 10,
-                    y=display.height - icon_bitmap.height,
-                )
-                return tile_grid
-
-            # This assumes that the icon size is the same as the original,
-            # otherwise the TileGrid will not allow the update.
-            tile_grid.bitmap = icon_bitmap
-            tile_grid.pixel_shader = icon_bitmap.pixel_shader
-            tile_grid.x = display.width - icon_bitmap.width + 10
-            tile_grid.y = display.height - icon_bitmap.height
-            return tile_grid
-    # pylint: disable=broad-exception-caught
-    except Exception as broad_exception:
-        logger.error(f"cannot display {icon_path}: {broad_exception}")
-        return None
-
-
 try:
     main()
+except watchdog.WatchDogTimeout:
+    # Some stage of the main loop took too long. Record which one
+    # so that it can be published after the reset.
+    STALL_WATCH.record_stall()
+    save_snapshot()
+    microcontroller.reset()  # pylint: disable=no-member
 except ConnectionError as conn_error:
     # When this happens, it usually means that the microcontroller's wifi/networking is botched.
     # The only way to recover is to perform hard reset.
@@ -725,6 +849,8 @@ except Exception as generic_exception:  # pylint: disable=broad-except
     # This assumes that such exceptions are quite rare.
     # Otherwise, this would drain the battery quickly by restarting
     # over and over in a quick succession.
+    STALL_WATCH.stop()
+    save_snapshot()
     print("Code stopped by unhandled exception:")
     print(
         traceback.format_exception(
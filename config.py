@@ -0,0 +1,331 @@
+"""
+configuration handling
+"""
+
+import json
+
+import adafruit_logging as logging
+
+from logutil import get_log_level
+from mqtt import PLAIN, TRANSPORTS
+from payload import ENCODINGS, JSON
+from plugpoll import parse_url
+
+BROKER_PORT = "broker_port"
+LOG_TOPIC = "log_topic"
+MQTT_TOPIC = "mqtt_topic"
+MQTT_TOPIC_ENV = "mqtt_topic_env"
+MQTT_TOPIC_POWER = "mqtt_topic_power"
+MQTT_TOPIC_CONFIG = "mqtt_topic_config"
+BROKER = "broker"
+PASSWORD = "password"
+SSID = "SSID"
+LOG_LEVEL = "log_level"
+ICON_PATHS = "icon_paths"
+POWER_THRESH = "power_threshold_watts"
+BREAK_THRESH = "break_threshold_seconds"
+LAST_UPDATE_THRESH = "last_update_threshold"
+CO2_THRESH = "co2_threshold"
+TABLE_STATE_DUR_THRESH = "table_state_dur_threshold"
+FONT_FILE_NAME = "font_file_name"
+NTP_SERVER = "ntp_server"
+TZ_OFFSET = "tz_offset"
+PUBLISH_ENCODING = "publish_encoding"
+START_HR = "start_hr"
+END_HR = "end_hr"
+DISTANCE_THRESH = "distance_threshold"
+TRACE_FILE = "trace_file"
+MQTT_TOPIC_TRACE = "mqtt_topic_trace"
+DISPLAY_FPS = "display_fps"
+METRICS_PORT = "metrics_port"
+CO2_EARLY_ALERT = "co2_early_alert_seconds"
+MIN_BREAK = "min_break_seconds"
+MIN_ON = "min_on_seconds"
+WATCHDOG_TIMEOUT = "watchdog_timeout"
+MQTT_TOPIC_ANNOTATION = "mqtt_topic_annotation"
+EVENT_WINDOW = "event_window_seconds"
+MQTT_TOPIC_STATE = "mqtt_topic_state"
+SNAPSHOT_INTERVAL = "snapshot_interval"
+MQTT_TRANSPORT = "mqtt_transport"
+MQTT_CA_FILE = "mqtt_ca_file"
+MQTT_KEEP_ALIVE = "mqtt_keep_alive"
+POWER_PLUG_URL = "power_plug_url"
+POWER_PLUG_KEY = "power_plug_key"
+POWER_POLL_INTERVAL = "power_poll_interval"
+
+MANDATORY_SECRETS = [
+    BROKER,
+    BROKER_PORT,
+    MQTT_TOPIC,
+    MQTT_TOPIC_POWER,
+    MQTT_TOPIC_ENV,
+    PASSWORD,
+    SSID,
+    LOG_LEVEL,
+    ICON_PATHS,
+    POWER_THRESH,
+    LAST_UPDATE_THRESH,
+    CO2_THRESH,
+    TABLE_STATE_DUR_THRESH,
+    FONT_FILE_NAME,
+    BREAK_THRESH,
+    START_HR,
+    END_HR,
+    DISTANCE_THRESH,
+]
+
+# Tunables that can be changed at runtime via the configuration topic.
+LIVE_TUNABLES = [
+    LOG_LEVEL,
+    POWER_THRESH,
+    BREAK_THRESH,
+    LAST_UPDATE_THRESH,
+    CO2_THRESH,
+    TABLE_STATE_DUR_THRESH,
+    START_HR,
+    END_HR,
+    DISTANCE_THRESH,
+    CO2_EARLY_ALERT,
+    MIN_BREAK,
+    MIN_ON,
+    EVENT_WINDOW,
+]
+
+# Default values of the optional live tunables.
+LIVE_DEFAULTS = {CO2_EARLY_ALERT: 600, MIN_BREAK: 60, MIN_ON: 20, EVENT_WINDOW: 60}
+
+NUMBER_TUNABLES = [
+    POWER_THRESH,
+    BREAK_THRESH,
+    LAST_UPDATE_THRESH,
+    CO2_THRESH,
+    TABLE_STATE_DUR_THRESH,
+    DISTANCE_THRESH,
+    BROKER_PORT,
+    TZ_OFFSET,
+    DISPLAY_FPS,
+    METRICS_PORT,
+    CO2_EARLY_ALERT,
+    MIN_BREAK,
+    MIN_ON,
+    WATCHDOG_TIMEOUT,
+    EVENT_WINDOW,
+    SNAPSHOT_INTERVAL,
+    MQTT_KEEP_ALIVE,
+    POWER_POLL_INTERVAL,
+]
+
+CONFIG_VERSION = "version"
+
+
+class ConfigError(Exception):
+    """
+    raised when the configuration is not valid
+    """
+
+
+def _validate_connections(values):
+    if values.get(POWER_PLUG_URL) is not None:
+        try:
+            parse_url(values[POWER_PLUG_URL])
+        except ValueError as value_error:
+            raise ConfigError(
+                f"invalid {POWER_PLUG_URL}: {value_error}"
+            ) from value_error
+
+    transport = values.get(MQTT_TRANSPORT, PLAIN)
+    if transport not in TRANSPORTS:
+        raise ConfigError(f"{MQTT_TRANSPORT} has to be one of {TRANSPORTS}")
+    if values.get(MQTT_CA_FILE) and transport == PLAIN:
+        raise ConfigError(f"{MQTT_CA_FILE} requires TLS {MQTT_TRANSPORT}")
+
+
+def _validate_numbers(values):
+    for name in NUMBER_TUNABLES:
+        value = values.get(name)
+        if value is None:
+            continue
+        # bool is a subclass of int
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ConfigError(f"{name} has to be a number: {value}")
+        # The time zone offset is the only value that can be negative.
+        if name != TZ_OFFSET and value < 0:
+            raise ConfigError(f"{name} cannot be negative: {value}")
+
+    for name in [
+        DISPLAY_FPS,
+        WATCHDOG_TIMEOUT,
+        SNAPSHOT_INTERVAL,
+        MQTT_KEEP_ALIVE,
+        POWER_POLL_INTERVAL,
+    ]:
+        if values.get(name) is not None and values[name] <= 0:
+            raise ConfigError(f"{name} has to be positive: {values[name]}")
+
+
+def _validate_hours(values):
+    for name in [START_HR, END_HR]:
+        value = values.get(name)
+        if value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, int):
+            raise ConfigError(f"{name} has to be an integer: {value}")
+        if not 0 <= value <= 24:
+            raise ConfigError(f"{name} has to be within 0-24: {value}")
+
+
+def _validate(values):
+    """
+    Check types and values of the configuration entries.
+    :raises ConfigError: if anything is wrong
+    """
+    _validate_numbers(values)
+    _validate_hours(values)
+
+    icon_paths = values.get(ICON_PATHS)
+    if icon_paths is not None and (
+        not isinstance(icon_paths, (list, tuple)) or len(icon_paths) != 2
+    ):
+        raise ConfigError(f"{ICON_PATHS} has to be a list of 2 paths: {icon_paths}")
+
+    if values.get(LOG_LEVEL) is not None and get_log_level(values[LOG_LEVEL]) is None:
+        raise ConfigError(f"invalid {LOG_LEVEL}: {values[LOG_LEVEL]}")
+
+    if values.get(PUBLISH_ENCODING, JSON) not in ENCODINGS:
+        raise ConfigError(f"{PUBLISH_ENCODING} has to be one of {ENCODINGS}")
+
+    _validate_connections(values)
+
+
+def _check_hours(start_hr, end_hr):
+    if start_hr > end_hr:
+        raise ConfigError(f"{START_HR} {start_hr} is after {END_HR} {end_hr}")
+
+
+# pylint: disable=too-many-instance-attributes,too-few-public-methods
+class Config:
+    """
+    Validated configuration. The values are accessible as attributes.
+
+    Tunables listed in LIVE_TUNABLES can be changed at runtime using update().
+    Not thread safe.
+    """
+
+    def __init__(self, secrets):
+        """
+        :param secrets: dictionary with configuration (normally from secrets.py)
+        :raises ConfigError: if mandatory entry is missing or some entry is invalid
+        """
+        for name in MANDATORY_SECRETS:
+            if secrets.get(name) is None:
+                raise ConfigError(f"secret {name} is missing")
+        _validate(secrets)
+
+        self.version = 0
+
+        self.ssid = secrets[SSID]
+        self.password = secrets[PASSWORD]
+        self.broker = secrets[BROKER]
+        self.broker_port = secrets[BROKER_PORT]
+        self.mqtt_topic = secrets[MQTT_TOPIC]
+        self.mqtt_topic_env = secrets[MQTT_TOPIC_ENV]
+        self.mqtt_topic_power = secrets[MQTT_TOPIC_POWER]
+        self.mqtt_topic_config = secrets.get(MQTT_TOPIC_CONFIG)
+        self.mqtt_topic_annotation = secrets.get(
+            MQTT_TOPIC_ANNOTATION, secrets[MQTT_TOPIC]
+        )
+        self.icon_paths = secrets[ICON_PATHS]
+        self.font_file_name = secrets[FONT_FILE_NAME]
+        self.ntp_server = secrets.get(NTP_SERVER)
+        self.tz_offset = secrets.get(TZ_OFFSET, 1)
+        self.publish_encoding = secrets.get(PUBLISH_ENCODING, JSON)
+        self.trace_file = secrets.get(TRACE_FILE)
+        self.mqtt_topic_trace = secrets.get(MQTT_TOPIC_TRACE)
+        self.display_fps = secrets.get(DISPLAY_FPS, 2)
+        self.metrics_port = secrets.get(METRICS_PORT)
+        self.watchdog_timeout = secrets.get(WATCHDOG_TIMEOUT)
+        self.mqtt_topic_state = secrets.get(MQTT_TOPIC_STATE)
+        self.snapshot_interval = secrets.get(SNAPSHOT_INTERVAL, 600)
+        self.mqtt_transport = secrets.get(MQTT_TRANSPORT, PLAIN)
+        self.mqtt_ca_file = secrets.get(MQTT_CA_FILE)
+        self.mqtt_keep_alive = secrets.get(MQTT_KEEP_ALIVE, 60)
+        self.power_plug_url = secrets.get(POWER_PLUG_URL)
+        self.power_plug_key = secrets.get(POWER_PLUG_KEY, "apower")
+        self.power_poll_interval = secrets.get(POWER_POLL_INTERVAL, 10)
+
+        self.log_level = None
+        self.power_threshold_watts = None
+        self.break_threshold_seconds = None
+        self.last_update_threshold = None
+        self.co2_threshold = None
+        self.table_state_dur_threshold = None
+        self.start_hr = None
+        self.end_hr = None
+        self.distance_threshold = None
+        self.co2_early_alert_seconds = None
+        self.min_break_seconds = None
+        self.min_on_seconds = None
+        self.event_window_seconds = None
+        self._apply(
+            {name: secrets.get(name, LIVE_DEFAULTS.get(name)) for name in LIVE_TUNABLES}
+        )
+        _check_hours(self.start_hr, self.end_hr)
+
+    def _apply(self, values):
+        for name, value in values.items():
+            if name == LOG_LEVEL:
+                value = get_log_level(value)
+            setattr(self, name, value)
+
+    def update(self, changes) -> int:
+        """
+        Validate the changes and apply them all at once. If any of the changes
+        is not valid, none is applied.
+        :param changes: dictionary with new values of the tunables,
+        optionally with the "version" key
+        :return: new configuration version
+        :raises ConfigError: if the changes are not valid
+        """
+        logger = logging.getLogger(__name__)
+
+        changes = dict(changes)
+        version = changes.pop(CONFIG_VERSION, self.version + 1)
+        if isinstance(version, bool) or not isinstance(version, int):
+            raise ConfigError(f"{CONFIG_VERSION} has to be an integer: {version}")
+
+        for name, value in changes.items():
+            if name not in LIVE_TUNABLES:
+                raise ConfigError(f"{name} cannot be changed at runtime")
+            # _validate() skips missing values, however the tunables cannot be unset.
+            if value is None:
+                raise ConfigError(f"{name} cannot be null")
+        _validate(changes)
+
+        # Check the resulting configuration as a whole.
+        _check_hours(
+            changes.get(START_HR, self.start_hr), changes.get(END_HR, self.end_hr)
+        )
+
+        self._apply(changes)
+        self.version = version
+        logger.info(f"configuration version {version} applied: {changes}")
+        return version
+
+    def update_from_message(self, msg):
+        """
+        Apply configuration update received as JSON message.
+        :return: acknowledgement message (dictionary)
+        """
+        try:
+            changes = json.loads(msg)
+            if not isinstance(changes, dict):
+                raise ConfigError(f"not a JSON object: {msg}")
+            version = self.update(changes)
+            return {CONFIG_VERSION: version, "status": "ok"}
+        except (ValueError, ConfigError) as error:
+            logging.getLogger(__name__).error(f"invalid configuration: {error}")
+            return {
+                CONFIG_VERSION: self.version,
+                "status": "error",
+                "error": str(error),
+            }
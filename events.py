@@ -0,0 +1,101 @@
+"""
+coalescing of events published as annotations
+"""
+
+import adafruit_logging as logging
+
+from clock import CLOCK
+from mqtt import mqtt_publish_robust
+from payload import encode_message
+
+# Event types, used as the annotation tags. New types have to be added
+# to TAG_IDS in payload.py as well. The session events (see session.py)
+# are used as they are.
+TABLE_UP = "table_up"
+TABLE_DOWN = "table_down"
+TABLE_DURATION = "table_duration"
+CO2_EPISODE_START = "co2_episode_start"
+CO2_EPISODE_END = "co2_episode_end"
+SENSOR_STALE = "sensor_stale"
+MQTT_RECONNECT = "mqtt_reconnect"
+
+# Number of events coalesced into the batch.
+EVENT_COUNT = "events"
+# Values accompanying the session events.
+SESSION_SECONDS = "session_seconds"
+BREAK_SECONDS = "break_seconds"
+
+
+class EventBus:
+    """
+    Collects events and publishes them in batches. All events raised within
+    the window since the first pending event are coalesced into single annotation
+    message with the event types as tags. Repeated events of the same type
+    are deduplicated, the numeric values accompanying the events are merged
+    (the last value wins).
+
+    This way flapping (e.g. the table going up and down repeatedly) results
+    in at most one message per window.
+    """
+
+    def __init__(self, clock=CLOCK):
+        self._clock = clock
+        # Event type to count, in the order of arrival.
+        self._pending = {}
+        self._values = {}
+        self._first_stamp = None
+
+    @property
+    def pending(self):
+        """
+        :return: number of pending events (incl. duplicates)
+        """
+        return sum(self._pending.values())
+
+    def emit(self, kind, values=None):
+        """
+        Raise an event.
+        :param kind: event type
+        :param values: optional dictionary with numeric values describing the event
+        """
+        logging.getLogger(__name__).debug(f"event {kind} {values}")
+        self._pending[kind] = self._pending.get(kind, 0) + 1
+        if values:
+            self._values.update(values)
+        if self._first_stamp is None:
+            self._first_stamp = self._clock.monotonic_ns()
+
+    def take(self, window):
+        """
+        :param window: coalescing window in seconds
+        :return: the batch as annotation dictionary if the window since the first
+        pending event elapsed, otherwise None
+        """
+        if self._first_stamp is None:
+            return None
+        if self._clock.monotonic_ns() - self._first_stamp < window * 1_000_000_000:
+            return None
+
+        batch = {
+            "annotation": True,
+            "tags": list(self._pending),
+            EVENT_COUNT: self.pending,
+        }
+        batch.update(self._values)
+        self._pending = {}
+        self._values = {}
+        self._first_stamp = None
+        return batch
+
+    def publish(self, mqtt_client, topic, window, encoding):
+        """
+        Publish the batch if it is due.
+        :return: True if the batch was published
+        """
+        batch = self.take(window)
+        if batch is None:
+            return False
+
+        logging.getLogger(__name__).info(f"publishing events: {batch}")
+        mqtt_publish_robust(mqtt_client, topic, encode_message(batch, encoding))
+        return True
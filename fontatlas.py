@@ -0,0 +1,176 @@
+"""
+Glyph atlas font: the glyphs used by the UI prerendered into a few bitmaps
+so that the font can be loaded without parsing the font file.
+
+The atlas file is generated on a host using tools/font_atlas.py.
+It consists of header, glyph metrics and the atlas bitmaps.
+The glyphs are grouped by size (width and height) so that the text is laid out
+the same as with the original font. Within a group, the glyphs are stored next
+to each other (this is how TileGrid addresses the tiles). Each group has its own
+bitmap stored as 1 bit per pixel (most significant bit first), rows padded
+to whole bytes.
+"""
+
+import struct
+import time
+
+import adafruit_logging as logging
+import displayio
+
+try:
+    from bitmaptools import readinto as _bitmap_readinto
+except ImportError:
+    _bitmap_readinto = None
+
+try:
+    from fontio import Glyph
+except ImportError:
+    Glyph = None  # pylint: disable=invalid-name
+
+# Characters the UI can render.
+CHARACTERS = (
+    "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz1234567890- ().,:!?/\\%+@~"
+    + "°³µ₂"
+)
+
+MAGIC = b"WMFA"
+VERSION = 2
+# magic, version, group count, bounding box (width, height, x offset, y offset),
+# ascent, descent
+HEADER_FMT = "<4sBBhhhhhh"
+HEADER_SIZE = struct.calcsize(HEADER_FMT)
+# glyph width, glyph height, glyph count
+GROUP_FMT = "<BBH"
+GROUP_SIZE = struct.calcsize(GROUP_FMT)
+# code point, dx, dy, shift_x, shift_y
+GLYPH_FMT = "<Ibbbb"
+GLYPH_SIZE = struct.calcsize(GLYPH_FMT)
+
+
+def atlas_path(font_path):
+    """
+    :return: path of the atlas file corresponding to the font file
+    """
+    dot = font_path.rfind(".")
+    if dot > font_path.rfind("/"):
+        font_path = font_path[:dot]
+    return font_path + ".atlas"
+
+
+def row_size(width):
+    """
+    :return: number of bytes per atlas bitmap row
+    """
+    return (width + 7) // 8
+
+
+class AtlasFont:
+    """
+    Font backed by glyph atlas, usable with adafruit_display_text.
+    """
+
+    # pylint: disable=too-many-locals
+    def __init__(self, file_name):
+        """
+        Load the atlas file.
+        :raises ValueError: if the file is not valid atlas
+        :raises OSError: if the file cannot be read
+        """
+        logger = logging.getLogger(__name__)
+
+        stamp = time.monotonic_ns()
+        self._glyphs = {}
+        self.size_bytes = 0
+        with open(file_name, "rb") as file:
+            header = file.read(HEADER_SIZE)
+            if len(header) != HEADER_SIZE:
+                raise ValueError("truncated atlas header")
+            (
+                magic,
+                version,
+                group_count,
+                bbox_width,
+                bbox_height,
+                bbox_dx,
+                bbox_dy,
+                self.ascent,
+                self.descent,
+            ) = struct.unpack(HEADER_FMT, header)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"unsupported atlas format in {file_name}")
+            self._bounding_box = (bbox_width, bbox_height, bbox_dx, bbox_dy)
+
+            # Glyphs with zero size are never drawn, however need some bitmap.
+            empty_bitmap = displayio.Bitmap(1, 1, 2)
+            for _ in range(group_count):
+                group = file.read(GROUP_SIZE)
+                if len(group) != GROUP_SIZE:
+                    raise ValueError("truncated atlas group header")
+                width, height, count = struct.unpack(GROUP_FMT, group)
+
+                # Read all the metrics of the group at once.
+                metrics = file.read(count * GLYPH_SIZE)
+                if len(metrics) != count * GLYPH_SIZE:
+                    raise ValueError("truncated atlas glyph metrics")
+
+                bitmap = empty_bitmap
+                if width > 0 and height > 0:
+                    bitmap = displayio.Bitmap(count * width, height, 2)
+                    _read_bitmap(bitmap, file)
+                    self.size_bytes += row_size(bitmap.width) * height
+
+                for i in range(count):
+                    code_point, dx, dy, shift_x, shift_y = struct.unpack_from(
+                        GLYPH_FMT, metrics, i * GLYPH_SIZE
+                    )
+                    self._glyphs[code_point] = Glyph(
+                        bitmap, i, width, height, dx, dy, shift_x, shift_y
+                    )
+                self.size_bytes += len(metrics)
+
+        self.load_time_ms = (time.monotonic_ns() - stamp) // 1_000_000
+        logger.info(
+            f"loaded {len(self._glyphs)} glyphs from {file_name} "
+            f"in {self.load_time_ms} ms ({self.size_bytes} bytes)"
+        )
+
+    def get_bounding_box(self):
+        """
+        :return: the maximum bounds of all glyphs in the font
+        (width, height, x offset, y offset)
+        """
+        return self._bounding_box
+
+    def get_glyph(self, code_point):
+        """
+        :return: Glyph object for the code point or None if the glyph is not available
+        """
+        return self._glyphs.get(code_point)
+
+    def load_glyphs(self, code_points):
+        """
+        All glyphs are loaded already. Provided for compatibility with the bitmap fonts.
+        """
+
+
+def _read_bitmap(bitmap, file):
+    """
+    Read 1 bit per pixel bitmap data from the file.
+    """
+    if _bitmap_readinto:
+        _bitmap_readinto(
+            bitmap,
+            file,
+            bits_per_pixel=1,
+            element_size=1,
+            reverse_pixels_in_element=True,
+        )
+        return
+
+    buf = bytearray(row_size(bitmap.width))
+    for y in range(bitmap.height):
+        if file.readinto(buf) != len(buf):
+            raise ValueError("truncated atlas bitmap")
+        for x in range(bitmap.width):
+            if buf[x // 8] & (128 >> (x % 8)):
+                bitmap[x, y] = 1
@@ -0,0 +1,95 @@
+"""
+Frame based display refresh: the changes of the display elements are collected
+and the display is refreshed at most once per frame, only if something changed.
+"""
+
+import adafruit_logging as logging
+
+from clock import CLOCK
+
+
+def set_label(label, text=None, color=None) -> bool:
+    """
+    Change the text and/or color of the label if different from the current value.
+    Assigning the same value would still make the label to be redrawn.
+    :return: whether the label changed
+    """
+    changed = False
+    if text is not None and label.text != text:
+        label.text = text
+        changed = True
+    if color is not None and label.color != color:
+        label.color = color
+        changed = True
+    return changed
+
+
+# pylint: disable=too-few-public-methods
+class TextCache:
+    """
+    Remembers the values the label texts were formatted from so that the text
+    is formatted (i.e. new string allocated) only when the value changes.
+    """
+
+    def __init__(self):
+        self._values = {}
+
+    def changed(self, label, value) -> bool:
+        """
+        :return: whether the value differs from the one the label was last formatted from
+        """
+        key = id(label)
+        if key in self._values and self._values[key] == value:
+            return False
+        self._values[key] = value
+        return True
+
+
+class Frame:
+    """
+    Refreshes the display explicitly with auto refresh disabled.
+    """
+
+    def __init__(self, display, fps=2, clock=CLOCK):
+        """
+        :param display: display object, can be None (e.g. in tests)
+        :param fps: maximum number of refreshes per second
+        """
+        self.display = display
+        self._clock = clock
+        self._interval_ns = int(1_000_000_000 / fps)
+        self._next_ns = 0
+        self._dirty = False
+        self.refresh_count = 0
+
+        if display is not None:
+            display.auto_refresh = False
+
+    def invalidate(self):
+        """
+        Mark the frame as changed so that the display is refreshed
+        by the next refresh() call.
+        """
+        self._dirty = True
+
+    def refresh(self, now_ns=None) -> bool:
+        """
+        Refresh the display if anything changed and the frame interval passed.
+        Cheap enough to be called on each iteration of the main loop.
+        :param now_ns: current monotonic time in nanoseconds, if already known
+        :return: whether the display was refreshed
+        """
+        if not self._dirty:
+            return False
+
+        now = self._clock.monotonic_ns() if now_ns is None else now_ns
+        if now < self._next_ns:
+            return False
+
+        logging.getLogger(__name__).debug("refreshing display")
+        if self.display is not None:
+            self.display.refresh()
+        self._dirty = False
+        self._next_ns = now + self._interval_ns
+        self.refresh_count += 1
+        return True
@@ -0,0 +1,452 @@
+"""
+handling of the sensor values and MQTT messages, driving the display and the blinker
+"""
+
+import json
+
+import adafruit_logging as logging
+import displayio
+
+from clock import CLOCK
+from events import (
+    BREAK_SECONDS,
+    CO2_EPISODE_END,
+    CO2_EPISODE_START,
+    SENSOR_STALE,
+    SESSION_SECONDS,
+    TABLE_DOWN,
+    TABLE_DURATION,
+    TABLE_UP,
+)
+from frame import TextCache, set_label
+from logutil import debug_enabled, set_log_level
+from mqtt import mqtt_publish_robust
+from payload import PayloadDecoder, encode_message
+from session import BREAK, SESSION_END
+from trend import Trend
+
+TEXT_COLOR_BASE = 0xFFFF00
+TEXT_COLOR_ALERT = 0xFF0000
+TEXT_COLOR_WARNING = 0xFF8000
+
+CO2 = "co2"
+TEMPERATURE = "temp"
+HUMIDITY = "humidity"
+POWER = "power"
+LAST_UPDATE = "time"
+TABLE_STATE_DURATION = "table_state_duration"
+ICON_PATH = "icon_path"
+CO2_TREND = "co2_trend"
+CO2_SLOPE = "co2_slope_ppm_per_min"
+EVENT_BUS = "event_bus"
+TEXT_CACHE = "text_cache"
+# Flags for raising the events only on changes.
+TABLE_ALERT = "table_alert"
+CO2_EPISODE = "co2_episode"
+STALE = "stale"
+
+# Time constant of the CO2 trend window in seconds.
+CO2_TREND_WINDOW = 600
+
+TEMP_PREFIX = "Temp: "
+HUM_PREFIX = "Hum: "
+TBL_PREFIX = "Tbl: "
+
+RED = (255, 0, 0)  # CO2 alert
+YELLOW = (255, 160, 0)  # CO2 early alert
+GREEN = (0, 255, 0)  # break alert
+BLUE = (0, 0, 255)  # table alert
+
+# Higher number means higher priority.
+COLOR_PRIORITY = {RED: 30, YELLOW: 25, GREEN: 20, BLUE: 10}
+
+# Decoders are allocated once to avoid allocating per message.
+ENV_DECODER = PayloadDecoder(("co2_ppm", "temperature", "humidity"))
+POWER_DECODER = PayloadDecoder(("current_power",))
+
+
+def on_message_with_env_metrics(mqtt, topic, msg, clock=CLOCK):
+    """
+    handle messages with environment sensor metrics
+    """
+    logger = logging.getLogger(__name__)
+
+    logger.debug(f"got MQTT message on {topic}: {msg}")
+    try:
+        co2, temperature, humidity = ENV_DECODER.decode(msg)
+        mqtt.user_data[CO2] = co2
+        mqtt.user_data[TEMPERATURE] = temperature
+        mqtt.user_data[HUMIDITY] = humidity
+        mqtt.user_data[LAST_UPDATE] = clock.monotonic_ns()
+    except ValueError as value_error:
+        logger.error(f"failed to parse {msg}: {value_error}")
+        return
+
+    if co2 is not None:
+        trend = mqtt.user_data.get(CO2_TREND)
+        if trend is None:
+            trend = Trend(CO2_TREND_WINDOW)
+            mqtt.user_data[CO2_TREND] = trend
+        trend.update(co2, clock.monotonic_ns())
+        slope = trend.slope()
+        mqtt.user_data[CO2_SLOPE] = slope * 60 if slope is not None else None
+
+
+def emit_event(user_data, kind, values=None):
+    """
+    Raise event on the event bus stored in user_data (if any).
+    """
+    event_bus = user_data.get(EVENT_BUS)
+    if event_bus is not None:
+        event_bus.emit(kind, values)
+
+
+def set_flag(user_data, flag, value, event_on=None, event_off=None):
+    """
+    Set boolean flag in user_data and raise event if its value changed.
+    """
+    if bool(user_data.get(flag)) == value:
+        return
+    user_data[flag] = value
+    event = event_on if value else event_off
+    if event is not None:
+        emit_event(user_data, event)
+
+
+# pylint: disable=unused-argument
+def on_message_with_power(mqtt, topic, msg):
+    """
+    handle messages with power metrics
+    """
+    logger = logging.getLogger(__name__)
+
+    logger.debug(f"got MQTT message on {topic}: {msg}")
+    try:
+        mqtt.user_data[POWER] = POWER_DECODER.decode(msg)[0]
+    except ValueError as value_error:
+        logger.error(f"failed to parse {msg}: {value_error}")
+
+
+def on_message_with_config(mqtt, topic, msg, config):
+    """
+    Handle configuration update and publish acknowledgement with the config version.
+    """
+    logger = logging.getLogger(__name__)
+
+    logger.debug(f"got MQTT message on {topic}: {msg}")
+    ack = config.update_from_message(msg)
+    set_log_level(config.log_level)
+    mqtt_publish_robust(mqtt, topic + "/ack", json.dumps(ack))
+
+
+def co2_alert(co2_value, user_data, config, blinker, clock=CLOCK):
+    """
+    Set the CO2 alert if the value is above threshold or the early alert
+    if it is going to be above the threshold soon. Without the value
+    (e.g. when the readings went stale), both alerts are cleared.
+    :return: text color for the CO2 value
+    """
+    logger = logging.getLogger(__name__)
+
+    if not co2_value:
+        blinker.set_alert(RED, False)
+        blinker.set_alert(YELLOW, False)
+        set_flag(user_data, CO2_EPISODE, False, event_off=CO2_EPISODE_END)
+        return TEXT_COLOR_BASE
+
+    co2_threshold = config.co2_threshold
+    if int(co2_value) > co2_threshold:
+        if debug_enabled(logger):
+            logger.debug(f"CO2 above threshold ({co2_value} > {co2_threshold})")
+        blinker.set_alert(RED)
+        blinker.set_alert(YELLOW, False)
+        set_flag(user_data, CO2_EPISODE, True, CO2_EPISODE_START)
+        return TEXT_COLOR_ALERT
+
+    blinker.set_alert(RED, False)
+    set_flag(user_data, CO2_EPISODE, False, event_off=CO2_EPISODE_END)
+    time_to = None
+    trend = user_data.get(CO2_TREND)
+    if trend is not None:
+        time_to = trend.time_to(co2_threshold, clock.monotonic_ns())
+    if time_to is not None and time_to < config.co2_early_alert_seconds:
+        if debug_enabled(logger):
+            logger.debug(f"CO2 will be above threshold in {time_to} seconds")
+        blinker.set_alert(YELLOW)
+        return TEXT_COLOR_WARNING
+
+    blinker.set_alert(YELLOW, False)
+    return TEXT_COLOR_BASE
+
+
+# pylint: disable=too-many-locals,too-many-branches,too-many-statements
+# pylint: disable=too-many-arguments,too-many-positional-arguments
+def refresh_text(
+    co2_value_area,
+    temp_area,
+    hum_area,
+    tbl_area,
+    user_data,
+    config,
+    blinker,
+    clock=CLOCK,
+) -> bool:
+    """
+    change the contents of the text label used to draw on the display
+    :return: whether any of the labels changed
+    """
+
+    logger = logging.getLogger(__name__)
+
+    last_update_threshold = config.last_update_threshold
+
+    # Multiply in order to preserve precision over time ?
+    # (time.monotonic() is float so not a good fit for long-running programs)
+    if user_data.get(LAST_UPDATE) is None or (
+        clock.monotonic_ns() - user_data.get(LAST_UPDATE)
+        > last_update_threshold * 1_000_000_000
+    ):
+        logger.warning(f"last update was before {last_update_threshold} seconds")
+        user_data[CO2] = None
+        user_data[TEMPERATURE] = None
+        user_data[HUMIDITY] = None
+        # Only the loss of previously received data is an event.
+        if user_data.get(LAST_UPDATE) is not None:
+            set_flag(user_data, STALE, True, SENSOR_STALE)
+    else:
+        set_flag(user_data, STALE, False)
+
+    # The texts are formatted only if the values changed to avoid allocations.
+    cache = user_data.get(TEXT_CACHE)
+    if cache is None:
+        cache = TextCache()
+        user_data[TEXT_CACHE] = cache
+
+    changed = False
+    co2_value = user_data.get(CO2)
+    color = co2_alert(co2_value, user_data, config, blinker, clock)
+    changed |= set_label(co2_value_area, color=color)
+    if cache.changed(co2_value_area, co2_value):
+        if co2_value:
+            changed |= set_label(co2_value_area, f"{co2_value} ppm")
+        else:
+            changed |= set_label(co2_value_area, "N/A")
+
+    temp = user_data.get(TEMPERATURE)
+    if cache.changed(temp_area, temp):
+        if temp:
+            temp_text = TEMP_PREFIX + f"{temp}°C"
+        else:
+            temp_text = TEMP_PREFIX + "N/A"
+        changed |= set_label(temp_area, temp_text)
+
+    val = user_data.get(HUMIDITY)
+    if cache.changed(hum_area, val):
+        if val:
+            hum_text = HUM_PREFIX + f"{val}%"
+        else:
+            hum_text = HUM_PREFIX + "N/A"
+        changed |= set_label(hum_area, hum_text)
+
+    val = user_data.get(TABLE_STATE_DURATION)
+    # The text has minute resolution.
+    if cache.changed(tbl_area, val // 60 if val else None):
+        if val:
+            hours = val // 3600
+            minutes = (val % 3600) // 60
+            if hours > 24:
+                time_val = f"{hours // 24} days"
+            else:
+                time_val = f"{hours:02}:{minutes:02}"
+            table_text = TBL_PREFIX + f"{time_val}"
+        else:
+            table_text = TBL_PREFIX + "N/A"
+        changed |= set_label(tbl_area, table_text)
+
+    return changed
+
+
+# pylint: disable=too-many-arguments,too-many-positional-arguments
+def handle_power(
+    blinker,
+    display,
+    image_tile_grid,
+    table_state,
+    table_state_val,
+    session,
+    user_data,
+    config,
+) -> bool:
+    """
+    Track the work session based on power. While in session, handle the table state.
+    :param session: SessionTracker instance
+    :return: whether the icon changed
+    """
+
+    logger = logging.getLogger(__name__)
+
+    power = user_data.get(POWER)
+    if power is None:
+        if debug_enabled(logger):
+            logger.debug("power N/A")
+        return False
+
+    for event, duration in session.update(
+        power > config.power_threshold_watts,
+        config.min_on_seconds,
+        config.min_break_seconds,
+    ):
+        logger.debug(f"session event {event} (duration {duration})")
+        values = None
+        if event == SESSION_END:
+            values = {SESSION_SECONDS: duration}
+        elif event == BREAK:
+            values = {BREAK_SECONDS: duration}
+        emit_event(user_data, event, values)
+        if event == SESSION_END:
+            # Reset the table position tracking, there was a work pause.
+            # Do not set the user_data element to keep showing the last value.
+            table_state.reset()
+            blinker.set_alert(GREEN, False)
+            blinker.set_alert(BLUE, False)
+
+    icon_changed = False
+    if session.in_session:
+        session_duration = session.duration()
+        if debug_enabled(logger):
+            logger.debug(f"in session for {session_duration} seconds")
+        if session_duration > config.break_threshold_seconds:
+            blinker.set_alert(GREEN)
+
+        # pylint: disable=too-many-function-args
+        icon_changed = handle_table_state(
+            blinker,
+            display,
+            image_tile_grid,
+            table_state,
+            table_state_val,
+            user_data,
+            config,
+        )
+
+    return icon_changed
+
+
+# pylint: disable=too-many-arguments,too-many-positional-arguments
+def handle_table_state(
+    blinker,
+    display,
+    image_tile_grid,
+    table_state,
+    table_state_val,
+    user_data,
+    config,
+) -> bool:
+    """
+    change the image based on table state duration
+    :return: whether the icon changed
+    """
+    if table_state_val is None:
+        return False
+
+    if table_state.prev_state is not None and table_state.prev_state != table_state_val:
+        emit_event(user_data, TABLE_UP if table_state_val == "up" else TABLE_DOWN)
+    table_state_duration = table_state.update(table_state_val)
+    #
+    # Implementation note:
+    #   The table state is smuggled into the user_data
+    #   (used to stored metrics received from MQTT)
+    #   so that refresh_text() has more uniform argument types.
+    #
+    user_data.update({TABLE_STATE_DURATION: table_state_duration})
+
+    #
+    # Change the icon and set the neopixel to blinking
+    # if table state duration exceeded the threshold.
+    #
+    icon_path = config.icon_paths[0]
+    if table_state_duration > config.table_state_dur_threshold:
+        icon_path = config.icon_paths[1]
+        blinker.set_alert(BLUE)
+        set_flag(user_data, TABLE_ALERT, True, TABLE_DURATION)
+    else:
+        blinker.set_alert(BLUE, False)
+        set_flag(user_data, TABLE_ALERT, False)
+
+    # Without the initial icon there is nothing to update.
+    # Reloading the icon makes the area to be redrawn so do it only on change.
+    if image_tile_grid is not None and user_data.get(ICON_PATH) != icon_path:
+        display_icon(display, image_tile_grid, icon_path)
+        user_data[ICON_PATH] = icon_path
+        return True
+
+    return False
+
+
+def handle_distance(distance, config, mqtt_client, mqtt_topic, user_data=None) -> str:
+    """
+    publish distance to MQTT, determine the state based on threshold
+    :param user_data: if specified, the CO2 trend is published along with the distance
+    :return: new table state value ("up" or "down")
+    """
+
+    logger = logging.getLogger(__name__)
+
+    if distance > config.distance_threshold:
+        table_state_val = "up"
+    else:
+        table_state_val = "down"
+    logger.debug(f"distance: {distance} cm (table {table_state_val})")
+
+    if mqtt_client is None:
+        return table_state_val
+
+    metrics = {"distance": distance}
+    if user_data is not None and user_data.get(CO2_SLOPE) is not None:
+        metrics[CO2_SLOPE] = user_data[CO2_SLOPE]
+    mqtt_publish_robust(
+        mqtt_client,
+        mqtt_topic,
+        encode_message(metrics, config.publish_encoding),
+    )
+
+    return table_state_val
+
+
+def display_icon(display, tile_grid, icon_path):
+    """
+    Display icon in the bottom right corner.
+    :return: TileGrid object (either new if the tile_grid argument was None or updated)
+    """
+
+    logger = logging.getLogger(__name__)
+
+    try:
+        with open(icon_path, "rb"):
+            #
+            # Technically the OnDiskBitmap should allow file object
+            # for file opened in binary mode (for backward compatibility),
+            # however this does not seem to be the case.
+            #
+            icon_bitmap = displayio.OnDiskBitmap(icon_path)
+            if not tile_grid:
+                tile_grid = displayio.TileGrid(
+                    icon_bitmap,
+                    pixel_shader=icon_bitmap.pixel_shader,
+                    x=display.width - icon_bitmap.width + 10,
+                    y=display.height - icon_bitmap.height,
+                )
+                return tile_grid
+
+            # This assumes that the icon size is the same as the original,
+            # otherwise the TileGrid will not allow the update.
+            tile_grid.bitmap = icon_bitmap
+            tile_grid.pixel_shader = icon_bitmap.pixel_shader
+            tile_grid.x = display.width - icon_bitmap.width + 10
+            tile_grid.y = display.height - icon_bitmap.height
+            return tile_grid
+    # Missing file, invalid bitmap or icon of different size than the original.
+    # Any other exception (e.g. WatchDogTimeout) has to propagate to the main loop.
+    except (OSError, ValueError) as icon_error:
+        logger.error(f"cannot display {icon_path}: {icon_error}")
+        return None
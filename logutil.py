@@ -25,6 +25,28 @@ logging utilities
 
 import adafruit_logging as logging
 
+# The adafruit_logging loggers have no hierarchy, so the level has to be set
+# on the logger of each module (these log via logging.getLogger(__name__)).
+# The MQTT logger has its own level (mqtt_log_level).
+LOGGER_NAMES = (
+    "__main__",
+    "binarystate",
+    "blinker",
+    "bootprof",
+    "config",
+    "events",
+    "fontatlas",
+    "frame",
+    "handlers",
+    "metricserver",
+    "plugpoll",
+    "session",
+    "snapshot",
+    "stallwatch",
+    "timeutil",
+    "tracelog",
+)
+
 
 def get_log_level(level):
     """
@@ -49,3 +71,22 @@ def get_log_level(level):
         return None
     except AttributeError:
         return None
+
+
+def debug_enabled(logger):
+    """
+    The adafruit_logging loggers create the log record (and the message has to be
+    formatted beforehand) even if the level is not enabled. Use this to guard
+    debug logging on the hot paths to avoid the allocations.
+    :return: whether debug messages of the logger are going to be emitted
+    """
+    return logger.getEffectiveLevel() <= logging.DEBUG
+
+
+def set_log_level(level):
+    """
+    Set the level of the loggers of all the modules.
+    :param level: integer log level
+    """
+    for name in LOGGER_NAMES:
+        logging.getLogger(name).setLevel(level)
@@ -0,0 +1,195 @@
+"""
+Minimal HTTP server exposing metrics in Prometheus text format.
+
+The server is driven from the main loop via poll() and never blocks:
+all the sockets are non-blocking and the request is read and the response
+written in as many poll() calls as needed. Only one client is served at a time.
+The response is rendered into preallocated buffer.
+
+Works with CircuitPython socketpool as well as with the CPython socket module.
+"""
+
+import errno
+
+import adafruit_logging as logging
+
+from clock import CLOCK
+
+GAUGE = b"gauge"
+COUNTER = b"counter"
+
+# Room for the HTTP response header in front of the body.
+HEADER_SIZE = 96
+
+
+def _would_block(os_error):
+    # BlockingIOError in CPython is OSError subclass with EAGAIN as well.
+    return os_error.errno in (errno.EAGAIN, errno.ETIMEDOUT)
+
+
+# pylint: disable=too-many-instance-attributes
+class MetricServer:
+    """
+    Serves the metrics to any GET request.
+    """
+
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    def __init__(
+        self,
+        pool,
+        metrics,
+        port=9100,
+        host="0.0.0.0",
+        buffer_size=2048,
+        timeout=2,
+        clock=CLOCK,
+    ):
+        """
+        :param pool: socketpool.SocketPool instance or the socket module
+        :param metrics: list of (name, type, function) tuples, the function returns
+        the current value (number or None if not available)
+        :param timeout: seconds after which unfinished request is dropped
+        """
+        self._clock = clock
+        self._timeout_ns = timeout * 1_000_000_000
+
+        # The metric lines up to the value are prepared in advance.
+        self._metrics = []
+        for name, metric_type, func in metrics:
+            name = name.encode()
+            prefix = b"# TYPE " + name + b" " + metric_type + b"\n" + name + b" "
+            self._metrics.append((prefix, func))
+
+        self._request = bytearray(512)
+        self._request_view = memoryview(self._request)
+        self._response = bytearray(buffer_size)
+        self._response_view = memoryview(self._response)
+
+        self._client = None
+        self._client_stamp = 0
+        self._received = 0
+        self._sent = 0
+        self._start = 0
+        self._end = 0
+        self.requests = 0
+
+        self._socket = pool.socket(pool.AF_INET, pool.SOCK_STREAM)
+        try:
+            self._socket.setsockopt(pool.SOL_SOCKET, pool.SO_REUSEADDR, 1)
+        except (AttributeError, OSError):
+            pass
+        self._socket.bind((host, port))
+        self._socket.listen(1)
+        self._socket.setblocking(False)
+        logging.getLogger(__name__).info(f"serving metrics on {host}:{port}")
+
+    @property
+    def port(self):
+        """
+        :return: the port the server is listening on
+        """
+        return self._socket.getsockname()[1]
+
+    def poll(self):
+        """
+        Make progress with the current client or accept a new one.
+        Should be called from the main loop.
+        """
+        if self._client is None:
+            try:
+                self._client, _ = self._socket.accept()
+            except OSError as os_error:
+                if not _would_block(os_error):
+                    raise
+                return
+            self._client.setblocking(False)
+            self._client_stamp = self._clock.monotonic_ns()
+            self._received = 0
+            self._sent = 0
+            self._end = 0
+
+        try:
+            if self._end == 0:
+                self._read()
+            if self._end > 0:
+                self._write()
+        except OSError as os_error:
+            if not _would_block(os_error):
+                logging.getLogger(__name__).debug(f"client error: {os_error}")
+                self._close()
+                return
+
+        if (
+            self._client is not None
+            and self._clock.monotonic_ns() - self._client_stamp > self._timeout_ns
+        ):
+            logging.getLogger(__name__).debug("client timed out")
+            self._close()
+
+    def close(self):
+        """
+        close the client (if any) and the listening socket
+        """
+        if self._client is not None:
+            self._close()
+        self._socket.close()
+
+    def _read(self):
+        """
+        Read the request until its end, then render the response.
+        """
+        count = self._client.recv_into(
+            self._request_view[self._received :]  # noqa: E203
+        )
+        if count == 0:
+            self._close()
+            return
+        self._received += count
+        # Only the end of the header matters, the request itself is not parsed.
+        if self._request.find(
+            b"\r\n\r\n", 0, self._received
+        ) >= 0 or self._received == len(self._request):
+            self._render()
+
+    def _write(self):
+        count = self._client.send(
+            self._response_view[self._start + self._sent : self._end]  # noqa: E203
+        )
+        self._sent += count
+        if self._start + self._sent >= self._end:
+            self.requests += 1
+            self._close()
+
+    def _close(self):
+        try:
+            self._client.close()
+        except OSError:
+            pass
+        self._client = None
+
+    def _render(self):
+        """
+        Render the body after the room reserved for the header,
+        then put the header right in front of it.
+        """
+        pos = HEADER_SIZE
+        for prefix, func in self._metrics:
+            value = func()
+            if value is None:
+                continue
+            value = (str(value) + "\n").encode()
+            end = pos + len(prefix) + len(value)
+            if end > len(self._response):
+                logging.getLogger(__name__).warning("metrics buffer too small")
+                break
+            self._response[pos : pos + len(prefix)] = prefix  # noqa: E203
+            self._response[pos + len(prefix) : end] = value  # noqa: E203
+            pos = end
+
+        header = (
+            "HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+            + f"Content-Length: {pos - HEADER_SIZE}\r\n\r\n"
+        ).encode()
+        self._start = HEADER_SIZE - len(header)
+        self._response[self._start : HEADER_SIZE] = header  # noqa: E203
+        self._end = pos
@@ -7,9 +7,54 @@ import ssl
 import adafruit_logging as logging
 import adafruit_minimqtt.adafruit_minimqtt as MQTT
 
+from clock import CLOCK
+
 # Avoid infinite recursion by using non-default logger in the MQTT callbacks.
 MQTT_LOGGER_NAME = "mqtt"
 
+# Transports of the connection to the broker.
+PLAIN = "plain"
+TLS = "tls"
+TRANSPORTS = (PLAIN, TLS)
+
+# user_data key of the ConnectStats instance.
+CONNECT_STATS = "connect_stats"
+
+
+# pylint: disable=too-few-public-methods
+class ConnectStats:
+    """
+    Counts the (re)connects to the broker and measures how long they take.
+    For TLS, the time is dominated by the handshake.
+    """
+
+    def __init__(self, clock=CLOCK):
+        self.connects = 0
+        self.failures = 0
+        # Duration of the last successful connect in milliseconds.
+        self.last_ms = None
+        self.max_ms = 0
+        self._clock = clock
+
+    def measure(self, connect_func):
+        """
+        Call the connect function and record how long it took.
+        :return: the result of the function
+        """
+        start = self._clock.monotonic_ns()
+        try:
+            result = connect_func()
+        except (OSError, MQTT.MMQTTException):
+            self.failures += 1
+            raise
+        self.last_ms = (self._clock.monotonic_ns() - start) // 1_000_000
+        self.max_ms = max(self.max_ms, self.last_ms)
+        self.connects += 1
+        logging.getLogger(MQTT_LOGGER_NAME).info(
+            f"connected to the broker in {self.last_ms} ms"
+        )
+        return result
+
 
 # pylint: disable=unused-argument, redefined-outer-name, invalid-name
 def connect(mqtt_client, userdata, flags, rc):
@@ -42,22 +87,59 @@ def publish(mqtt_client, userdata, topic, pid):
     logger.info(f"Published to {topic} with PID {pid}")
 
 
+def ssl_context(transport, ca_file=None):
+    """
+    :param transport: one of TRANSPORTS
+    :param ca_file: optional path of PEM file with the CA certificate(s)
+    to verify the broker with instead of the built-in ones
+    :return: SSL context or None for plain connection
+    """
+    if transport == PLAIN:
+        return None
+
+    context = ssl.create_default_context()
+    if ca_file:
+        with open(ca_file, encoding="ascii") as pem_file:
+            context.load_verify_locations(cadata=pem_file.read())
+    return context
+
+
 # pylint: disable=too-many-arguments,too-many-positional-arguments
-def mqtt_client_setup(pool, broker, port, log_level, user_data=None, socket_timeout=1):
+def mqtt_client_setup(
+    pool,
+    broker,
+    port,
+    log_level,
+    user_data=None,
+    socket_timeout=1,
+    use_binary_mode=False,
+    transport=PLAIN,
+    ca_file=None,
+    keep_alive=60,
+):
     """
     Set up a MiniMQTT Client
+    :param use_binary_mode: if True, the message callbacks will receive bytes
+    :param transport: one of TRANSPORTS
+    :param ca_file: optional path of PEM file with the CA certificate(s) for TLS
+    :param keep_alive: keep alive interval in seconds. The main loop calls loop()
+    often enough for the pings to be sent in time.
     """
 
     logger = logging.getLogger(MQTT_LOGGER_NAME)
     logger.setLevel(log_level)
 
+    # The context is created once and reused by all the reconnects.
     mqtt_client = MQTT.MQTT(
         broker=broker,
         port=port,
         socket_pool=pool,
-        ssl_context=ssl.create_default_context(),
+        is_ssl=transport == TLS,
+        ssl_context=ssl_context(transport, ca_file),
+        keep_alive=keep_alive,
         user_data=user_data,
         socket_timeout=socket_timeout,
+        use_binary_mode=use_binary_mode,
     )
     # Connect callback handlers to mqtt_client
     mqtt_client.on_connect = connect
@@ -67,9 +149,31 @@ def mqtt_client_setup(pool, broker, port, log_level, user_data=None, socket_time
     return mqtt_client
 
 
-def mqtt_publish_robust(mqtt_client, mqtt_topic, data):
+def _measure(mqtt_client, connect_func):
+    user_data = getattr(mqtt_client, "user_data", None)
+    if isinstance(user_data, dict) and CONNECT_STATS in user_data:
+        return user_data[CONNECT_STATS].measure(connect_func)
+    return connect_func()
+
+
+def mqtt_connect(mqtt_client):
+    """
+    Connect to the broker, recording the latency if the user data has ConnectStats.
+    """
+    return _measure(mqtt_client, mqtt_client.connect)
+
+
+def mqtt_reconnect(mqtt_client):
+    """
+    Reconnect to the broker, recording the latency if the user data has ConnectStats.
+    """
+    return _measure(mqtt_client, mqtt_client.reconnect)
+
+
+def mqtt_publish_robust(mqtt_client, mqtt_topic, data, retain=False):
     """
     publish message to MQTT broker. Reconnect on error.
+    :param retain: whether the broker should retain the message
     """
     logger = logging.getLogger(MQTT_LOGGER_NAME)
 
@@ -81,10 +185,11 @@ def mqtt_publish_robust(mqtt_client, mqtt_topic, data):
         mqtt_client.publish(
             mqtt_topic,
             data,
+            retain=retain,
         )
     except OSError as os_error:
         logger.error(f"failed to publish MQTT message: {os_error}")
-        mqtt_client.reconnect()
+        mqtt_reconnect(mqtt_client)
     except MQTT.MMQTTException as mqtt_exception:
         logger.error(f"failed to publish MQTT message: {mqtt_exception}")
-        mqtt_client.reconnect()
+        mqtt_reconnect(mqtt_client)
@@ -0,0 +1,123 @@
+"""
+display pages selectable with the buttons
+"""
+
+import displayio
+from adafruit_display_text import label
+
+from frame import set_label
+from sparkline import Sparkline
+
+DAY_NAMES = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+
+# Ranges of the chart series.
+CO2_RANGE = (400, 2000)
+DISTANCE_RANGE = (50, 150)
+
+CO2_COLOR = 0xFF8000
+DISTANCE_COLOR = 0x00FFFF
+
+# The index of the chart series.
+CO2_SERIES = 0
+DISTANCE_SERIES = 1
+
+# Page indexes, the buttons select the pages in this order.
+MAIN_PAGE = 0
+WEEK_PAGE = 1
+CHART_PAGE = 2
+
+# Used for placing the text on the display.
+BORDER = 5
+
+
+# pylint: disable=too-few-public-methods
+class Pages:
+    """
+    Switches between pages (groups) built upfront by hiding all but one of them,
+    so the switch is instant.
+    """
+
+    def __init__(self, groups):
+        self.groups = groups
+        self.current = None
+        self.show(0)
+
+    def show(self, index) -> bool:
+        """
+        :param index: page index, out of range values are clamped
+        :return: whether the page changed
+        """
+        index = min(max(index, 0), len(self.groups) - 1)
+        if index == self.current:
+            return False
+
+        for i, group in enumerate(self.groups):
+            group.hidden = i != index
+        self.current = index
+        return True
+
+
+def week_page(font, scale, color):
+    """
+    Page with the work time of each day of the week, in two columns.
+    :return: tuple of the group and the list of labels (one per day)
+    """
+    group = displayio.Group(scale=scale)
+    labels = []
+    for day, name in enumerate(DAY_NAMES):
+        day_label = label.Label(font, text=name, color=color)
+        line_height = day_label.bounding_box[3]
+        day_label.anchor_point = (0, 0)
+        day_label.anchored_position = (
+            BORDER // scale + (day // 4) * (9 * line_height // 2),
+            BORDER // scale + (day % 4) * line_height,
+        )
+        group.append(day_label)
+        labels.append(day_label)
+    return group, labels
+
+
+def refresh_week(labels, week_log, cache) -> bool:
+    """
+    Update the work time of the days that changed.
+    :param cache: TextCache instance
+    :return: whether any of the labels changed
+    """
+    changed = False
+    for day, day_label in enumerate(labels):
+        minutes = week_log.minutes(day)
+        if cache.changed(day_label, minutes):
+            changed |= set_label(
+                day_label, f"{DAY_NAMES[day]} {minutes // 60:2}:{minutes % 60:02}"
+            )
+    return changed
+
+
+def chart_page(font, width, height, color):
+    """
+    Page with the chart of CO2 and distance (desk height) with the legend on top.
+    :return: tuple of the group and the Sparkline instance
+    """
+    group = displayio.Group()
+    x = BORDER
+    for text, text_color in (
+        ("CO2", CO2_COLOR),
+        ("desk", DISTANCE_COLOR),
+        ("1h", color),
+    ):
+        legend = label.Label(font, text=text, color=text_color)
+        legend.anchor_point = (0, 0)
+        legend.anchored_position = (x, BORDER)
+        x += legend.bounding_box[2] + BORDER
+        group.append(legend)
+    top = 2 * BORDER + legend.bounding_box[3]
+
+    sparkline = Sparkline(
+        width,
+        height - top,
+        [CO2_RANGE, DISTANCE_RANGE],
+        [CO2_COLOR, DISTANCE_COLOR],
+        y=top,
+    )
+    group.append(sparkline.tile_grid)
+    return group, sparkline
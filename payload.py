@@ -0,0 +1,263 @@
+"""
+MQTT payload decoding that avoids building a full dict for each message
+"""
+
+import json
+import struct
+
+# Marker of the compact binary payload format. JSON payloads always start
+# with a printable character so the first byte is enough to tell the formats apart.
+COMPACT_VERSION = 0x01
+
+# Each compact record is (key ID, value) pair encoded as little endian
+# unsigned byte and float.
+COMPACT_RECORD_FMT = "<Bf"
+COMPACT_RECORD_SIZE = struct.calcsize(COMPACT_RECORD_FMT)
+
+# Key IDs used in the compact format. Never renumber these, only append.
+KEY_IDS = {
+    "co2_ppm": 1,
+    "temperature": 2,
+    "humidity": 3,
+    "current_power": 4,
+    "distance": 5,
+    "time_to_first_frame_ms": 7,
+    "time_to_connected_ms": 8,
+    "co2_slope_ppm_per_min": 9,
+    "stall_stage": 10,
+    "stall_duration_ms": 11,
+    "events": 12,
+    "session_seconds": 13,
+    "break_seconds": 14,
+    "boot_sensors_ms": 15,
+    "boot_font_ms": 16,
+    "boot_wifi_ms": 17,
+    "boot_mqtt_ms": 18,
+    "boot_ntp_ms": 19,
+    "boot_metrics_ms": 20,
+}
+
+# Records with this key ID carry annotation tag ID (see TAG_IDS) as the value.
+TAG_KEY_ID = 6
+
+# Tag IDs of annotations used in the compact format. Never renumber these, only append.
+TAG_IDS = {
+    "table_duration": 1,
+    "watchdog_stall": 2,
+    "table_up": 3,
+    "table_down": 4,
+    "session_start": 5,
+    "session_end": 6,
+    "break": 7,
+    "co2_episode_start": 8,
+    "co2_episode_end": 9,
+    "sensor_stale": 10,
+    "mqtt_reconnect": 11,
+}
+
+JSON = "json"
+COMPACT = "compact"
+ENCODINGS = [JSON, COMPACT]
+
+_SPACE = b" \t\r\n"
+_DIGITS = b"0123456789"
+
+
+# pylint: disable=too-few-public-methods
+class PayloadDecoder:
+    """
+    Extracts preselected numeric keys from MQTT message payloads.
+
+    JSON payloads are scanned for the keys directly. If the value of any key
+    is not a plain number (e.g. null or nested object), the decoder falls back
+    to json.loads() for the whole message. Compact binary payloads
+    (see encode_compact()) are decoded using the key IDs.
+
+    The values are stored into preallocated list (self.values)
+    in the order of the keys, with None for keys that were not present.
+    The scanning assumes flat JSON objects, which is what the publishers produce.
+    """
+
+    def __init__(self, keys):
+        """
+        :param keys: sequence of keys to extract
+        """
+        self.keys = tuple(keys)
+        self._needles = tuple(b'"' + k.encode() + b'"' for k in self.keys)
+        self._ids = tuple(KEY_IDS.get(k) for k in self.keys)
+        self.values = [None] * len(self.keys)
+
+    def decode(self, msg):
+        """
+        Decode the payload into self.values.
+        :param msg: message payload (bytes or str)
+        :return: the list of values
+        :raises ValueError: if the message cannot be parsed
+        """
+        if isinstance(msg, str):
+            msg = msg.encode()
+
+        for i, _ in enumerate(self.values):
+            self.values[i] = None
+
+        if len(msg) > 0 and msg[0] == COMPACT_VERSION:
+            self._decode_compact(msg)
+            return self.values
+
+        for i, needle in enumerate(self._needles):
+            pos = msg.find(needle)
+            if pos < 0:
+                continue
+            value = _scan_number(msg, pos + len(needle))
+            if value is None:
+                return self._decode_json(msg)
+            self.values[i] = value
+
+        return self.values
+
+    def _decode_compact(self, msg):
+        if (len(msg) - 1) % COMPACT_RECORD_SIZE != 0:
+            raise ValueError("truncated compact payload")
+
+        for offset in range(1, len(msg), COMPACT_RECORD_SIZE):
+            key_id, value = struct.unpack_from(COMPACT_RECORD_FMT, msg, offset)
+            for i, wanted_id in enumerate(self._ids):
+                if wanted_id == key_id:
+                    self.values[i] = value
+
+    def _decode_json(self, msg):
+        metrics = json.loads(msg)
+        if not isinstance(metrics, dict):
+            raise ValueError(f"not a JSON object: {msg}")
+        for i, key in enumerate(self.keys):
+            self.values[i] = metrics.get(key)
+        return self.values
+
+
+# pylint: disable=too-many-branches
+def _scan_number(msg, pos):
+    """
+    Parse JSON number following the colon after position in the message.
+    :return: int or float or None if the value is not a number
+    """
+    size = len(msg)
+    while pos < size and msg[pos] in _SPACE:
+        pos += 1
+    if pos >= size or msg[pos] != ord(":"):
+        return None
+    pos += 1
+    while pos < size and msg[pos] in _SPACE:
+        pos += 1
+
+    negative = False
+    if pos < size and msg[pos] == ord("-"):
+        negative = True
+        pos += 1
+
+    start = pos
+    mantissa = 0
+    while pos < size and msg[pos] in _DIGITS:
+        mantissa = mantissa * 10 + msg[pos] - 48
+        pos += 1
+    if pos == start:
+        return None
+
+    is_float = False
+    exponent = 0
+    if pos < size and msg[pos] == ord("."):
+        is_float = True
+        pos += 1
+        while pos < size and msg[pos] in _DIGITS:
+            mantissa = mantissa * 10 + msg[pos] - 48
+            exponent -= 1
+            pos += 1
+    if pos < size and msg[pos] in b"eE":
+        is_float = True
+        pos += 1
+        exp_sign = 1
+        if pos < size and msg[pos] in b"+-":
+            if msg[pos] == ord("-"):
+                exp_sign = -1
+            pos += 1
+        exp_value = 0
+        while pos < size and msg[pos] in _DIGITS:
+            exp_value = exp_value * 10 + msg[pos] - 48
+            pos += 1
+        exponent += exp_sign * exp_value
+
+    if pos < size and msg[pos] not in b",} \t\r\n":
+        return None
+
+    if negative:
+        mantissa = -mantissa
+    if not is_float:
+        return mantissa
+    if exponent < 0:
+        return mantissa / 10**-exponent
+    return float(mantissa * 10**exponent)
+
+
+def encode_compact(metrics):
+    """
+    Encode dictionary of numeric metrics into the compact binary format.
+    Keys without assigned ID are skipped. The "tags" value (list of annotation tags)
+    is encoded as records with the TAG_KEY_ID key ID.
+    :return: bytes
+    :raises ValueError: if some of the tags does not have assigned ID
+    """
+    records = [(KEY_IDS[k], v) for k, v in metrics.items() if k in KEY_IDS]
+    for tag in metrics.get("tags", ()):
+        if tag not in TAG_IDS:
+            raise ValueError(f"tag without ID: {tag}")
+        records.append((TAG_KEY_ID, TAG_IDS[tag]))
+    buf = bytearray(1 + COMPACT_RECORD_SIZE * len(records))
+    buf[0] = COMPACT_VERSION
+    for i, (key_id, value) in enumerate(records):
+        struct.pack_into(
+            COMPACT_RECORD_FMT, buf, 1 + i * COMPACT_RECORD_SIZE, key_id, value
+        )
+    return bytes(buf)
+
+
+def decode_compact(msg):
+    """
+    Decode payload in the compact binary format into dictionary
+    with the same structure as the JSON messages. Unknown key/tag IDs are skipped.
+    :return: dictionary
+    :raises ValueError: if the payload is not valid
+    """
+    if len(msg) == 0 or msg[0] != COMPACT_VERSION:
+        raise ValueError("unsupported compact payload version")
+    if (len(msg) - 1) % COMPACT_RECORD_SIZE != 0:
+        raise ValueError("truncated compact payload")
+
+    names = {v: k for k, v in KEY_IDS.items()}
+    tag_names = {v: k for k, v in TAG_IDS.items()}
+    metrics = {}
+    for offset in range(1, len(msg), COMPACT_RECORD_SIZE):
+        key_id, value = struct.unpack_from(COMPACT_RECORD_FMT, msg, offset)
+        if key_id == TAG_KEY_ID:
+            tag = tag_names.get(int(value))
+            if tag is not None:
+                metrics["annotation"] = True
+                metrics.setdefault("tags", []).append(tag)
+        elif key_id in names:
+            metrics[names[key_id]] = value
+    return metrics
+
+
+def encode_message(metrics, encoding=JSON):
+    """
+    Encode dictionary with metrics to be published over MQTT.
+    Messages that cannot be encoded in the compact format (annotations with tags
+    without assigned ID) are encoded as JSON so that they are not lost.
+    :param encoding: one of ENCODINGS
+    :return: str for JSON, bytes for the compact encoding
+    """
+    if encoding == COMPACT:
+        try:
+            return encode_compact(metrics)
+        except ValueError:
+            pass
+
+    return json.dumps(metrics)
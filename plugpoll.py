@@ -0,0 +1,237 @@
+"""
+Polls power plug with local HTTP API returning JSON (e.g. Shelly or Tasmota),
+as an alternative to receiving the power via MQTT.
+
+The poller is driven from the main loop via poll(). Only connecting blocks
+(for up to the timeout), the request is sent and the response read
+in as many poll() calls as needed. The connection is kept alive between the polls.
+
+Works with CircuitPython socketpool as well as with the CPython socket module.
+"""
+
+import errno
+import json
+
+import adafruit_logging as logging
+
+from clock import CLOCK
+from handlers import POWER
+
+
+def _would_block(os_error):
+    return os_error.errno in (errno.EAGAIN, errno.ETIMEDOUT)
+
+
+def parse_url(url):
+    """
+    :return: tuple of host, port and path
+    :raises ValueError: if the URL is not valid plain HTTP URL
+    """
+    prefix = "http://"
+    if not url.startswith(prefix):
+        raise ValueError(f"only {prefix} URLs are supported: {url}")
+    host, _, path = url[len(prefix) :].partition("/")  # noqa: E203
+    port = 80
+    if ":" in host:
+        host, port = host.split(":")
+        port = int(port)
+    if not host:
+        raise ValueError(f"missing host: {url}")
+    return host, port, "/" + path
+
+
+def get_value(data, path):
+    """
+    :param path: dot separated keys of the value in nested dictionaries
+    :return: the value
+    :raises ValueError: if the value is not found or is not a number
+    """
+    for key in path.split("."):
+        if not isinstance(data, dict) or key not in data:
+            raise ValueError(f"{path} not found")
+        data = data[key]
+    if isinstance(data, bool) or not isinstance(data, (int, float)):
+        raise ValueError(f"{path} is not a number: {data}")
+    return data
+
+
+# pylint: disable=too-many-instance-attributes
+class PowerPoller:
+    """
+    Periodically fetches the power from the plug and stores it to the user data.
+    """
+
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    def __init__(
+        self, pool, url, path, interval=10, timeout=2, buffer_size=1024, clock=CLOCK
+    ):
+        """
+        :param pool: socketpool.SocketPool instance or the socket module,
+        can be set later via the pool attribute
+        :param url: plain HTTP URL returning JSON with the power in Watts
+        :param path: dot separated keys of the power value in the JSON
+        :param interval: seconds between the polls
+        :param timeout: seconds after which unfinished request is dropped
+        :raises ValueError: if the URL is not valid
+        """
+        self.pool = pool
+        self._host, self._port, url_path = parse_url(url)
+        self._path = path
+        self._interval_ns = interval * 1_000_000_000
+        self._timeout = timeout
+        self._timeout_ns = timeout * 1_000_000_000
+        self._clock = clock
+
+        self._request = (
+            f"GET {url_path} HTTP/1.1\r\nHost: {self._host}\r\n"
+            + "Connection: keep-alive\r\n\r\n"
+        ).encode()
+        self._response = bytearray(buffer_size)
+        self._response_view = memoryview(self._response)
+
+        self._socket = None
+        self._reused = False
+        self._received = 0
+        # Start of the current request or None if there is none in flight.
+        self._request_stamp = None
+        # Monotonic time when the next request is due.
+        self._next_poll_ns = 0
+
+        self.polls = 0
+        self.failures = 0
+        self.connects = 0
+        # Duration of the last successful poll in milliseconds.
+        self.last_ms = None
+        self.max_ms = 0
+
+    def poll(self, user_data, now_ns=None):
+        """
+        Make progress with the current request or start new one if it is time.
+        Should be called from the main loop.
+        :param now_ns: current monotonic time in nanoseconds, if already known
+        """
+        if self.pool is None:
+            return
+
+        now = self._clock.monotonic_ns() if now_ns is None else now_ns
+        if self._request_stamp is None:
+            # Compared with the deadline so that no big number is computed while idle.
+            if now < self._next_poll_ns:
+                return
+            self._next_poll_ns = now + self._interval_ns
+            self._start(now)
+            return
+
+        try:
+            self._read(user_data)
+        except OSError as os_error:
+            if not _would_block(os_error):
+                self._fail(f"failed to read from {self._host}: {os_error}")
+                return
+        except ValueError as value_error:
+            self._fail(f"invalid response from {self._host}: {value_error}")
+            return
+
+        if (
+            self._request_stamp is not None
+            and now - self._request_stamp > self._timeout_ns
+        ):
+            self._fail(f"request to {self._host} timed out")
+
+    def close(self):
+        """
+        close the connection (if any)
+        """
+        if self._socket is not None:
+            try:
+                self._socket.close()
+            except OSError:
+                pass
+            self._socket = None
+        self._request_stamp = None
+
+    def _connect(self):
+        addr = self.pool.getaddrinfo(self._host, self._port)[0][4]
+        self._socket = self.pool.socket(self.pool.AF_INET, self.pool.SOCK_STREAM)
+        self._socket.settimeout(self._timeout)
+        self._socket.connect(addr)
+        self._socket.setblocking(False)
+        self.connects += 1
+
+    def _start(self, stamp):
+        self._request_stamp = stamp
+        self._received = 0
+        self._reused = self._socket is not None
+        if self._socket is None:
+            try:
+                self._connect()
+            except OSError as os_error:
+                self._fail(f"failed to connect to {self._host}: {os_error}")
+                return
+        try:
+            self._socket.send(self._request)
+        except OSError as os_error:
+            self._retry(f"failed to send request to {self._host}: {os_error}")
+
+    def _retry(self, message):
+        """
+        The connection kept alive might have been closed by the plug in the meantime,
+        so retry once with new connection.
+        """
+        if not self._reused:
+            self._fail(message)
+            return
+        stamp = self._request_stamp
+        self.close()
+        self._start(stamp)
+
+    def _read(self, user_data):
+        count = self._socket.recv_into(
+            self._response_view[self._received :]  # noqa: E203
+        )
+        if count == 0:
+            if self._received == 0:
+                self._retry(f"connection to {self._host} closed")
+                return
+            raise ValueError("connection closed")
+        self._received += count
+
+        header_end = self._response.find(b"\r\n\r\n", 0, self._received)
+        if header_end < 0:
+            if self._received == len(self._response):
+                raise ValueError("response header too big")
+            return
+
+        header = bytes(self._response_view[:header_end]).lower()
+        if not header.startswith(b"http/1.1 200") and not header.startswith(
+            b"http/1.0 200"
+        ):
+            raise ValueError(f"unexpected status: {header[:12]}")
+        length_start = header.find(b"content-length:")
+        if length_start < 0:
+            raise ValueError("missing content length")
+        length_end = header.find(b"\r\n", length_start)
+        if length_end < 0:
+            length_end = len(header)
+        length = int(header[length_start + 15 : length_end])  # noqa: E203
+        body_start = header_end + 4
+        if body_start + length > len(self._response):
+            raise ValueError("response too big")
+        if self._received < body_start + length:
+            return
+
+        body = self._response_view[body_start : body_start + length]  # noqa: E203
+        value = get_value(json.loads(bytes(body)), self._path)
+        user_data[POWER] = value
+
+        self.last_ms = (self._clock.monotonic_ns() - self._request_stamp) // 1_000_000
+        self.max_ms = max(self.max_ms, self.last_ms)
+        self.polls += 1
+        self._request_stamp = None
+        if b"connection: close" in header or header.startswith(b"http/1.0"):
+            self.close()
+
+    def _fail(self, message):
+        logging.getLogger(__name__).warning(message)
+        self.failures += 1
+        self.close()
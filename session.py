@@ -0,0 +1,131 @@
+"""
+work session and break detection
+"""
+
+import adafruit_logging as logging
+
+from clock import CLOCK
+
+SESSION_START = "session_start"
+SESSION_END = "session_end"
+BREAK = "break"
+
+_NO_EVENTS = ()
+
+
+class SessionTracker:
+    """
+    Turns noisy on/off readings into work sessions and breaks.
+
+    The session starts only after the power has been on for the minimum on-dwell time
+    and ends only after it has been off for the minimum break duration,
+    so short blips in either direction are ignored. The start and end
+    of the session are backdated to the first reading of the change.
+    """
+
+    def __init__(self, clock=CLOCK):
+        self.clock = clock
+        self.in_session = False
+        # Start of the current session or break (monotonic ns).
+        self._stamp = None
+        # First reading contradicting the current state (monotonic ns).
+        self._change_stamp = None
+
+    def update(self, power_on, min_on, min_break):
+        """
+        :param power_on: current reading
+        :param min_on: minimum on-dwell time in seconds to start a session
+        :param min_break: minimum off time in seconds to end a session
+        :return: tuple of (event, duration in seconds) tuples,
+        the duration being the length of the preceding break (BREAK event),
+        the ended session (SESSION_END) or None (SESSION_START)
+        """
+        logger = logging.getLogger(__name__)
+
+        now = self.clock.monotonic_ns()
+        if power_on == self.in_session:
+            self._change_stamp = None
+            return _NO_EVENTS
+
+        if self._change_stamp is None:
+            self._change_stamp = now
+
+        dwell = (now - self._change_stamp) / 1_000_000_000
+        if power_on:
+            if dwell < min_on:
+                return _NO_EVENTS
+            events = ((SESSION_START, None),)
+            if self._stamp is not None:
+                break_duration = (self._change_stamp - self._stamp) / 1_000_000_000
+                events = ((BREAK, break_duration), (SESSION_START, None))
+        else:
+            if dwell < min_break:
+                return _NO_EVENTS
+            events = (
+                (SESSION_END, (self._change_stamp - self._stamp) / 1_000_000_000),
+            )
+
+        self.in_session = power_on
+        self._stamp = self._change_stamp
+        self._change_stamp = None
+        logger.info(f"session events: {events}")
+        return events
+
+    def duration(self):
+        """
+        :return: duration of the current session (or break) in seconds, 0 if unknown
+        """
+        if self._stamp is None:
+            return 0
+        return (self.clock.monotonic_ns() - self._stamp) / 1_000_000_000
+
+    def restore(self, in_session, duration):
+        """
+        Restore the state, e.g. after reset.
+        :param duration: duration of the current session (or break) in seconds
+        or None if not known
+        """
+        self.in_session = in_session
+        self._change_stamp = None
+        self._stamp = None
+        if duration is not None:
+            self._stamp = self.clock.monotonic_ns() - int(duration * 1_000_000_000)
+
+
+class WeekLog:
+    """
+    Work time for each day of the last week. The time of the day is zeroed
+    when the day comes again.
+    """
+
+    def __init__(self, clock=CLOCK):
+        self.clock = clock
+        # Nanoseconds per day of the week (0 is Monday).
+        self._durations = [0] * 7
+        self._weekday = None
+        self._stamp = None
+
+    def update(self, in_session, weekday):
+        """
+        Account the time since the previous update to the current day
+        if the session is in progress.
+        :param weekday: current day of the week (0 is Monday) or None if not known
+        """
+        if weekday is None:
+            return
+
+        now = self.clock.monotonic_ns()
+        if weekday != self._weekday:
+            if self._weekday is not None:
+                self._durations[weekday] = 0
+            self._weekday = weekday
+        if self._stamp is not None:
+            # The session was in progress since the previous update.
+            self._durations[weekday] += now - self._stamp
+        self._stamp = now if in_session else None
+
+    def minutes(self, weekday):
+        """
+        :return: work time of the day in minutes
+        """
+        return self._durations[weekday] // 60_000_000_000
@@ -0,0 +1,303 @@
+"""
+snapshot of the live state so that it can be restored after reset
+"""
+
+import json
+import math
+import struct
+
+import adafruit_logging as logging
+
+from clock import CLOCK
+from handlers import CO2, HUMIDITY, LAST_UPDATE, POWER, TEMPERATURE
+
+TABLE = "table"
+TABLE_DURATION = "table_duration"
+IN_SESSION = "in_session"
+SESSION_DURATION = "session_duration"
+ENV_AGE = "env_age"
+# Wall clock time (seconds since the Epoch) of the snapshot, 0 if not known.
+TIME = "time"
+
+# Snapshots older than this (in seconds) are not restored.
+MAX_AGE = 900
+
+# user_data keys for the state received on the retained state topic.
+RETAINED_STATE = "retained_state"
+_STATE_RECEIVED = "state_received"
+
+# The record persisted in the NVM: magic, flags, table state duration,
+# session duration, CO2, temperature, humidity, power, age of the environment
+# metrics, wall clock time. Missing values are stored as NaN (or as 0xFFFFFFFF).
+_RECORD_FMT = "<BBIIffffII"
+_MAGIC = 0x53
+_FLAG_TABLE = 0x01
+_FLAG_TABLE_UP = 0x02
+_FLAG_IN_SESSION = 0x04
+_NONE = 0xFFFFFFFF
+NVM_SIZE = struct.calcsize(_RECORD_FMT)
+
+_ENV_KEYS = (CO2, TEMPERATURE, HUMIDITY)
+
+
+# pylint: disable=too-many-arguments,too-many-positional-arguments
+def capture(table_state, session, user_data, wall_s=0, clock=CLOCK):
+    """
+    :param table_state: BinaryState instance tracking the table state
+    :param session: SessionTracker instance
+    :param wall_s: current wall clock time in seconds since the Epoch or 0 if not known
+    :return: the state as dictionary
+    """
+    state = {
+        TABLE: table_state.prev_state,
+        TABLE_DURATION: int(table_state.state_duration),
+        IN_SESSION: session.in_session,
+        SESSION_DURATION: int(session.duration()),
+        POWER: user_data.get(POWER),
+        ENV_AGE: None,
+        TIME: wall_s,
+    }
+    for key in _ENV_KEYS:
+        state[key] = user_data.get(key)
+    if user_data.get(LAST_UPDATE) is not None:
+        state[ENV_AGE] = (
+            clock.monotonic_ns() - user_data[LAST_UPDATE]
+        ) // 1_000_000_000
+    return state
+
+
+# pylint: disable=too-many-arguments,too-many-positional-arguments
+def restore(state, table_state, session, user_data, wall_s=0, clock=CLOCK) -> bool:
+    """
+    Restore the state unless it is too old.
+    :param wall_s: current wall clock time in seconds since the Epoch or 0 if not known,
+    in which case the time since the snapshot is assumed to be negligible.
+    If known, snapshots without the time are not restored.
+    :return: whether the state was restored
+    """
+    logger = logging.getLogger(__name__)
+
+    downtime = 0
+    if wall_s:
+        if not state.get(TIME):
+            # Taken before the time was known, could be arbitrarily old.
+            logger.info("not restoring snapshot of unknown age")
+            return False
+        downtime = wall_s - state[TIME]
+    if not 0 <= downtime <= MAX_AGE:
+        logger.info(f"not restoring snapshot taken {downtime} seconds ago")
+        return False
+
+    if state.get(TABLE) is not None:
+        table_state.restore(state[TABLE], state[TABLE_DURATION] + downtime)
+    session_duration = state.get(SESSION_DURATION)
+    session.restore(
+        bool(state.get(IN_SESSION)),
+        session_duration + downtime if session_duration is not None else None,
+    )
+    if state.get(POWER) is not None:
+        user_data[POWER] = state[POWER]
+    if state.get(ENV_AGE) is not None:
+        for key in _ENV_KEYS:
+            user_data[key] = state.get(key)
+        user_data[LAST_UPDATE] = (
+            clock.monotonic_ns() - (state[ENV_AGE] + downtime) * 1_000_000_000
+        )
+    logger.info(f"restored snapshot taken {downtime} seconds ago: {state}")
+    return True
+
+
+def _float(value):
+    return math.nan if value is None else value
+
+
+def _value(value):
+    return None if math.isnan(value) else value
+
+
+def pack(state):
+    """
+    :return: the state encoded as compact record
+    """
+    flags = 0
+    if state[TABLE] is not None:
+        flags |= _FLAG_TABLE
+        if state[TABLE] == "up":
+            flags |= _FLAG_TABLE_UP
+    if state[IN_SESSION]:
+        flags |= _FLAG_IN_SESSION
+    return struct.pack(
+        _RECORD_FMT,
+        _MAGIC,
+        flags,
+        state[TABLE_DURATION],
+        state[SESSION_DURATION],
+        _float(state[CO2]),
+        _float(state[TEMPERATURE]),
+        _float(state[HUMIDITY]),
+        _float(state[POWER]),
+        _NONE if state[ENV_AGE] is None else state[ENV_AGE],
+        state[TIME],
+    )
+
+
+def unpack(data):
+    """
+    :return: the state decoded from the compact record or None if not valid
+    """
+    if len(data) < NVM_SIZE:
+        return None
+    (
+        magic,
+        flags,
+        table_duration,
+        session_duration,
+        co2,
+        temperature,
+        humidity,
+        power,
+        env_age,
+        wall_s,
+    ) = struct.unpack(_RECORD_FMT, bytes(data[:NVM_SIZE]))
+    if magic != _MAGIC:
+        return None
+
+    table = None
+    if flags & _FLAG_TABLE:
+        table = "up" if flags & _FLAG_TABLE_UP else "down"
+    return {
+        TABLE: table,
+        TABLE_DURATION: table_duration,
+        IN_SESSION: bool(flags & _FLAG_IN_SESSION),
+        SESSION_DURATION: session_duration,
+        CO2: _value(co2),
+        TEMPERATURE: _value(temperature),
+        HUMIDITY: _value(humidity),
+        POWER: _value(power),
+        ENV_AGE: None if env_age == _NONE else env_age,
+        TIME: wall_s,
+    }
+
+
+def to_message(state):
+    """
+    :return: the state as JSON message (for the retained state topic)
+    """
+    return json.dumps(state)
+
+
+def from_message(msg):
+    """
+    :return: the state decoded from JSON message or None if not valid
+    """
+    try:
+        state = json.loads(msg)
+    except ValueError:
+        return None
+    if not isinstance(state, dict) or TABLE_DURATION not in state:
+        return None
+    return state
+
+
+# pylint: disable=unused-argument
+def on_message_with_state(mqtt, topic, msg):
+    """
+    Handle message on the retained state topic. Only the first message counts,
+    i.e. the one retained by the broker, the others are the snapshots published by this device.
+    """
+    if mqtt.user_data.get(_STATE_RECEIVED):
+        return
+    ignore_state_messages(mqtt.user_data)
+
+    state = from_message(msg)
+    if state is None:
+        logging.getLogger(__name__).warning(f"invalid state message: {msg}")
+        return
+    mqtt.user_data[RETAINED_STATE] = state
+
+
+def ignore_state_messages(user_data):
+    """
+    Ignore the subsequent messages on the retained state topic. To be called before
+    publishing the first snapshot, as the device receives its own snapshots as well.
+    """
+    user_data[_STATE_RECEIVED] = True
+
+
+class WarmStart:
+    """
+    Restores the newest of the offered snapshots.
+    """
+
+    # pylint: disable=too-few-public-methods
+    def __init__(self, table_state, session, user_data, clock=CLOCK):
+        self._table_state = table_state
+        self._session = session
+        self._user_data = user_data
+        self._clock = clock
+        # Wall clock time of the restored snapshot (0 if not known) or None.
+        self.restored = None
+
+    def offer(self, state, wall_s=0) -> bool:
+        """
+        Restore the state if it is newer than the one restored so far.
+        :param state: the state or None
+        :param wall_s: current wall clock time in seconds since the Epoch or 0 if not known
+        :return: whether the state was restored
+        """
+        if state is None:
+            return False
+        stamp = state.get(TIME, 0)
+        if self.restored is not None and stamp <= self.restored:
+            return False
+        if not restore(
+            state,
+            self._table_state,
+            self._session,
+            self._user_data,
+            wall_s,
+            self._clock,
+        ):
+            return False
+        self.restored = stamp
+        return True
+
+
+class SnapshotStore:
+    """
+    Keeps the snapshot in the NVM. The NVM is backed by flash memory
+    with limited number of writes, so the record is written only if it changed
+    and the snapshots should be taken sparingly.
+    """
+
+    def __init__(self, nvm, offset=0):
+        """
+        :param nvm: byte array like object surviving reset (microcontroller.nvm)
+        :param offset: offset of the record in the NVM (occupies NVM_SIZE bytes)
+        """
+        self._nvm = nvm
+        self._offset = offset
+        # Function returning the current state, set once the state exists.
+        self.source = None
+
+    def save(self, state=None):
+        """
+        :param state: the state to save, if None it is obtained from the source
+        :return: the state or None if there is nothing to save
+        """
+        if state is None:
+            if self.source is None:
+                return None
+            state = self.source()
+
+        data = pack(state)
+        end = self._offset + NVM_SIZE
+        if bytes(self._nvm[self._offset : end]) != data:  # noqa: E203
+            self._nvm[self._offset : end] = data  # noqa: E203
+        return state
+
+    def load(self):
+        """
+        :return: the saved state or None
+        """
+        return unpack(self._nvm[self._offset : self._offset + NVM_SIZE])  # noqa: E203
@@ -0,0 +1,89 @@
+"""
+chart of recent values drawn incrementally
+"""
+
+import displayio
+
+
+# pylint: disable=too-many-instance-attributes
+class Sparkline:
+    """
+    Chart of the last width samples of one or more series, scrolling to the left.
+
+    The bitmap is twice as wide as the chart and each column is drawn twice,
+    at its position in the ring and one chart width further. Adding a sample
+    thus means drawing just the new column and moving the TileGrid to the left
+    by one pixel (wrapping around once the ring is full) so that the visible
+    part of the bitmap always ends with the newest column. The older columns
+    are never redrawn so the cost of the update does not depend on the width.
+
+    The rest of the bitmap is not clipped, so the chart has to span the whole
+    width of the display.
+    """
+
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    def __init__(self, width, height, ranges, colors, x=0, y=0):
+        """
+        :param width: number of samples (and pixels) shown
+        :param ranges: list of (low, high) tuples, one for each series
+        :param colors: list of colors, one for each series
+        """
+        if len(ranges) != len(colors):
+            raise ValueError("need one color for each range")
+
+        self.width = width
+        self.height = height
+        self._ranges = ranges
+        self._x = x
+
+        self.bitmap = displayio.Bitmap(2 * width, height, len(colors) + 1)
+        palette = displayio.Palette(len(colors) + 1)
+        palette[0] = 0x000000
+        palette.make_transparent(0)
+        for i, color in enumerate(colors):
+            palette[i + 1] = color
+        self.tile_grid = displayio.TileGrid(self.bitmap, pixel_shader=palette, x=x, y=y)
+
+        # Preallocated so that the update does not allocate.
+        self._values = [None] * len(ranges)
+        self._last_rows = [None] * len(ranges)
+        self._head = 0
+
+    def set(self, series, value):
+        """
+        Set the value of the series for the next column. Series without value
+        are not drawn in the column.
+        """
+        self._values[series] = value
+
+    def _row(self, series, value):
+        low, high = self._ranges[series]
+        value = min(max(value, low), high)
+        return self.height - 1 - int((value - low) * (self.height - 1) / (high - low))
+
+    def _draw(self, column, row_from, row_to, color_index):
+        for row in range(min(row_from, row_to), max(row_from, row_to) + 1):
+            self.bitmap[column, row] = color_index
+            self.bitmap[column + self.width, row] = color_index
+
+    def advance(self):
+        """
+        Draw the column with the values set since the last call and scroll
+        the chart by one column.
+        """
+        column = self._head
+        self._draw(column, 0, self.height - 1, 0)
+        for series, value in enumerate(self._values):
+            if value is None:
+                self._last_rows[series] = None
+                continue
+
+            row = self._row(series, value)
+            # Connect with the previous value so that steep changes are visible.
+            last_row = self._last_rows[series]
+            self._draw(column, row if last_row is None else last_row, row, series + 1)
+            self._last_rows[series] = row
+            self._values[series] = None
+
+        self._head = (column + 1) % self.width
+        self.tile_grid.x = self._x - self._head
@@ -0,0 +1,141 @@
+"""
+main loop stall detection with attribution to the stage of the loop
+"""
+
+import struct
+
+import adafruit_logging as logging
+
+from clock import CLOCK
+
+# Stages of the main loop (and the startup). The values are persisted
+# and published so never renumber these, only append.
+STAGE_LOOP = 0
+STAGE_WIFI = 1
+STAGE_MQTT = 2
+STAGE_NTP = 3
+STAGE_METRICS = 4
+STAGE_BUTTONS = 5
+STAGE_DISTANCE = 6
+STAGE_DISPLAY = 7
+STAGE_SNAPSHOT = 8
+STAGE_PLUG = 9
+
+STAGES = (
+    "loop",
+    "wifi",
+    "mqtt",
+    "ntp",
+    "metrics",
+    "buttons",
+    "distance",
+    "display",
+    "snapshot",
+    "plug",
+)
+
+STALL_STAGE = "stall_stage"
+STALL_DURATION = "stall_duration_ms"
+STALL_TAG = "watchdog_stall"
+
+# The record persisted in the NVM: magic, stage index, stall duration in milliseconds.
+_RECORD_FMT = "<BBI"
+_MAGIC = 0x57
+NVM_SIZE = struct.calcsize(_RECORD_FMT)
+
+
+class StallWatch:
+    """
+    Feeds the watchdog on each change of the main loop stage and records
+    the stage that did not finish in time.
+
+    The watchdog is expected to be in the RAISE mode so that the WatchDogTimeout
+    exception can be caught, the stall recorded via record_stall() and the
+    microcontroller reset. The record survives the reset in the NVM
+    and can be retrieved after boot with load_stall().
+    """
+
+    def __init__(self, nvm, offset=0, clock=CLOCK):
+        """
+        :param nvm: byte array like object surviving reset (microcontroller.nvm)
+        :param offset: offset of the record in the NVM (occupies NVM_SIZE bytes)
+        """
+        self._nvm = nvm
+        self._offset = offset
+        self._clock = clock
+        self._wdt = None
+        self.stage = 0
+        self._stamp = clock.monotonic_ns()
+
+    def start(self, wdt, timeout, mode):
+        """
+        Start the watchdog.
+        :param wdt: watchdog object (microcontroller.watchdog)
+        :param timeout: watchdog timeout in seconds
+        :param mode: watchdog mode, should be WatchDogMode.RAISE
+        """
+        wdt.timeout = timeout
+        wdt.mode = mode
+        self._wdt = wdt
+        self._wdt.feed()
+        logging.getLogger(__name__).info(f"watchdog started with timeout {timeout}")
+
+    def stop(self):
+        """
+        Stop the watchdog, e.g. before deliberate long sleep.
+        """
+        if self._wdt is not None:
+            self._wdt.deinit()
+            self._wdt = None
+
+    def enter(self, stage, now_ns=None):
+        """
+        Mark the start of loop stage and feed the watchdog. Cheap enough
+        to be called multiple times per loop iteration.
+        :param stage: one of the stage constants
+        :param now_ns: current monotonic time in nanoseconds, if already known
+        (e.g. the start of the loop iteration, which makes the stall duration
+        include the preceding stages of the iteration)
+        """
+        self.stage = stage
+        self._stamp = self._clock.monotonic_ns() if now_ns is None else now_ns
+        if self._wdt is not None:
+            self._wdt.feed()
+
+    def record_stall(self):
+        """
+        Persist the current stage and the time spent in it.
+        :return: the stall metrics
+        """
+        duration_ms = (self._clock.monotonic_ns() - self._stamp) // 1_000_000
+        duration_ms = min(duration_ms, 0xFFFFFFFF)
+        self._nvm[self._offset : self._offset + NVM_SIZE] = struct.pack(  # noqa: E203
+            _RECORD_FMT, _MAGIC, self.stage, duration_ms
+        )
+        logging.getLogger(__name__).error(
+            f"stalled in stage {STAGES[self.stage]} for {duration_ms} ms"
+        )
+        return {STALL_STAGE: self.stage, STALL_DURATION: duration_ms}
+
+    def load_stall(self):
+        """
+        Retrieve the stall recorded before the reset and clear the record.
+        :return: annotation metrics suitable for publishing or None
+        """
+        magic, stage, duration_ms = struct.unpack(
+            _RECORD_FMT,
+            bytes(self._nvm[self._offset : self._offset + NVM_SIZE]),  # noqa: E203
+        )
+        if magic != _MAGIC:
+            return None
+
+        self._nvm[self._offset] = 0
+        logging.getLogger(__name__).warning(
+            f"previous run stalled in stage {stage} for {duration_ms} ms"
+        )
+        return {
+            "annotation": True,
+            "tags": [STALL_TAG],
+            STALL_STAGE: stage,
+            STALL_DURATION: duration_ms,
+        }
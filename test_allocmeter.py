@@ -0,0 +1,125 @@
+"""
+tests for the allocation accounting of the main loop logic
+"""
+
+import calendar
+import tracemalloc
+
+import pytest
+
+from allocmeter import AllocMeter
+from config import Config
+from test_config import SECRETS
+from tools.simulator import Simulator
+
+# Bytes per display update in the steady state. On CPython even the arithmetic
+# with big numbers (monotonic time in nanoseconds) allocates,
+# so these cannot be zero.
+TYPICAL_BUDGET = 64
+MAX_BUDGET = 512
+# Bytes per the other loop iterations: just the temporaries of the conversion
+# of the time to seconds.
+IDLE_BUDGET = 64
+# Now and then CPython misses its free lists (e.g. of tuples) regardless
+# of the loop, which costs a few more bytes in the odd iteration.
+FREE_LIST_SLACK = 64
+
+# Main loop iterations per second.
+LOOP_RATE = 10
+
+
+@pytest.fixture(name="traced")
+def fixture_traced():
+    """
+    trace the allocations for the duration of the test
+    """
+    tracemalloc.start()
+    yield
+    tracemalloc.stop()
+
+
+def test_meter(traced):  # pylint: disable=unused-argument
+    """
+    allocations are measured, garbage collection does not spoil the lap
+    """
+    meter = AllocMeter()
+    meter.lap()
+    data = bytearray(10_000)
+    assert meter.lap() >= 10_000
+    meter.collect()
+    assert meter.lap() < 1_000
+    assert meter.max >= 10_000
+    assert meter.laps == 3
+    del data
+
+
+def test_steady_state(traced):  # pylint: disable=unused-argument
+    """
+    Once the values settle, the periodic display update should not allocate
+    anything but small change and the other loop iterations (including the stall
+    watch, the blinker and the chart) nothing at all. On CircuitPython, each read
+    of the monotonic time allocates, so it should be read just once per iteration.
+    """
+    day_start = calendar.timegm((2024, 1, 15, 9, 0, 0, 0, 15, 0))
+    config = Config(dict(SECRETS, start_hr=8, end_hr=18))
+    simulator = Simulator(config, epoch=day_start)
+
+    def inputs(second):
+        if second % 10 == 0:
+            simulator.distance(50)
+            simulator.message(config.mqtt_topic_power, '{"current_power": 50}')
+        if second % 30 == 0:
+            # Above the threshold so that the blinker is busy.
+            simulator.message(
+                config.mqtt_topic_env,
+                '{"co2_ppm": 1300, "temperature": 23.1, "humidity": 40}',
+            )
+
+    reads = 0
+    monotonic_ns = simulator.clock.monotonic_ns
+
+    def counting_monotonic_ns():
+        nonlocal reads
+        reads += 1
+        return monotonic_ns()
+
+    simulator.clock.monotonic_ns = counting_monotonic_ns
+
+    # Warm up, e.g. to get the session started and the events published.
+    # CPython caches only the integers up to 256, so the measurement
+    # is done before the seconds since the start get past that.
+    meter = AllocMeter()
+    laps = []
+    idle_laps = []
+    for iteration in range(250 * LOOP_RATE):
+        if iteration % LOOP_RATE == 0:
+            inputs(iteration // LOOP_RATE)
+        display_update_stamp = simulator.display_update_stamp
+        chart_deadline = simulator.chart_deadline
+        reads = 0
+        meter.lap()
+        simulator.tick()
+        lap = meter.lap()
+        simulator.clock.advance(1 / LOOP_RATE)
+        if iteration < 100 * LOOP_RATE:
+            continue
+
+        if (
+            display_update_stamp == simulator.display_update_stamp
+            and chart_deadline == simulator.chart_deadline
+        ):
+            idle_laps.append(lap)
+            assert reads == 1
+        else:
+            laps.append(lap)
+
+    assert simulator.blinker.is_blinking
+    # Even an empty lap does not come for free.
+    meter.lap()
+    overhead = min(meter.lap() for _ in range(10))
+    idle_laps.sort()
+    assert idle_laps[len(idle_laps) * 99 // 100] - overhead <= IDLE_BUDGET, idle_laps
+    assert idle_laps[-1] - overhead <= IDLE_BUDGET + FREE_LIST_SLACK, idle_laps
+    laps.sort()
+    assert laps[len(laps) // 2] - overhead <= TYPICAL_BUDGET, laps
+    assert laps[-1] - overhead <= MAX_BUDGET, laps
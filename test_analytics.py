@@ -0,0 +1,152 @@
+"""
+tests for the offline analysis
+"""
+
+import calendar
+import json
+import time
+from argparse import Namespace
+
+import numpy as np
+import pytest
+
+from timeutil import dst_offset_eu
+from tools.analytics import analyze, dwell, load_series, local_time
+from tools.bench_analytics import analyze_loop, session_loop, synthesize
+
+PARAMS = Namespace(
+    distance_threshold=90,
+    power_threshold_watts=35,
+    break_threshold_seconds=1800,
+    tz_offset=1,
+    start_hr=8,
+    end_hr=18,
+    min_on=20,
+    min_break=60,
+    step=10,
+    max_age=60,
+)
+
+
+def test_local_time():
+    """
+    The vectorized local time has to match dst_offset_eu() from the device code.
+    """
+    timestamps = np.arange(
+        calendar.timegm((2023, 1, 1, 0, 0, 0)),
+        calendar.timegm((2026, 1, 1, 0, 0, 0)),
+        1799,
+    )
+    local = local_time(timestamps, 1)
+    for timestamp, result in zip(timestamps[::7], local[::7]):
+        expected = int(timestamp) + 3600
+        expected += dst_offset_eu(time.gmtime(expected)) * 3600
+        assert result == expected
+
+
+def test_session():
+    """
+    Standing for 20 minutes, sitting for 10, break for 10 minutes and another
+    5 minute session.
+    """
+    start = calendar.timegm((2024, 1, 8, 8, 0, 0))
+    timestamps = start + np.arange(0, 45 * 60, 10.0)
+    minutes = (timestamps - start) // 60
+    power = np.where((minutes < 30) | (minutes >= 40), 50.0, 0.0)
+    distance = np.where(minutes < 20, 110.0, 70.0)
+
+    result = analyze((timestamps, distance), (timestamps, power), PARAMS)
+    assert result["sessions"]["count"] == 2
+    assert result["sessions"]["max"] == 30 * 60
+    assert result["breaks"]["count"] == 1
+    assert result["standing"] == {"count": 1, "mean": 1200.0, "max": 1200.0}
+    assert result["sitting"]["count"] == 2
+    assert result["weeks"] == {
+        "2024-01-08": {
+            "worked": 35 * 60.0,
+            "standing": 20 * 60.0,
+            "sitting": 15 * 60.0,
+            "breaks": 1,
+        }
+    }
+
+
+def test_dwell_and_hours():
+    """
+    Short power off should not end a session, the session should end
+    with the working hours and the gap spanning the night should not count as a break.
+    """
+    start = calendar.timegm((2024, 1, 8, 16, 0, 0))
+    timestamps = start + np.arange(0, 17 * 3600, 10.0)
+    seconds = timestamps - start
+    # Power on from 17:00 local time till 19:00 with 30 seconds power off at 17:10,
+    # then from 8:30 next day till 10:00.
+    power = np.where(
+        (seconds < 600)
+        | ((seconds >= 630) & (seconds < 7200))
+        | (seconds >= 15.5 * 3600),
+        50.0,
+        0.0,
+    )
+    distance = np.full(len(timestamps), 70.0)
+
+    result = analyze((timestamps, distance), (timestamps, power), PARAMS)
+    assert result["sessions"] == {"count": 2, "mean": 4500.0, "max": 5400.0}
+    assert result["breaks"]["count"] == 0
+
+
+def test_dwell_matches_tracker():
+    """
+    The vectorized dwell should give the same result as session.SessionTracker.
+    """
+    rng = np.random.default_rng(1)
+    # Runs of random length so that some are shorter than the minimum dwell times.
+    working = np.repeat(rng.uniform(0, 1, 500) > 0.5, rng.integers(1, 12, 500))
+    assert list(dwell(working, PARAMS.min_on, PARAMS.min_break, PARAMS.step)) == (
+        session_loop(working, PARAMS)
+    )
+
+
+def test_matches_loop():
+    """
+    The vectorized analysis gives the same results as the pure Python loop.
+    """
+    distance_series, power_series = synthesize(21)
+    result = analyze(distance_series, power_series, PARAMS)
+    expected = analyze_loop(distance_series, power_series, PARAMS)
+    for key in ["sessions", "breaks", "standing", "sitting"]:
+        assert result[key] == pytest.approx(expected[key])
+    assert result["overdue_sessions"] == expected["overdue_sessions"]
+    assert result["weeks"] == expected["weeks"]
+    assert result["sessions"]["count"] > 0
+    assert len(result["weeks"]) == 3
+
+
+def test_load_series(tmp_path):
+    """
+    load CSV and Prometheus JSON
+    """
+    csv_path = tmp_path / "power.csv"
+    csv_path.write_text("timestamp,value\n20,2.5\n10,1.5\n", encoding="utf-8")
+    timestamps, values = load_series(str(csv_path))
+    assert list(timestamps) == [10, 20]
+    assert list(values) == [1.5, 2.5]
+
+    json_path = tmp_path / "distance.json"
+    json_path.write_text(
+        json.dumps(
+            {
+                "status": "success",
+                "data": {
+                    "resultType": "matrix",
+                    "result": [
+                        {"metric": {}, "values": [[10, "100"], [20, "80.5"]]},
+                    ],
+                },
+            }
+        ),
+        encoding="utf-8",
+    )
+    timestamps, values = load_series(str(json_path))
+    assert list(timestamps) == [10, 20]
+    assert list(values) == [100, 80.5]
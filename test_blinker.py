@@ -0,0 +1,148 @@
+"""
+tests for the Blinker class
+"""
+
+import pytest
+
+from blinker import Blinker
+from clock import VirtualClock
+from handlers import BLUE, COLOR_PRIORITY, GREEN, RED
+
+
+class CountingPixel:
+    """
+    neopixel stand-in counting the writes
+    """
+
+    def __init__(self):
+        self._brightness = 0
+        self.color = None
+        self.writes = 0
+
+    @property
+    def brightness(self):
+        """
+        :return: brightness
+        """
+        return self._brightness
+
+    @brightness.setter
+    def brightness(self, value):
+        self.writes += 1
+        self._brightness = value
+
+    def fill(self, color):
+        """
+        set the color
+        """
+        self.writes += 1
+        self.color = color
+
+    @property
+    def lit(self):
+        """
+        :return: the color the pixel is lit with or None
+        """
+        return self.color if self._brightness else None
+
+
+def run(blinker, clock, seconds, step=0.1):
+    """
+    tick the blinker for given time
+    :return: list of colors the pixel was lit with after each tick
+    """
+    colors = []
+    for _ in range(round(seconds / step)):
+        clock.advance(step)
+        blinker.tick()
+        colors.append(blinker.pixel.lit)
+    return colors
+
+
+def test_duration():
+    """
+    The pixel toggles according to the duration, independently of set_alert() calls.
+    """
+    clock = VirtualClock()
+    pixel = CountingPixel()
+    blinker = Blinker(pixel, duration=0.5, priorities=COLOR_PRIORITY, clock=clock)
+    blinker.set_alert(BLUE)
+    assert pixel.lit == BLUE
+
+    colors = run(blinker, clock, 2)
+    assert colors == [BLUE] * 4 + [None] * 5 + [BLUE] * 5 + [None] * 5 + [BLUE]
+    # 2 writes when lit, 1 when off
+    assert pixel.writes == 2 + 1 + 2 + 1 + 2
+
+
+def test_priority():
+    """
+    The highest priority alert wins regardless of the order.
+    """
+    clock = VirtualClock()
+    pixel = CountingPixel()
+    blinker = Blinker(pixel, priorities=COLOR_PRIORITY, clock=clock)
+    blinker.set_alert(RED)
+    blinker.set_alert(GREEN)
+    blinker.set_alert(BLUE)
+    assert blinker.color == RED
+    assert set(run(blinker, clock, 3)) == {RED, None}
+
+    blinker.set_alert(RED, False)
+    assert blinker.color == GREEN
+    assert set(run(blinker, clock, 3)) == {GREEN, None}
+
+    blinker.clear()
+    assert not blinker.is_blinking
+    assert blinker.color is None
+    assert pixel.lit is None
+
+
+def test_no_restart():
+    """
+    Repeated set_alert() calls do not restart the sequence nor write the pixel.
+    """
+    clock = VirtualClock()
+    pixel = CountingPixel()
+    blinker = Blinker(pixel, priorities=COLOR_PRIORITY, clock=clock)
+    blinker.set_alert(RED)
+    writes = pixel.writes
+    for _ in range(4):
+        clock.advance(0.1)
+        blinker.set_alert(RED)
+        blinker.set_alert(BLUE)
+        blinker.set_alert(GREEN, False)
+        blinker.tick()
+    assert pixel.writes == writes
+    clock.advance(0.1)
+    blinker.tick()
+    assert pixel.lit is None
+
+
+def test_time_share():
+    """
+    Concurrent alerts take turns with their patterns.
+    """
+    clock = VirtualClock()
+    pixel = CountingPixel()
+    blinker = Blinker(pixel, priorities=COLOR_PRIORITY, time_share=True, clock=clock)
+    blinker.set_alert(BLUE, pattern=(0.2, 0.2))
+    blinker.set_alert(RED, pattern=(0.1, 0.1, 0.1, 0.3))
+    assert run(blinker, clock, 1.2) == [None, RED, None, None, None] + [
+        BLUE,
+        BLUE,
+        None,
+        None,
+        RED,
+        None,
+        RED,
+    ]
+
+
+def test_invalid_pattern():
+    """
+    zero duration would stall the tick
+    """
+    blinker = Blinker(CountingPixel())
+    with pytest.raises(ValueError):
+        blinker.set_alert(RED, pattern=(0.5, 0))
@@ -0,0 +1,72 @@
+"""
+tests for boot profiling and staged startup
+"""
+
+import pytest
+
+from bootprof import (
+    TIME_TO_CONNECTED,
+    TIME_TO_FIRST_FRAME,
+    BootProfiler,
+    StagedStartup,
+)
+from payload import decode_compact, encode_compact
+
+
+def test_staged_startup():
+    """
+    The stages should be performed one per step() and recorded as boot phases.
+    """
+    performed = []
+    profiler = BootProfiler()
+    startup = StagedStartup(
+        profiler,
+        [("a", lambda: performed.append("a")), ("b", lambda: performed.append("b"))],
+    )
+    assert not startup.done
+    assert not startup.step()
+    assert performed == ["a"]
+    assert startup.step()
+    assert performed == ["a", "b"]
+    assert startup.done
+    assert startup.step()
+    assert performed == ["a", "b"]
+
+    profiler.mark(TIME_TO_CONNECTED)
+    metrics = profiler.metrics()
+    assert set(metrics.keys()) == {TIME_TO_CONNECTED, "boot_a_ms", "boot_b_ms"}
+
+
+def test_staged_startup_failure():
+    """
+    Failed stage should be retried on the next step.
+    """
+    attempts = []
+
+    def failing():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise OSError("no network")
+
+    startup = StagedStartup(BootProfiler(), [("net", failing)])
+    with pytest.raises(OSError):
+        startup.step()
+    assert not startup.done
+    assert startup.failures == 1
+    assert startup.step()
+    assert startup.failures == 0
+    assert len(attempts) == 2
+
+
+def test_compact_metrics():
+    """
+    The boot metrics published by code.py should survive the compact encoding.
+    """
+    profiler = BootProfiler()
+    for name in ["sensors", "font", "wifi", "mqtt", "ntp", "metrics"]:
+        with profiler.phase(name):
+            pass
+    profiler.mark(TIME_TO_FIRST_FRAME)
+    profiler.mark(TIME_TO_CONNECTED)
+    metrics = profiler.metrics()
+    assert decode_compact(encode_compact(metrics)) == metrics
@@ -0,0 +1,184 @@
+"""
+tests for configuration handling
+"""
+
+import json
+
+import adafruit_logging as logging
+import pytest
+
+from config import MANDATORY_SECRETS, Config, ConfigError
+from handlers import on_message_with_config, on_message_with_power
+from logutil import set_log_level
+from tools.simulator import FakeMQTTClient
+
+SECRETS = {
+    "SSID": "FOO",
+    "password": "XYZ",
+    "broker": "172.40.0.3",
+    "broker_port": 1883,
+    "log_level": "info",
+    "mqtt_topic_env": "devices/pracovna/qtpy",
+    "mqtt_topic_power": "devices/plug/pracovna",
+    "mqtt_topic": "devices/pracovna/featherTFT",
+    "distance_threshold": 90,
+    "power_threshold_watts": 35,
+    "co2_threshold": 1000,
+    "last_update_threshold": 60,
+    "break_threshold_seconds": 2700,
+    "icon_paths": ["/images/a.bmp", "/images/b.bmp"],
+    "table_state_dur_threshold": 1800,
+    "start_hr": 8,
+    "end_hr": 23,
+    "font_file_name": "fonts/Inter-Regular-25.pcf",
+}
+
+
+@pytest.mark.parametrize("name", MANDATORY_SECRETS)
+def test_missing_secret(name):
+    """
+    Each of the mandatory secrets has to be present.
+    """
+    secrets = dict(SECRETS)
+    del secrets[name]
+    with pytest.raises(ConfigError):
+        Config(secrets)
+
+
+def test_invalid_value():
+    """
+    Values of wrong type should be rejected.
+    """
+    with pytest.raises(ConfigError):
+        Config(dict(SECRETS, co2_threshold="1000"))
+
+
+@pytest.mark.parametrize(
+    "values",
+    [
+        {"mqtt_transport": "websocket"},
+        {"mqtt_ca_file": "/ca.pem"},
+        {"mqtt_keep_alive": 0},
+        {"power_plug_url": "https://10.0.0.5/status"},
+    ],
+)
+def test_invalid_connection(values):
+    """
+    Unknown transport, CA certificate without TLS, zero keep alive
+    and plug URL other than plain HTTP are rejected.
+    """
+    with pytest.raises(ConfigError):
+        Config(dict(SECRETS, **values))
+
+
+def test_update():
+    """
+    Valid update should be applied and bump the version.
+    """
+    config = Config(SECRETS)
+    assert config.version == 0
+    assert config.update({"co2_threshold": 1200, "end_hr": 20}) == 1
+    assert config.co2_threshold == 1200
+    assert config.end_hr == 20
+    assert config.update({"version": 10, "log_level": "debug"}) == 10
+    assert config.log_level == 10
+
+
+def test_update_atomic():
+    """
+    If any of the changes is invalid, none of them should be applied.
+    """
+    config = Config(SECRETS)
+    with pytest.raises(ConfigError):
+        config.update({"co2_threshold": 1200, "start_hr": 30})
+    with pytest.raises(ConfigError):
+        config.update({"co2_threshold": 1200, "broker": "localhost"})
+    with pytest.raises(ConfigError):
+        config.update({"co2_threshold": 1200, "start_hr": 23, "end_hr": 8})
+    assert config.co2_threshold == 1000
+    assert config.version == 0
+
+
+@pytest.mark.parametrize(
+    "changes",
+    [
+        {"co2_threshold": None},
+        {"start_hr": None},
+        {"co2_threshold": -1},
+        {"break_threshold_seconds": -60},
+    ],
+)
+def test_update_null_or_negative(changes):
+    """
+    The tunables cannot be unset or negative, the update is rejected
+    with error acknowledgement.
+    """
+    config = Config(SECRETS)
+    ack = config.update_from_message(json.dumps(changes))
+    assert ack["status"] == "error"
+    assert ack["version"] == 0
+    assert config.co2_threshold == 1000
+    assert config.start_hr == 8
+
+
+def test_negative_and_hours():
+    """
+    The initial configuration is checked the same way as the updates.
+    """
+    with pytest.raises(ConfigError):
+        Config(dict(SECRETS, power_threshold_watts=-5))
+    with pytest.raises(ConfigError):
+        Config(dict(SECRETS, start_hr=20, end_hr=8))
+    assert Config(dict(SECRETS, tz_offset=-5)).tz_offset == -5
+
+
+def test_update_from_message():
+    """
+    The acknowledgement should contain the config version and status.
+    """
+    config = Config(SECRETS)
+    ack = config.update_from_message(json.dumps({"version": 3, "start_hr": 7}))
+    assert ack == {"version": 3, "status": "ok"}
+    assert config.start_hr == 7
+    ack = config.update_from_message(b"[1, 2]")
+    assert ack["version"] == 3
+    assert ack["status"] == "error"
+    ack = config.update_from_message(b"{")
+    assert ack["status"] == "error"
+
+
+def test_log_level():
+    """
+    The configured log level applies to the loggers of all the modules,
+    also when changed with configuration update.
+    """
+
+    class Collector(logging.Handler):
+        """
+        collects the log messages
+        """
+
+        def __init__(self):
+            super().__init__()
+            self.messages = []
+
+        def emit(self, record):
+            self.messages.append(record.msg)
+
+    config = Config(SECRETS)
+    set_log_level(config.log_level)
+    collector = Collector()
+    handlers_logger = logging.getLogger("handlers")
+    handlers_logger.addHandler(collector)
+    mqtt = FakeMQTTClient({})
+    try:
+        on_message_with_power(mqtt, "power", '{"current_power": 1}')
+        assert not collector.messages
+
+        on_message_with_config(mqtt, "config", '{"log_level": "debug"}', config)
+        assert logging.getLogger("__main__").getEffectiveLevel() == logging.DEBUG
+        on_message_with_power(mqtt, "power", '{"current_power": 2}')
+        assert collector.messages == ['got MQTT message on power: {"current_power": 2}']
+    finally:
+        handlers_logger.removeHandler(collector)
+        set_log_level(logging.WARNING)
@@ -0,0 +1,69 @@
+"""
+tests for the event coalescing
+"""
+
+from unittest.mock import Mock
+
+from clock import VirtualClock
+from events import (
+    EVENT_COUNT,
+    MQTT_RECONNECT,
+    SESSION_SECONDS,
+    TABLE_DOWN,
+    TABLE_UP,
+    EventBus,
+)
+from payload import COMPACT, JSON, decode_compact
+from session import SESSION_END
+
+
+def test_flapping_coalesced():
+    """
+    events within the window end up in single batch
+    """
+    clock = VirtualClock()
+    event_bus = EventBus(clock)
+    assert event_bus.take(60) is None
+
+    for _ in range(5):
+        event_bus.emit(TABLE_UP)
+        clock.advance(5)
+        event_bus.emit(TABLE_DOWN)
+        clock.advance(5)
+        assert event_bus.take(60) is None
+    event_bus.emit(SESSION_END, {SESSION_SECONDS: 42})
+    assert event_bus.pending == 11
+
+    clock.advance(10)
+    batch = event_bus.take(60)
+    assert batch == {
+        "annotation": True,
+        "tags": [TABLE_UP, TABLE_DOWN, SESSION_END],
+        EVENT_COUNT: 11,
+        SESSION_SECONDS: 42,
+    }
+    assert event_bus.pending == 0
+    assert event_bus.take(0) is None
+
+
+def test_publish():
+    """
+    the batch is published once it is due, in the configured encoding
+    """
+    clock = VirtualClock()
+    event_bus = EventBus(clock)
+    mqtt_client = Mock()
+    assert not event_bus.publish(mqtt_client, "anno", 0, JSON)
+
+    event_bus.emit(MQTT_RECONNECT)
+    event_bus.emit(MQTT_RECONNECT)
+    assert not event_bus.publish(mqtt_client, "anno", 30, COMPACT)
+    clock.advance(30)
+    assert event_bus.publish(mqtt_client, "anno", 30, COMPACT)
+    topic, msg = mqtt_client.publish.call_args.args
+    assert topic == "anno"
+    assert decode_compact(msg) == {
+        "annotation": True,
+        "tags": [MQTT_RECONNECT],
+        EVENT_COUNT: 2,
+    }
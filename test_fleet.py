@@ -0,0 +1,175 @@
+"""
+tests for the fleet aggregator
+"""
+
+import asyncio
+import calendar
+import time
+
+from payload import COMPACT
+from tools.fleet import Fleet, escape_label, serve_metrics, topic_desk
+from tools.fleet_loadgen import SyntheticDesk, generate
+
+# Monday noon in January, in UTC
+START = calendar.timegm((2024, 1, 8, 12, 0, 0, 0, 0, 0))
+
+
+def test_topic_desk():
+    """
+    test extracting desk name from the topic
+    """
+    assert topic_desk("devices/+/featherTFT", "devices/pracovna/featherTFT") == (
+        "pracovna"
+    )
+    assert topic_desk("devices/+/featherTFT", "devices/pracovna/other") is None
+    assert topic_desk("devices/plug/+", "devices/plug/a/b") is None
+
+
+def test_sessions_and_totals():
+    """
+    Feed a desk standing for 10 minutes, sitting for 5, then power off.
+    """
+    fleet = Fleet(distance_threshold=90, power_threshold=35)
+    batch = []
+    for second in range(0, 20 * 60, 10):
+        power = 50 if second < 15 * 60 else 0
+        distance = 110 if second < 10 * 60 else 70
+        stamp = START + second
+        batch.append(("power", "a", f'{{"current_power": {power}}}', stamp))
+        batch.append(("distance", "a", f'{{"distance": {distance}}}', stamp))
+    batch.append(("distance", "a", b"garbage", START))
+    fleet.process(batch)
+
+    desk = fleet.desks["a"]
+    assert desk.sessions == 1
+    assert desk.seconds_up == 600
+    assert desk.seconds_down == 300
+    assert desk.seconds_power_on == 900
+    assert not desk.power_on
+    assert fleet.errors == 1
+    assert fleet.messages == len(batch)
+
+    text = fleet.render()
+    assert 'workmon_desk_today_up_seconds{desk="a"} 600.0\n' in text
+    assert 'workmon_desk_power_sessions_total{desk="a"} 1\n' in text
+
+
+def test_non_object_payload():
+    """
+    Valid JSON that is not an object should be counted as error.
+    """
+    fleet = Fleet(distance_threshold=90, power_threshold=35)
+    fleet.process(
+        [
+            ("distance", "a", "[1]", START),
+            ("power", "a", "3", START),
+            ("distance", "a", '{"distance": 100}', START),
+        ]
+    )
+    assert fleet.errors == 2
+    assert fleet.desks["a"].table_state == "up"
+
+
+def test_label_escaping():
+    """
+    The desk name comes from the topic, it has to be escaped in the exposition.
+    """
+    assert escape_label('a\\b"c\nd') == 'a\\\\b\\"c\\nd'
+    fleet = Fleet(distance_threshold=90, power_threshold=35)
+    fleet.process([("power", 'x"y', '{"current_power": 50}', START)])
+    assert 'workmon_desk_power_on{desk="x\\"y"} 1\n' in fleet.render()
+
+
+def test_day_change():
+    """
+    The daily totals are reset when the day changes, also for the desks
+    that went silent. Late message does not bring the previous day back.
+    """
+    fleet = Fleet(distance_threshold=90, power_threshold=35)
+    fleet.process(
+        [
+            ("power", "a", '{"current_power": 50}', START),
+            ("distance", "a", '{"distance": 100}', START + 60),
+            ("distance", "a", '{"distance": 100}', START + 120),
+            ("power", "b", '{"current_power": 50}', START),
+            ("distance", "b", '{"distance": 100}', START + 60),
+            ("distance", "b", '{"distance": 100}', START + 120),
+        ]
+    )
+    assert fleet.desks["a"].seconds_up == 60
+    fleet.process([("distance", "a", '{"distance": 100}', START + 86400)])
+    assert fleet.desks["a"].seconds_up == 0
+    assert fleet.desks["b"].seconds_up == 0
+    assert 'workmon_desk_today_up_seconds{desk="b"} 0.0\n' in fleet.render()
+
+    fleet.process(
+        [
+            ("distance", "b", '{"distance": 100}', START + 130),
+            ("distance", "a", '{"distance": 100}', START + 86410),
+            ("distance", "b", '{"distance": 100}', START + 86410),
+            ("distance", "b", '{"distance": 100}', START + 86420),
+        ]
+    )
+    assert fleet.desks["a"].seconds_up == 10
+    assert fleet.desks["b"].seconds_up == 10
+
+
+def test_gap():
+    """
+    Only max_gap of the time the desk was silent is accounted.
+    """
+    fleet = Fleet(distance_threshold=90, power_threshold=35, max_gap=30)
+    fleet.process(
+        [
+            ("power", "a", '{"current_power": 50}', START),
+            ("distance", "a", '{"distance": 100}', START + 10),
+            ("distance", "a", '{"distance": 100}', START + 20),
+            ("distance", "a", '{"distance": 100}', START + 4 * 3600),
+        ]
+    )
+    desk = fleet.desks["a"]
+    assert desk.seconds_up == 10 + 30
+    assert desk.seconds_power_on == 10 + 10 + 30
+
+
+def test_synthetic_fleet():
+    """
+    Many desks with mixed encodings, the state per desk stays the same size.
+    """
+    fleet = Fleet(distance_threshold=90, power_threshold=35)
+    desks = [SyntheticDesk(f"desk{i}") for i in range(50)]
+    for round_number in range(100):
+        fleet.process(
+            [
+                (kind, name, payload, START + round_number * 10)
+                for kind, name, payload in generate(desks, COMPACT)
+            ]
+        )
+    assert len(fleet.desks) == 50
+    assert fleet.errors == 0
+    assert fleet.messages == 100 * 100
+    for desk in fleet.desks.values():
+        assert desk.seconds_power_on <= 990
+        assert not hasattr(desk, "__dict__")
+
+
+def test_metrics_endpoint():
+    """
+    Query the metrics over HTTP.
+    """
+    fleet = Fleet(distance_threshold=90, power_threshold=35)
+    fleet.process([("power", "a", '{"current_power": 50}', time.time())])
+
+    async def query():
+        server = await serve_metrics(fleet, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+            response = await reader.read()
+            writer.close()
+            return response
+
+    response = asyncio.run(query())
+    assert response.startswith(b"HTTP/1.1 200 OK\r\n")
+    assert b'workmon_desk_power_on{desk="a"} 1\n' in response
@@ -0,0 +1,81 @@
+"""
+tests for the glyph atlas font
+"""
+
+import pytest
+from adafruit_bitmap_font import bitmap_font
+from adafruit_display_text import label
+
+from fontatlas import CHARACTERS, AtlasFont, atlas_path
+from tools.font_atlas import build_atlas
+
+FONT_FILE = "fonts/Inter-Regular-25.pcf"
+
+
+def test_atlas_path():
+    """
+    The atlas file should be placed next to the font file.
+    """
+    assert atlas_path("fonts/Inter-Regular-25.pcf") == "fonts/Inter-Regular-25.atlas"
+    assert atlas_path("/foo.bar/font") == "/foo.bar/font.atlas"
+
+
+def test_atlas_matches_font(tmp_path):
+    """
+    The glyphs loaded from the atlas should have the same pixels and metrics
+    as the glyphs loaded from the font.
+    """
+    atlas_file = tmp_path / "font.atlas"
+    atlas_file.write_bytes(build_atlas(bitmap_font.load_font(FONT_FILE)))
+    atlas = AtlasFont(str(atlas_file))
+
+    font = bitmap_font.load_font(FONT_FILE)
+    font.load_glyphs(CHARACTERS)
+    assert atlas.get_bounding_box() == font.get_bounding_box()
+    assert atlas.ascent == font.ascent
+    assert atlas.descent == font.descent
+    assert atlas.size_bytes > 0
+
+    for character in CHARACTERS:
+        expected = font.get_glyph(ord(character))
+        glyph = atlas.get_glyph(ord(character))
+        assert (
+            glyph.width,
+            glyph.height,
+            glyph.dx,
+            glyph.dy,
+            glyph.shift_x,
+            glyph.shift_y,
+        ) == (
+            expected.width,
+            expected.height,
+            expected.dx,
+            expected.dy,
+            expected.shift_x,
+            expected.shift_y,
+        ), character
+        if glyph.width == 0 or glyph.height == 0:
+            continue
+        origin = glyph.tile_index * glyph.width
+        for y in range(glyph.height):
+            for x in range(glyph.width):
+                pixel = expected.bitmap[x, y]
+                assert glyph.bitmap[origin + x, y] == pixel, f"{character} {x},{y}"
+
+    assert atlas.get_glyph(ord("Ж")) is None
+
+
+@pytest.mark.parametrize("text", ["Tbl: 01:23", "i", "CO₂: 812 ppm", "Temp: 23.4°C"])
+def test_atlas_label_size(tmp_path, text):
+    """
+    The text rendered with the atlas should have the same size as with the font.
+    """
+    atlas_file = tmp_path / "font.atlas"
+    atlas_file.write_bytes(build_atlas(bitmap_font.load_font(FONT_FILE)))
+    atlas = AtlasFont(str(atlas_file))
+    font = bitmap_font.load_font(FONT_FILE)
+
+    assert (
+        label.Label(atlas, text=text).bounding_box
+        == label.Label(font, text=text).bounding_box
+    )
@@ -0,0 +1,45 @@
+"""
+tests for the frame based display refresh
+"""
+
+from types import SimpleNamespace
+from unittest.mock import Mock
+
+from clock import VirtualClock
+from frame import Frame, set_label
+
+
+def test_set_label():
+    """
+    Only actual changes are assigned.
+    """
+    label = Mock(text="a", color=1)
+    assert not set_label(label, "a", 1)
+    assert set_label(label, "b")
+    assert label.text == "b"
+    assert set_label(label, color=2)
+    assert label.color == 2
+
+
+def test_refresh():
+    """
+    The display is refreshed only if invalidated and at most fps times per second.
+    """
+    clock = VirtualClock()
+    display = SimpleNamespace(auto_refresh=True, refresh=Mock())
+    frame = Frame(display, fps=2, clock=clock)
+    assert not display.auto_refresh
+
+    assert not frame.refresh()
+    frame.invalidate()
+    frame.invalidate()
+    assert frame.refresh()
+    assert not frame.refresh()
+
+    clock.advance(0.1)
+    frame.invalidate()
+    assert not frame.refresh()
+    clock.advance(0.4)
+    assert frame.refresh()
+    assert display.refresh.call_count == 2
+    assert frame.refresh_count == 2
@@ -0,0 +1,121 @@
+"""
+tests for the metrics HTTP server using local sockets
+"""
+
+import socket
+import time
+
+from clock import VirtualClock
+from metricserver import COUNTER, GAUGE, MetricServer
+
+VALUES = {"distance": 101.5, "loops": 42, "co2": None}
+
+
+def make_server(clock=None, buffer_size=2048):
+    """
+    :return: MetricServer listening on random local port
+    """
+    return MetricServer(
+        socket,
+        [
+            ("workmon_distance_cm", GAUGE, lambda: VALUES["distance"]),
+            ("workmon_co2_ppm", GAUGE, lambda: VALUES["co2"]),
+            ("workmon_loop_iterations_total", COUNTER, lambda: VALUES["loops"]),
+        ],
+        port=0,
+        host="127.0.0.1",
+        buffer_size=buffer_size,
+        clock=clock or VirtualClock(),
+    )
+
+
+def poll_until(server, client, max_polls=1000):
+    """
+    Poll the server while reading the response.
+    :return: the response
+    """
+    client.setblocking(False)
+    response = b""
+    for _ in range(max_polls):
+        start = time.monotonic()
+        server.poll()
+        assert time.monotonic() - start < 0.05
+        try:
+            data = client.recv(4096)
+            if not data:
+                break
+            response += data
+        except BlockingIOError:
+            time.sleep(0.001)
+    return response
+
+
+def test_request():
+    """
+    The metrics are served, the ones without value are omitted.
+    """
+    server = make_server()
+    with socket.create_connection(("127.0.0.1", server.port)) as client:
+        client.sendall(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        response = poll_until(server, client)
+
+    header, body = response.split(b"\r\n\r\n")
+    assert header.startswith(b"HTTP/1.0 200 OK")
+    assert f"Content-Length: {len(body)}".encode() in header
+    assert body == (
+        b"# TYPE workmon_distance_cm gauge\nworkmon_distance_cm 101.5\n"
+        b"# TYPE workmon_loop_iterations_total counter\n"
+        b"workmon_loop_iterations_total 42\n"
+    )
+    assert server.requests == 1
+    server.close()
+
+
+def test_split_request():
+    """
+    The request can arrive in multiple parts, poll() does not block meanwhile.
+    """
+    server = make_server()
+    with socket.create_connection(("127.0.0.1", server.port)) as client:
+        client.sendall(b"GET /metrics HTTP/1.1\r\n")
+        for _ in range(10):
+            server.poll()
+        client.sendall(b"\r\n")
+        response = poll_until(server, client)
+    assert b"workmon_distance_cm 101.5" in response
+
+    # The server is ready for the next client.
+    with socket.create_connection(("127.0.0.1", server.port)) as client:
+        client.sendall(b"GET / HTTP/1.0\r\n\r\n")
+        assert b"200 OK" in poll_until(server, client)
+    assert server.requests == 2
+    server.close()
+
+
+def test_timeout():
+    """
+    A client that does not send the whole request is dropped.
+    """
+    clock = VirtualClock()
+    server = make_server(clock)
+    with socket.create_connection(("127.0.0.1", server.port)) as client:
+        client.sendall(b"GET")
+        for _ in range(10):
+            server.poll()
+        clock.advance(3)
+        assert poll_until(server, client) == b""
+    assert server.requests == 0
+    server.close()
+
+
+def test_small_buffer():
+    """
+    The metrics that do not fit are left out.
+    """
+    server = make_server(buffer_size=160)
+    with socket.create_connection(("127.0.0.1", server.port)) as client:
+        client.sendall(b"GET / HTTP/1.0\r\n\r\n")
+        response = poll_until(server, client)
+    assert b"workmon_distance_cm 101.5" in response
+    assert b"workmon_loop_iterations_total" not in response
+    server.close()
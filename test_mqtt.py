@@ -0,0 +1,79 @@
+"""
+tests for the MQTT utility functions
+"""
+
+import ssl
+
+import adafruit_minimqtt.adafruit_minimqtt as MQTT
+import pytest
+
+from clock import VirtualClock
+from mqtt import (
+    CONNECT_STATS,
+    PLAIN,
+    TLS,
+    ConnectStats,
+    mqtt_publish_robust,
+    mqtt_reconnect,
+    ssl_context,
+)
+
+
+class FakeClient:
+    """
+    MQTT client whose connects take given time and optionally fail
+    """
+
+    def __init__(self, clock, user_data, failures=0):
+        self.clock = clock
+        self.user_data = user_data
+        self.failures = failures
+        self.published = []
+
+    def reconnect(self):
+        """
+        take 150 ms, fail if there are failures left
+        """
+        self.clock.advance(0.15)
+        if self.failures:
+            self.failures -= 1
+            raise MQTT.MMQTTException("connection refused")
+
+    def publish(self, topic, msg, retain=False):
+        """
+        fail like with broken connection
+        """
+        self.published.append((topic, msg, retain))
+        raise OSError("broken pipe")
+
+
+def test_connect_stats():
+    """
+    successful connects are measured, failures counted
+    """
+    clock = VirtualClock()
+    stats = ConnectStats(clock)
+    client = FakeClient(clock, {CONNECT_STATS: stats}, failures=1)
+
+    with pytest.raises(MQTT.MMQTTException):
+        mqtt_reconnect(client)
+    assert stats.failures == 1
+    assert stats.last_ms is None
+
+    # Failed publish reconnects.
+    mqtt_publish_robust(client, "topic", "data", retain=True)
+    assert client.published == [("topic", "data", True)]
+    assert stats.connects == 1
+    assert stats.last_ms == 150
+    assert stats.max_ms == 150
+
+    # Works also without the stats.
+    mqtt_reconnect(FakeClient(clock, None))
+
+
+def test_ssl_context():
+    """
+    plain transport does not need the SSL context
+    """
+    assert ssl_context(PLAIN) is None
+    assert isinstance(ssl_context(TLS), ssl.SSLContext)
@@ -0,0 +1,95 @@
+"""
+tests for the display pages, the chart and the work week log
+"""
+
+import displayio
+import terminalio
+
+from clock import VirtualClock
+from frame import TextCache
+from pages import CHART_PAGE, Pages, chart_page, refresh_week, week_page
+from session import WeekLog
+from sparkline import Sparkline
+
+
+def visible_column(sparkline, x):
+    """
+    :return: the bitmap column displayed at given x coordinate of the chart
+    """
+    column = x - sparkline.tile_grid.x
+    return [sparkline.bitmap[column, row] for row in range(sparkline.height)]
+
+
+def test_sparkline_scroll():
+    """
+    The newest value is always in the rightmost column, the older values
+    move to the left without being redrawn.
+    """
+    sparkline = Sparkline(4, 5, [(0, 4)], [0xFF0000])
+    for value in range(6):
+        sparkline.set(0, value)
+        sparkline.advance()
+        # The value 4 is at the top.
+        assert visible_column(sparkline, 3)[4 - min(value, 4)] == 1
+
+    # Values 2, 3, 4 (clamped) and 4 (clamped). The columns are connected
+    # with the previous value.
+    assert visible_column(sparkline, 0) == [0, 0, 1, 1, 0]
+    assert visible_column(sparkline, 1) == [0, 1, 1, 0, 0]
+    assert visible_column(sparkline, 2) == [1, 1, 0, 0, 0]
+    assert visible_column(sparkline, 3) == [1, 0, 0, 0, 0]
+
+    # Missing value leaves empty column.
+    sparkline.advance()
+    assert visible_column(sparkline, 3) == [0] * 5
+    assert visible_column(sparkline, 2) == [1, 0, 0, 0, 0]
+
+
+def test_pages():
+    """
+    only the selected page is visible
+    """
+    groups = [displayio.Group() for _ in range(3)]
+    pages = Pages(groups)
+    assert [g.hidden for g in groups] == [False, True, True]
+    assert pages.show(CHART_PAGE)
+    assert [g.hidden for g in groups] == [True, True, False]
+    assert not pages.show(CHART_PAGE)
+    # Out of range index is clamped.
+    assert not pages.show(10)
+    assert pages.show(-1)
+    assert pages.current == 0
+
+    group, sparkline = chart_page(terminalio.FONT, 240, 135, 0xFFFF00)
+    assert group[len(group) - 1] is sparkline.tile_grid
+    assert sparkline.width == 240
+
+
+def test_week():
+    """
+    the work time is accounted to the day, the day is zeroed a week later
+    """
+    clock = VirtualClock()
+    week_log = WeekLog(clock)
+    _, labels = week_page(terminalio.FONT, 2, 0xFFFF00)
+    cache = TextCache()
+
+    week_log.update(True, 0)
+    clock.advance(3600 + 30 * 60)
+    week_log.update(False, 0)
+    clock.advance(3600)
+    week_log.update(False, 0)
+    assert week_log.minutes(0) == 90
+    assert refresh_week(labels, week_log, cache)
+    assert labels[0].text == "Mon  1:30"
+    assert labels[1].text == "Tue  0:00"
+    assert not refresh_week(labels, week_log, cache)
+
+    week_log.update(True, 1)
+    clock.advance(60)
+    week_log.update(True, 1)
+    assert week_log.minutes(1) == 1
+
+    # Next Monday
+    week_log.update(True, 0)
+    assert week_log.minutes(0) == 0
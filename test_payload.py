@@ -0,0 +1,105 @@
+"""
+tests for MQTT payload decoding
+"""
+
+import json
+
+import pytest
+
+from payload import (
+    COMPACT,
+    PayloadDecoder,
+    decode_compact,
+    encode_compact,
+    encode_message,
+)
+from tools.mqtt_bridge import translate
+
+testdata = [
+    (b'{"co2_ppm": 812, "temperature": 23.4, "humidity": 41.5}', [812, 23.4, 41.5]),
+    (b'{"humidity":40,"co2_ppm":1200}', [1200, None, 40]),
+    (b'{"co2_ppm": -1.5e2, "temperature": 2E1}', [-150.0, 20.0, None]),
+    (b'{"co2_ppm": null, "temperature": 21}', [None, 21, None]),
+    (b'{"co2_ppm": {"value": 1}, "temperature": 21}', [{"value": 1}, 21, None]),
+    (b"{}", [None, None, None]),
+]
+
+
+@pytest.mark.parametrize(
+    "msg,expected",
+    testdata,
+    ids=["all", "reordered", "exponent", "null", "nested", "empty"],
+)
+def test_decode_json(msg, expected):
+    """
+    The decoded values should match what json.loads() would produce.
+    """
+    decoder = PayloadDecoder(("co2_ppm", "temperature", "humidity"))
+    values = decoder.decode(msg)
+    assert values == expected
+    metrics = json.loads(msg)
+    assert values == [metrics.get(k) for k in decoder.keys]
+
+
+def test_decode_str():
+    """
+    Payloads received in non-binary mode are str.
+    """
+    decoder = PayloadDecoder(("current_power",))
+    assert decoder.decode('{"current_power": 42.0}') == [42.0]
+
+
+def test_decode_invalid():
+    """
+    Invalid payload should raise ValueError.
+    """
+    decoder = PayloadDecoder(("current_power",))
+    with pytest.raises(ValueError):
+        decoder.decode(b'{"current_power": nope')
+
+
+def test_compact_roundtrip():
+    """
+    Values encoded in the compact format should be decoded (with float precision).
+    """
+    decoder = PayloadDecoder(("co2_ppm", "temperature", "humidity"))
+    msg = encode_compact({"temperature": 22.5, "co2_ppm": 900, "foo": 1})
+    assert decoder.decode(msg) == [900.0, 22.5, None]
+    with pytest.raises(ValueError):
+        decoder.decode(msg[:-1])
+
+
+def test_compact_annotation():
+    """
+    Annotations should survive the compact encoding.
+    """
+    msg = encode_message(
+        {"annotation": True, "tags": ["table_duration"]}, encoding=COMPACT
+    )
+    assert decode_compact(msg) == {"annotation": True, "tags": ["table_duration"]}
+
+
+def test_compact_unknown_tag():
+    """
+    Annotations with tags without ID cannot be encoded in the compact format,
+    these should be sent as JSON and republished by the bridge as is.
+    """
+    metrics = {"annotation": True, "tags": ["table_duration", "foo"]}
+    with pytest.raises(ValueError):
+        encode_compact(metrics)
+    msg = encode_message(metrics, encoding=COMPACT)
+    assert json.loads(msg) == metrics
+    _, data = translate("compact/devices/desk", msg.encode(), "compact/", "")
+    assert json.loads(data) == metrics
+
+
+def test_bridge_translate():
+    """
+    The bridge should republish the compact messages as JSON on the stripped topic.
+    """
+    msg = encode_message({"distance": 92.5}, encoding=COMPACT)
+    topic, data = translate("compact/devices/desk", msg, "compact/", "")
+    assert topic == "devices/desk"
+    assert json.loads(data) == {"distance": 92.5}
+    assert translate("devices/desk", msg, "compact/", "") is None
+    assert translate("compact/devices/desk", b"\x02", "compact/", "") is None
@@ -0,0 +1,194 @@
+"""
+tests for the local power plug poller using fake plug HTTP server
+"""
+
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from clock import VirtualClock
+from handlers import POWER
+from plugpoll import PowerPoller, get_value, parse_url
+
+
+class FakePlug(ThreadingHTTPServer):
+    """
+    Plug with local API like Shelly, keeps the connections alive.
+    """
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FakePlugHandler)
+        self.power = 42.5
+        self.connections = 0
+        self.requests = 0
+        self.status = 200
+        self.close_after_response = False
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def handle_error(self, request, client_address):
+        """
+        the poller might close the connection early
+        """
+
+    @property
+    def url(self):
+        """
+        :return: URL of the status endpoint
+        """
+        return f"http://127.0.0.1:{self.server_address[1]}/rpc/Switch.GetStatus?id=0"
+
+
+class FakePlugHandler(BaseHTTPRequestHandler):
+    """
+    Serves the power status.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    # pylint: disable=invalid-name
+    def do_GET(self):
+        """
+        respond with JSON similar to Shelly plug
+        """
+        self.server.requests += 1
+        body = json.dumps({"id": 0, "output": True, "apower": self.server.power})
+        self.send_response(self.server.status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if self.server.close_after_response:
+            self.send_header("Connection", "close")
+            self.close_connection = True
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+
+@pytest.fixture(name="plug")
+def fixture_plug():
+    """
+    fake plug running for the duration of the test
+    """
+    plug = FakePlug()
+    yield plug
+    plug.shutdown()
+    plug.server_close()
+
+
+def poll_once(poller, user_data, clock, max_polls=1000):
+    """
+    Poll until the request finishes, then move the time to the next poll.
+    """
+    clock.advance(10)
+    polls = poller.polls
+    failures = poller.failures
+    for _ in range(max_polls):
+        poller.poll(user_data)
+        if poller.polls > polls or poller.failures > failures:
+            break
+        time.sleep(0.001)
+
+
+def test_parse():
+    """
+    only plain HTTP is supported, the value can be nested
+    """
+    assert parse_url("http://plug.local/status") == ("plug.local", 80, "/status")
+    assert parse_url("http://10.0.0.5:8080") == ("10.0.0.5", 8080, "/")
+    with pytest.raises(ValueError):
+        parse_url("https://plug.local/status")
+    assert (
+        get_value({"StatusSNS": {"ENERGY": {"Power": 12}}}, "StatusSNS.ENERGY.Power")
+        == 12
+    )
+    with pytest.raises(ValueError):
+        get_value({"apower": "12"}, "apower")
+    with pytest.raises(ValueError):
+        get_value({"apower": 12}, "power")
+
+
+def test_keep_alive(plug):
+    """
+    The power is fetched periodically over single connection.
+    """
+    clock = VirtualClock()
+    poller = PowerPoller(socket, plug.url, "apower", clock=clock)
+    user_data = {}
+    poll_once(poller, user_data, clock)
+    assert user_data[POWER] == 42.5
+    assert poller.last_ms is not None
+
+    plug.power = 3.0
+    # Not yet the time for another poll.
+    clock.advance(5)
+    poller.poll(user_data)
+    assert plug.requests == 1
+
+    for _ in range(3):
+        poll_once(poller, user_data, clock)
+    assert user_data[POWER] == 3.0
+    assert poller.polls == 4
+    assert poller.failures == 0
+    assert plug.connections == 1
+    assert poller.connects == 1
+    poller.close()
+
+
+def test_reconnect(plug):
+    """
+    Closed connection is reopened, errors are counted.
+    """
+    clock = VirtualClock()
+    poller = PowerPoller(socket, plug.url, "apower", clock=clock)
+    user_data = {}
+    plug.close_after_response = True
+    poll_once(poller, user_data, clock)
+    poll_once(poller, user_data, clock)
+    assert poller.polls == 2
+    assert plug.connections == 2
+
+    plug.status = 500
+    plug.power = 1.0
+    poll_once(poller, user_data, clock)
+    assert poller.failures == 1
+    assert user_data[POWER] == 42.5
+
+    # No plug listening.
+    poller = PowerPoller(socket, "http://127.0.0.1:1/", "apower", clock=clock)
+    poll_once(poller, user_data, clock)
+    assert poller.failures == 1
+    assert poller.polls == 0
+
+
+def test_timeout():
+    """
+    Unfinished request is dropped after the timeout.
+    """
+    clock = VirtualClock()
+    # Never sends the response.
+    with socket.create_server(("127.0.0.1", 0)) as silent:
+        poller = PowerPoller(
+            socket,
+            f"http://127.0.0.1:{silent.getsockname()[1]}/",
+            "apower",
+            clock=clock,
+        )
+        user_data = {}
+        poller.poll(user_data)
+        poller.poll(user_data)
+        assert poller.failures == 0
+        clock.advance(3)
+        poller.poll(user_data)
+        assert poller.failures == 1
+        assert POWER not in user_data
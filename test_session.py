@@ -0,0 +1,100 @@
+"""
+tests for the work session and break detection
+"""
+
+from unittest.mock import Mock
+
+from binarystate import BinaryState
+from blinker import Blinker
+from clock import VirtualClock
+from config import Config
+from handlers import COLOR_PRIORITY, GREEN, POWER, handle_power
+from session import BREAK, SESSION_END, SESSION_START, SessionTracker
+from test_config import SECRETS
+
+
+def run(tracker, clock, readings, min_on=20, min_break=60):
+    """
+    Feed the tracker with one reading per second.
+    :return: list of (second, event, duration) tuples
+    """
+    events = []
+    for second, power_on in enumerate(readings):
+        for event, duration in tracker.update(power_on, min_on, min_break):
+            events.append((second, event, duration))
+        clock.advance(1)
+    return events
+
+
+def test_blips_ignored():
+    """
+    power blips shorter than the dwell times do not produce any events
+    """
+    clock = VirtualClock()
+    tracker = SessionTracker(clock)
+    readings = [False] * 10 + [True] * 5 + [False] * 10
+    assert not run(tracker, clock, readings)
+    assert not tracker.in_session
+
+    readings = [True] * 30 + [False] * 30 + [True] * 30
+    events = run(tracker, clock, readings)
+    assert events == [(20, SESSION_START, None)]
+    assert tracker.in_session
+
+
+def test_session_and_break():
+    """
+    the events are backdated to the first reading of the change
+    """
+    clock = VirtualClock()
+    tracker = SessionTracker(clock)
+    readings = [True] * 600 + [False] * 300 + [True] * 100
+    events = run(tracker, clock, readings)
+    assert events == [
+        (20, SESSION_START, None),
+        (660, SESSION_END, 600),
+        (920, BREAK, 300),
+        (920, SESSION_START, None),
+    ]
+    # The current session started at 900.
+    assert tracker.duration() == 100
+
+
+def test_green_alert_stable():
+    """
+    short power dip does not reset the break alert
+    """
+    clock = VirtualClock()
+    config = Config(SECRETS)
+    blinker = Blinker(Mock(), priorities=COLOR_PRIORITY, clock=clock)
+    tracker = SessionTracker(clock)
+    user_data = {}
+
+    def step(power):
+        user_data[POWER] = power
+        handle_power(
+            blinker,
+            None,
+            None,
+            BinaryState(clock),
+            None,
+            tracker,
+            user_data,
+            config,
+        )
+        clock.advance(1)
+
+    for _ in range(config.break_threshold_seconds + 30):
+        step(config.power_threshold_watts + 10)
+    assert blinker.color == GREEN
+
+    for _ in range(config.min_break_seconds // 2):
+        step(0)
+        assert blinker.color == GREEN
+
+    step(config.power_threshold_watts + 10)
+    assert blinker.color == GREEN
+
+    for _ in range(config.min_break_seconds + 1):
+        step(0)
+    assert blinker.color is None
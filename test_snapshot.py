@@ -0,0 +1,172 @@
+"""
+tests for the snapshot of the live state
+"""
+
+from binarystate import BinaryState
+from clock import VirtualClock
+from handlers import CO2, LAST_UPDATE, POWER, TEMPERATURE
+from session import SessionTracker
+from snapshot import (
+    MAX_AGE,
+    RETAINED_STATE,
+    TIME,
+    SnapshotStore,
+    WarmStart,
+    capture,
+    from_message,
+    ignore_state_messages,
+    on_message_with_state,
+    pack,
+    restore,
+    to_message,
+    unpack,
+)
+
+EPOCH = 1_700_000_000
+
+
+def live_state(clock):
+    """
+    :return: tuple of table state, session tracker and user data
+    with the table up for 5 minutes and the session running for 10 minutes
+    """
+    table_state = BinaryState(clock)
+    session = SessionTracker(clock)
+    user_data = {}
+    session.update(True, 0, 0)
+    table_state.update("down")
+    clock.advance(300)
+    table_state.update("up")
+    clock.advance(300)
+    table_state.update("up")
+    user_data[CO2] = 800
+    user_data[TEMPERATURE] = 22.5
+    user_data[POWER] = 50.0
+    user_data[LAST_UPDATE] = clock.monotonic_ns()
+    clock.advance(30)
+    table_state.update("up")
+    return table_state, session, user_data
+
+
+def test_pack_roundtrip():
+    """
+    the NVM record holds the state, missing values included
+    """
+    clock = VirtualClock(EPOCH)
+    state = capture(*live_state(clock), wall_s=EPOCH + 630, clock=clock)
+    assert state["table"] == "up"
+    assert state["table_duration"] == 330
+    assert state["session_duration"] == 630
+    assert state["env_age"] == 30
+    unpacked = unpack(pack(state))
+    assert unpacked == state
+
+    assert unpack(bytes(len(pack(state)))) is None
+    assert unpack(b"S") is None
+
+
+def test_restore_with_downtime():
+    """
+    the durations include the time the device was down
+    """
+    clock = VirtualClock(EPOCH)
+    state = capture(*live_state(clock), wall_s=EPOCH, clock=clock)
+
+    clock = VirtualClock(EPOCH)
+    table_state = BinaryState(clock)
+    session = SessionTracker(clock)
+    user_data = {}
+    assert restore(state, table_state, session, user_data, EPOCH + 60, clock)
+    assert table_state.prev_state == "up"
+    assert table_state.update("up") == 330 + 60
+    assert session.in_session
+    assert session.duration() == 630 + 60
+    assert user_data[CO2] == 800
+    assert user_data[POWER] == 50.0
+    assert (clock.monotonic_ns() - user_data[LAST_UPDATE]) // 1_000_000_000 == 90
+
+    # Too old or from the future.
+    for wall_s in (EPOCH + MAX_AGE + 1, EPOCH - 1):
+        assert not restore(state, BinaryState(clock), session, {}, wall_s, clock)
+
+    # Taken before the time was known: restored only when assuming no downtime.
+    state[TIME] = 0
+    assert not restore(state, BinaryState(clock), session, {}, EPOCH + 60, clock)
+    assert restore(state, BinaryState(clock), session, {}, 0, clock)
+
+
+def test_warm_start():
+    """
+    only the newest snapshot is restored, the retained message is taken only once
+    """
+    clock = VirtualClock(EPOCH)
+    state = capture(*live_state(clock), wall_s=EPOCH, clock=clock)
+
+    # pylint: disable=too-few-public-methods
+    class FakeMQTT:
+        """
+        holds the user data like MQTT client
+        """
+
+        user_data = {}
+
+    mqtt = FakeMQTT()
+    on_message_with_state(mqtt, "state", to_message(state))
+    retained = mqtt.user_data.pop(RETAINED_STATE)
+    assert retained == state
+    on_message_with_state(mqtt, "state", to_message(state))
+    assert RETAINED_STATE not in mqtt.user_data
+    assert from_message("{") is None
+
+    # The device receives its own snapshots once it starts publishing them.
+    echo = FakeMQTT()
+    echo.user_data = {}
+    ignore_state_messages(echo.user_data)
+    on_message_with_state(echo, "state", to_message(state))
+    assert RETAINED_STATE not in echo.user_data
+
+    table_state = BinaryState(clock)
+    warm_start = WarmStart(table_state, SessionTracker(clock), {}, clock)
+    assert not warm_start.offer(None)
+    assert warm_start.offer(retained, EPOCH + 10)
+    assert not warm_start.offer(dict(state, table="down"), EPOCH + 10)
+    assert warm_start.offer(dict(state, table="down", time=EPOCH + 5), EPOCH + 10)
+    assert table_state.prev_state == "down"
+    assert warm_start.restored == EPOCH + 5
+
+
+def test_store():
+    """
+    the NVM is written only if the state changed
+    """
+
+    class CountingNVM(bytearray):
+        """
+        counts the writes
+        """
+
+        writes = 0
+
+        def __setitem__(self, key, value):
+            self.writes += 1
+            super().__setitem__(key, value)
+
+    clock = VirtualClock(EPOCH)
+    table_state, session, user_data = live_state(clock)
+    nvm = CountingNVM(64)
+    store = SnapshotStore(nvm, offset=6)
+    assert store.load() is None
+    assert store.save() is None
+
+    store.source = lambda: capture(table_state, session, user_data, 0, clock)
+    state = store.save()
+    assert nvm.writes == 1
+    assert store.load() == state
+    assert state[TIME] == 0
+    store.save()
+    assert nvm.writes == 1
+    assert nvm[:6] == bytes(6)
+
+    clock.advance(1)
+    store.save()
+    assert nvm.writes == 2
@@ -0,0 +1,67 @@
+"""
+tests for the main loop stall detection
+"""
+
+from unittest.mock import Mock
+
+from clock import VirtualClock
+from payload import COMPACT, decode_compact, encode_message
+from stallwatch import (
+    NVM_SIZE,
+    STAGE_DISTANCE,
+    STAGE_MQTT,
+    STALL_DURATION,
+    STALL_STAGE,
+    STALL_TAG,
+    StallWatch,
+)
+
+
+def test_stall_survives_reset():
+    """
+    the stalled stage and its duration are retrieved once after the "reset"
+    """
+    clock = VirtualClock()
+    nvm = bytearray(16)
+    wdt = Mock()
+    stall_watch = StallWatch(nvm, offset=4, clock=clock)
+    assert stall_watch.load_stall() is None
+
+    stall_watch.start(wdt, 10, "RAISE")
+    assert wdt.timeout == 10
+    assert wdt.mode == "RAISE"
+    stall_watch.enter(STAGE_MQTT)
+    clock.advance(1)
+    stall_watch.enter(STAGE_DISTANCE)
+    assert wdt.feed.call_count == 3
+    clock.advance(10.5)
+    assert stall_watch.record_stall() == {
+        STALL_STAGE: STAGE_DISTANCE,
+        STALL_DURATION: 10500,
+    }
+    assert nvm[:4] == bytes(4)
+    assert nvm[4 + NVM_SIZE :] == bytes(16 - 4 - NVM_SIZE)  # noqa: E203
+
+    stall_watch = StallWatch(nvm, offset=4, clock=clock)
+    stall = stall_watch.load_stall()
+    assert stall == {
+        "annotation": True,
+        "tags": [STALL_TAG],
+        STALL_STAGE: STAGE_DISTANCE,
+        STALL_DURATION: 10500,
+    }
+    assert decode_compact(encode_message(stall, COMPACT)) == stall
+    assert stall_watch.load_stall() is None
+
+
+def test_stop():
+    """
+    the watchdog is no longer fed after stop
+    """
+    wdt = Mock()
+    stall_watch = StallWatch(bytearray(NVM_SIZE), clock=VirtualClock())
+    stall_watch.start(wdt, 5, "RAISE")
+    stall_watch.stop()
+    wdt.deinit.assert_called_once()
+    stall_watch.enter(STAGE_MQTT)
+    assert wdt.feed.call_count == 1
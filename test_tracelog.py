@@ -0,0 +1,180 @@
+"""
+tests for trace recording and replay
+"""
+
+import io
+
+import pytest
+
+from clock import VirtualClock
+from config import Config
+from test_config import SECRETS
+from tools.simulator import FakeMQTTClient, Simulator
+from tools.trace_receiver import TraceFiles
+from tracelog import (
+    BUTTON,
+    DISTANCE,
+    MESSAGE,
+    MQTTTraceSink,
+    TraceRecorder,
+    read_trace,
+    replay,
+    split_chunk,
+)
+
+
+def run_live(simulator, recorder):
+    """
+    Feed flapping distance and power readings to the simulator for 2 hours
+    while recording them.
+    """
+    config = simulator.config
+    for second in range(2 * 3600):
+        if second % 10 == 0:
+            distance = 100.0 if second % 70 else 80.0
+            recorder.record_distance(distance)
+            simulator.distance(distance)
+            msg = b'{"current_power": 50}'
+            recorder.record_message(config.mqtt_topic_power, msg)
+            simulator.message(config.mqtt_topic_power, msg)
+        if second == 5:
+            recorder.record_button(1)
+            simulator.button(1)
+        simulator.tick()
+        simulator.clock.advance(1)
+
+
+def test_record_replay():
+    """
+    Replaying the recorded trace should lead to the same results.
+    """
+    config = Config(dict(SECRETS, start_hr=0, end_hr=24))
+    live = Simulator(config)
+    trace = io.BytesIO()
+    recorder = TraceRecorder(trace, live.clock)
+    run_live(live, recorder)
+
+    trace.seek(0)
+    records = list(read_trace(trace))
+    assert len(records) == 2 * 2 * 360 + 1
+    assert records[0] == (DISTANCE, 0, 80.0)
+    assert records[1] == (
+        MESSAGE,
+        0,
+        (config.mqtt_topic_power, b'{"current_power": 50}'),
+    )
+    assert (BUTTON, 5000, 1) in records
+
+    replayed = Simulator(config)
+    count = replay(
+        records,
+        replayed.clock,
+        replayed.distance,
+        replayed.button,
+        replayed.message,
+        on_tick=replayed.tick,
+    )
+    assert count == len(records)
+    assert replayed.mqtt_client.published == live.mqtt_client.published
+    assert replayed.pixel.colors == live.pixel.colors
+
+
+def test_truncated_trace():
+    """
+    Truncated last record should be skipped, invalid trace should be rejected.
+    """
+    trace = io.BytesIO()
+    recorder = TraceRecorder(trace)
+    recorder.record_distance(90)
+    recorder.record_distance(91)
+    data = trace.getvalue()
+    assert len(list(read_trace(io.BytesIO(data[:-1])))) == 1
+    with pytest.raises(ValueError):
+        list(read_trace(io.BytesIO(b"foo")))
+
+
+def test_appended_trace():
+    """
+    The recordings of subsequent boots appended to the same file are read
+    as one trace, the timestamps continue from the previous recording.
+    Messages that do not fit into record are skipped.
+    """
+    trace = io.BytesIO()
+    for boot in range(2):
+        clock = VirtualClock()
+        recorder = TraceRecorder(trace, clock)
+        clock.advance(1)
+        recorder.record_distance(90 + boot)
+        recorder.record_message("a" * 256, b"{}")
+        recorder.record_message("foo", bytes(0x10000))
+        clock.advance(1)
+        recorder.record_button(boot)
+
+    trace.seek(0)
+    assert list(read_trace(trace)) == [
+        (DISTANCE, 1000, 90.0),
+        (BUTTON, 2000, 0),
+        (DISTANCE, 3000, 91.0),
+        (BUTTON, 4000, 1),
+    ]
+
+
+def test_mqtt_sink(tmp_path):
+    """
+    The trace should be published in chunks of whole records, these should
+    be stored by the receiver into trace equal to the recorded one.
+    The records written before the MQTT client is set should be kept.
+    """
+    sink = MQTTTraceSink(None, "trace", chunk_size=64)
+    recorder = TraceRecorder(sink)
+    file = io.BytesIO()
+    file_recorder = TraceRecorder(file)
+    recorder.record_distance(1)
+    file_recorder.record_distance(1)
+    recorder.flush()
+    mqtt_client = FakeMQTTClient({})
+    sink.mqtt_client = mqtt_client
+    for distance in range(2, 20):
+        recorder.record_distance(distance)
+        file_recorder.record_distance(distance)
+    recorder.record_message("foo", b"bar")
+    file_recorder.record_message("foo", b"bar")
+    recorder.flush()
+
+    chunks = [msg for _, msg in mqtt_client.published]
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 64 for chunk in chunks)
+    assert [split_chunk(chunk)[0] for chunk in chunks] == list(range(len(chunks)))
+
+    files = TraceFiles(str(tmp_path / "desk"))
+    for chunk in chunks:
+        files.write(chunk)
+    files.close()
+    assert len(files.paths) == 1
+    with open(files.paths[0], "rb") as trace:
+        assert trace.read() == file.getvalue()
+
+
+def test_mqtt_sink_lost_chunk(tmp_path):
+    """
+    Lost chunk should not prevent reading the records that follow.
+    New trace (device boot) should be stored into new file.
+    """
+    mqtt_client = FakeMQTTClient({})
+    recorder = TraceRecorder(MQTTTraceSink(mqtt_client, "trace", chunk_size=32))
+    for distance in range(6):
+        recorder.record_distance(distance)
+    recorder.flush()
+    chunks = [msg for _, msg in mqtt_client.published]
+    assert len(chunks) == 3
+
+    files = TraceFiles(str(tmp_path / "desk"))
+    files.write(chunks[0])
+    files.write(chunks[2])
+    files.write(chunks[0])
+    files.close()
+    assert len(files.paths) == 2
+    with open(files.paths[0], "rb") as trace:
+        assert [value for _, _, value in read_trace(trace)] == [0, 1, 4, 5]
+    with open(files.paths[1], "rb") as trace:
+        assert [value for _, _, value in read_trace(trace)] == [0, 1]
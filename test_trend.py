@@ -0,0 +1,94 @@
+"""
+tests for the CO2 trend estimation and early alert
+"""
+
+import random
+from types import SimpleNamespace
+from unittest.mock import Mock
+
+import pytest
+
+from blinker import Blinker
+from clock import VirtualClock
+from config import Config
+from handlers import (
+    CO2_SLOPE,
+    COLOR_PRIORITY,
+    RED,
+    TEXT_COLOR_WARNING,
+    YELLOW,
+    handle_distance,
+    on_message_with_env_metrics,
+    refresh_text,
+)
+from test_config import SECRETS
+from trend import Trend
+
+
+def test_slope():
+    """
+    linear ramp with noise
+    """
+    rng = random.Random(1)
+    trend = Trend(window=600)
+    assert trend.slope() is None
+    for second in range(0, 3600, 30):
+        trend.update(400 + second * 0.2 + rng.uniform(-5, 5), second * 1_000_000_000)
+    assert trend.slope() == pytest.approx(0.2, rel=0.05)
+    assert trend.value() == pytest.approx(400 + 3570 * 0.2, abs=5)
+    # 0.2 ppm/s from ~1114 to 1200
+    assert trend.time_to(1200, 3570 * 1_000_000_000) == pytest.approx(430, rel=0.1)
+    assert trend.time_to(1000, 3570 * 1_000_000_000) == 0
+
+
+def test_window():
+    """
+    The old samples fade away, a long gap resets the estimator.
+    """
+    trend = Trend(window=60)
+    for second in range(0, 600, 10):
+        trend.update(second, second * 1_000_000_000)
+    for second in range(600, 1200, 10):
+        trend.update(600 - (second - 600) / 100, second * 1_000_000_000)
+    assert trend.slope() == pytest.approx(-0.01, abs=1e-3)
+    assert trend.time_to(500, 1200 * 1_000_000_000) is None
+
+    trend.update(600, 2000 * 1_000_000_000)
+    assert trend.slope() is None
+
+
+def test_early_alert():
+    """
+    CO2 rising by 10 ppm a minute from 600 reaches 1000 after 40 minutes,
+    the early alert fires when it is less than 10 minutes away.
+    """
+    clock = VirtualClock()
+    config = Config(dict(SECRETS, co2_early_alert_seconds=600))
+    mqtt_client = Mock()
+    mqtt_client.user_data = {}
+    labels = [SimpleNamespace(text="", color=0) for _ in range(4)]
+    blinker = Blinker(Mock(), priorities=COLOR_PRIORITY, clock=clock)
+
+    alerts = {}
+    for second in range(0, 45 * 60, 30):
+        co2 = 600 + second // 6
+        on_message_with_env_metrics(
+            mqtt_client,
+            config.mqtt_topic_env,
+            f'{{"co2_ppm": {co2}, "temperature": 23.1, "humidity": 40}}',
+            clock,
+        )
+        refresh_text(*labels, mqtt_client.user_data, config, blinker, clock)
+        if blinker.is_blinking:
+            alerts.setdefault(blinker.color, second)
+        if labels[0].color == TEXT_COLOR_WARNING:
+            alerts.setdefault(TEXT_COLOR_WARNING, second)
+        clock.advance(30)
+
+    assert 29 * 60 <= alerts[YELLOW] <= 31 * 60
+    assert alerts[TEXT_COLOR_WARNING] == alerts[YELLOW]
+    assert alerts[RED] == 40 * 60 + 30
+    assert mqtt_client.user_data[CO2_SLOPE] == pytest.approx(10, rel=0.01)
+
+    handle_distance(100, config, mqtt_client, config.mqtt_topic, mqtt_client.user_data)
+    assert "co2_slope_ppm_per_min" in mqtt_client.publish.call_args.args[1]
@@ -0,0 +1,132 @@
+"""
+Simulate a workday of the main loop using virtual clock.
+"""
+
+import calendar
+import json
+
+from config import Config
+from events import (
+    BREAK_SECONDS,
+    CO2_EPISODE_END,
+    CO2_EPISODE_START,
+    SENSOR_STALE,
+    TABLE_DOWN,
+    TABLE_DURATION,
+    TABLE_UP,
+)
+from handlers import BLUE, GREEN, RED, TEXT_COLOR_ALERT, TEXT_COLOR_BASE
+from session import BREAK, SESSION_END, SESSION_START
+from test_config import SECRETS
+from tools.simulator import Simulator
+
+
+def hhmm(hours, minutes=0):
+    """
+    :return: seconds since midnight
+    """
+    return hours * 3600 + minutes * 60
+
+
+def scenario(now):
+    """
+    :param now: seconds since midnight
+    :return: tuple of table distance, power and CO2 value at given time of day
+    """
+    distance = 120 if hhmm(10) <= now < hhmm(11) else 70
+    power = 5 if hhmm(12) <= now < hhmm(12, 30) else 50
+    co2 = 1300 if hhmm(15) <= now < hhmm(15, 30) else 600
+    return distance, power, co2
+
+
+def test_workday():
+    """
+    Run the main loop logic (see tools/simulator.py) from 7:00 to 18:00 in one second steps
+    and check the alerts and published messages.
+    """
+    # Use winter day so that there is no DST offset.
+    day_start = calendar.timegm((2024, 1, 15, 0, 0, 0, 0, 15, 0))
+    config = Config(dict(SECRETS, start_hr=8, end_hr=18))
+    simulator = Simulator(config, epoch=day_start + hhmm(7))
+
+    alerts = {}
+    for second in range(hhmm(7), hhmm(18)):
+        distance, power, co2 = scenario(second)
+        if second % 10 == 0:
+            simulator.distance(distance)
+            simulator.message(config.mqtt_topic_power, f'{{"current_power": {power}}}')
+        if second % 30 == 0:
+            simulator.message(
+                config.mqtt_topic_env,
+                f'{{"co2_ppm": {co2}, "temperature": 23.1, "humidity": 40}}',
+            )
+
+        simulator.tick()
+
+        if simulator.blinker.is_blinking:
+            alerts.setdefault(simulator.blinker.color, second)
+        if simulator.labels[0].color == TEXT_COLOR_ALERT:
+            alerts.setdefault(TEXT_COLOR_ALERT, second)
+        simulator.clock.advance(1)
+
+    # Power on since 8:00 without a break -> break alert after 45 minutes.
+    assert alerts[GREEN] == hhmm(8, 45) + 1
+    # The session starts after the minimum on-dwell time (backdated to 8:00),
+    # the table position is tracked from then on -> table alert after 30 minutes.
+    assert alerts[BLUE] == hhmm(8, 30) + config.min_on_seconds + 1
+    # CO2 went up at 15:00, the CO2 alert has the highest priority.
+    assert alerts[TEXT_COLOR_ALERT] == hhmm(15)
+    assert alerts[RED] == hhmm(15)
+    assert simulator.labels[0].color != TEXT_COLOR_ALERT
+    assert simulator.pixel.colors == {RED, GREEN, BLUE}
+
+    published = [msg for _, msg in simulator.mqtt_client.published]
+    annotations = [p for p in published if "annotation" in p]
+    assert len([p for p in published if "distance" in p]) == hhmm(11) // 10
+    tags = [json.loads(a)["tags"] for a in annotations]
+    assert tags == [
+        [SESSION_START],
+        [TABLE_DURATION],
+        [TABLE_UP],
+        [TABLE_DURATION],
+        [TABLE_DOWN],
+        [TABLE_DURATION],
+        # Lunch break from 12:00 to 12:30.
+        [SESSION_END],
+        [BREAK, SESSION_START],
+        [TABLE_DURATION],
+        [CO2_EPISODE_START],
+        [CO2_EPISODE_END],
+    ]
+    assert json.loads(annotations[7])[BREAK_SECONDS] == 1800
+
+
+def test_stale_co2():
+    """
+    The CO2 alert and episode end when the high reading goes stale.
+    """
+    config = Config(dict(SECRETS, start_hr=0, end_hr=24))
+    simulator = Simulator(config)
+    simulator.message(
+        config.mqtt_topic_env,
+        '{"co2_ppm": 1300, "temperature": 23.1, "humidity": 40}',
+    )
+    simulator.tick()
+    assert simulator.blinker.color == RED
+    assert simulator.labels[0].color == TEXT_COLOR_ALERT
+
+    # The events are published after the event window.
+    for _ in range(config.last_update_threshold + config.event_window_seconds + 1):
+        simulator.clock.advance(1)
+        simulator.tick()
+
+    assert not simulator.blinker.is_blinking
+    assert simulator.labels[0].text == "N/A"
+    assert simulator.labels[0].color == TEXT_COLOR_BASE
+    tags = [
+        tag
+        for _, msg in simulator.mqtt_client.published
+        if "annotation" in msg
+        for tag in json.loads(msg)["tags"]
+    ]
+    assert tags == [CO2_EPISODE_START, SENSOR_STALE, CO2_EPISODE_END]
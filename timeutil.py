@@ -4,6 +4,9 @@ DST utilities
 
 import adafruit_logging as logging
 
+from clock import CLOCK
+from logutil import debug_enabled
+
 
 def dst_offset_eu(time_struct) -> int:
     """
@@ -38,26 +41,73 @@ def dst_offset_eu(time_struct) -> int:
     return 0
 
 
-def get_time(ntp):
+def get_datetime(ntp):
     """
-    return current time from NTP as tuple hour, minute
+    :return: current time from NTP as time struct, retried on error
     """
     logger = logging.getLogger(__name__)
 
-    current_time = None  # to silence a warning in IDEA
     attempts = 3
     for i in range(attempts):
         try:
-            current_time = ntp.datetime
-            break
+            return ntp.datetime
         except OSError as os_error:
             logger.warning(f"got OSError when getting NTP time: {os_error}")
             if i == attempts - 1:
                 raise os_error
-            continue
 
+    return None  # not reached, to silence a warning
+
+
+def get_time(ntp):
+    """
+    return current time from NTP as tuple hour, minute
+    """
+    logger = logging.getLogger(__name__)
+
+    current_time = get_datetime(ntp)
     current_hour = current_time.tm_hour + dst_offset_eu(current_time)
     current_minute = current_time.tm_min
-    logger.debug(f"time: {current_hour:2}:{current_minute:02}")
+    if debug_enabled(logger):
+        logger.debug(f"time: {current_hour:2}:{current_minute:02}")
 
     return current_hour, current_minute
+
+
+# pylint: disable=too-few-public-methods
+class HourCache:
+    """
+    Keeps the current hour (and day of the week) so that the time is obtained (which allocates
+    the time struct and possibly performs NTP request) only once per interval
+    rather than on each iteration of the main loop.
+    """
+
+    def __init__(self, default, interval=10, clock=CLOCK):
+        """
+        :param default: hour to assume until the time source is set
+        :param interval: how often to refresh the hour, in seconds
+        """
+        self.ntp = None
+        self.hour = default
+        # Day of the week (0 is Monday), None until the time is known.
+        self.weekday = None
+        self._interval_ns = interval * 1_000_000_000
+        self._next_ns = 0
+        self._clock = clock
+
+    def update(self, now_ns=None) -> int:
+        """
+        Refresh the hour if the interval passed and the time source (self.ntp) is set.
+        :param now_ns: current monotonic time in nanoseconds, if already known
+        :return: current hour
+        """
+        if self.ntp is None:
+            return self.hour
+
+        now = self._clock.monotonic_ns() if now_ns is None else now_ns
+        if now >= self._next_ns:
+            current_time = get_datetime(self.ntp)
+            self.hour = current_time.tm_hour + dst_offset_eu(current_time)
+            self.weekday = current_time.tm_wday
+            self._next_ns = now + self._interval_ns
+        return self.hour
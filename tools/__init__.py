@@ -0,0 +1,3 @@
+"""
+host side tools for workmon (not meant to be copied to the microcontroller)
+"""
@@ -0,0 +1,342 @@
+"""
+Offline work pattern analysis of exported distance and power time series.
+
+Run from the top level directory of the repository, e.g.:
+
+    python -m tools.analytics --distance distance.json --power power.csv
+
+The input files are either CSV with timestamp (seconds since the Epoch) and value
+columns (optionally with header) or Prometheus JSON as returned from
+the /api/v1/query_range endpoint.
+
+The thresholds and working hours are taken from the device configuration
+given with --secrets (and can be overridden with the options).
+
+The series are resampled to a common grid (the last value not older than --max-age
+is used) and evaluated with the same semantics as on the device:
+  - the power is on if it is above power_threshold_watts
+  - the work session starts once the power is on for min_on_seconds and ends
+    once it is off for min_break_seconds (see session.SessionTracker)
+  - the table is up if the distance is above distance_threshold
+  - local time is UTC + tz_offset + dst_offset_eu()
+Only the time between start_hr and end_hr is considered, so the gaps
+between the sessions spanning outside of these hours are not counted as breaks.
+"""
+
+import argparse
+import json
+import runpy
+
+import numpy as np
+
+from config import LIVE_DEFAULTS, MIN_BREAK, MIN_ON, Config
+
+SECONDS_PER_DAY = 86400
+
+
+def load_series(path):
+    """
+    Load time series from CSV or Prometheus JSON file.
+    :return: tuple of arrays with timestamps and values, sorted by timestamp
+    """
+    with open(path, "r", encoding="utf-8") as file:
+        first = file.read(1)
+        file.seek(0)
+        if first in "{[":
+            data = json.load(file)
+            if isinstance(data, dict):
+                data = data["data"]["result"]
+            values = [value for result in data for value in result["values"]]
+            series = np.array(values, dtype=np.float64).reshape(-1, 2)
+        else:
+            header = file.readline()
+            skip = 0
+            try:
+                float(header.split(",")[0])
+            except ValueError:
+                skip = 1
+            file.seek(0)
+            series = np.loadtxt(
+                file, delimiter=",", skiprows=skip, usecols=(0, 1), ndmin=2
+            )
+
+    order = np.argsort(series[:, 0], kind="stable")
+    return series[order, 0], series[order, 1]
+
+
+def resample(timestamps, values, grid, max_age):
+    """
+    :return: array with the last value at or before each grid point,
+    NaN if there is none or it is older than max_age seconds
+    """
+    if len(timestamps) == 0:
+        return np.full(len(grid), np.nan)
+    idx = np.searchsorted(timestamps, grid, side="right") - 1
+    valid = idx >= 0
+    idx = np.maximum(idx, 0)
+    valid &= grid - timestamps[idx] <= max_age
+    return np.where(valid, values[idx], np.nan)
+
+
+def dst_offset_eu(year, month, day, hour):
+    """
+    Vectorized version of timeutil.dst_offset_eu() taking arrays of the date components.
+    :return: array of time offsets in hours
+    """
+    begin_dst_month = 3  # March
+    begin_dst_day = 31 - (5 * year // 4 + 4) % 7
+    end_dst_month = 10  # October
+    end_dst_day = 31 - (5 * year // 4 + 1) % 7
+
+    dst = (
+        ((month > begin_dst_month) & (month < end_dst_month))
+        | ((month == begin_dst_month) & (day > begin_dst_day))
+        | ((month == begin_dst_month) & (day == begin_dst_day) & (hour >= 2))
+        | ((month == end_dst_month) & (day < end_dst_day))
+        | ((month == end_dst_month) & (day == end_dst_day) & (hour < 1))
+    )
+    return dst.astype(np.int64)
+
+
+def local_time(timestamps, tz_offset):
+    """
+    :return: array of local time in seconds since the Epoch (including DST)
+    """
+    local = np.floor(timestamps).astype(np.int64) + tz_offset * 3600
+    seconds = local.astype("datetime64[s]")
+    days = seconds.astype("datetime64[D]")
+    months = seconds.astype("datetime64[M]")
+    year = seconds.astype("datetime64[Y]").astype(np.int64) + 1970
+    month = months.astype(np.int64) % 12 + 1
+    day = (days - months.astype("datetime64[D]")).astype(np.int64) + 1
+    hour = (seconds - days).astype(np.int64) // 3600
+    return local + dst_offset_eu(year, month, day, hour) * 3600
+
+
+def runs(mask):
+    """
+    :return: tuple of arrays with start and end (exclusive) indexes of the runs of True
+    """
+    padded = np.concatenate(([0], mask.astype(np.int8), [0]))
+    diff = np.diff(padded)
+    return np.flatnonzero(diff == 1), np.flatnonzero(diff == -1)
+
+
+def dwell(mask, min_on, min_break, step):
+    """
+    Apply the minimum dwell times of session.SessionTracker to the on/off samples.
+    The state changes once the contradicting samples last for the minimum time
+    (measured from the first of them) and the change is backdated to the first of them.
+    :return: boolean array, True where in session
+    """
+    if len(mask) == 0:
+        return mask
+    edges = np.flatnonzero(np.diff(mask.astype(np.int8))) + 1
+    starts = np.concatenate(([0], edges))
+    ends = np.concatenate((edges, [len(mask)]))
+    values = mask[starts]
+    changes = (ends - starts - 1) * step >= np.where(values, min_on, min_break)
+    # Each run takes the value of the last run that lasted long enough to change the state.
+    last = np.maximum.accumulate(np.where(changes, np.arange(len(starts)), -1))
+    state = (last >= 0) & values[np.maximum(last, 0)]
+    return np.repeat(state, ends - starts)
+
+
+def week_start(local):
+    """
+    :return: array of days since the Epoch of Monday of the week
+    """
+    days = local // SECONDS_PER_DAY
+    # 1970-01-01 was Thursday.
+    return days - (days + 3) % 7
+
+
+def run_stats(durations):
+    """
+    :return: dictionary with count, mean and maximum of the durations
+    """
+    if len(durations) == 0:
+        return {"count": 0, "mean": 0.0, "max": 0.0}
+    return {
+        "count": int(len(durations)),
+        "mean": float(np.mean(durations)),
+        "max": float(np.max(durations)),
+    }
+
+
+# pylint: disable=too-many-locals
+def analyze(distance_series, power_series, params):
+    """
+    :param distance_series: tuple of timestamp and value arrays
+    :param power_series: tuple of timestamp and value arrays
+    :param params: object with the distance_threshold, power_threshold_watts,
+    break_threshold_seconds, tz_offset, start_hr, end_hr, min_on, min_break, step
+    and max_age attributes
+    :return: dictionary with the results
+    """
+    step = params.step
+    start = min(distance_series[0][0], power_series[0][0]) // step * step
+    end = max(distance_series[0][-1], power_series[0][-1])
+    grid = start + np.arange(int((end - start) // step) + 1) * step
+
+    power = resample(*power_series, grid, params.max_age)
+    distance = resample(*distance_series, grid, params.max_age)
+    local = local_time(grid, params.tz_offset)
+    hour = local // 3600 % 24
+
+    in_hours = (hour >= params.start_hr) & (hour < params.end_hr)
+    with np.errstate(invalid="ignore"):
+        working = dwell(
+            (power > params.power_threshold_watts) & in_hours,
+            params.min_on,
+            params.min_break,
+            step,
+        )
+        up = working & (distance > params.distance_threshold)
+        down = working & (distance <= params.distance_threshold)
+
+    session_starts, session_ends = runs(working)
+    sessions = (session_ends - session_starts) * step
+    # The gaps spanning outside of the working hours are not breaks.
+    outside = np.concatenate(([0], np.cumsum(~in_hours)))
+    within = outside[session_starts[1:]] == outside[session_ends[:-1]]
+    breaks = (session_starts[1:] - session_ends[:-1])[within] * step
+    break_weeks = week_start(local[session_ends[:-1][within]])
+    stand_starts, stand_ends = runs(up)
+    sit_starts, sit_ends = runs(down)
+
+    weeks = week_start(local)
+    first_week = weeks[0]
+    week_count = int(weeks[-1] - first_week) + 1
+    worked = np.bincount(weeks - first_week, weights=working, minlength=week_count)
+    standing = np.bincount(weeks - first_week, weights=up, minlength=week_count)
+    sitting = np.bincount(weeks - first_week, weights=down, minlength=week_count)
+    week_breaks = np.bincount(break_weeks - first_week, minlength=week_count)
+
+    weekly = {}
+    for i in np.flatnonzero(worked):
+        monday = str(np.datetime64(int(first_week + i), "D"))
+        weekly[monday] = {
+            "worked": float(worked[i] * step),
+            "standing": float(standing[i] * step),
+            "sitting": float(sitting[i] * step),
+            "breaks": int(week_breaks[i]),
+        }
+
+    return {
+        "sessions": run_stats(sessions),
+        "overdue_sessions": int(
+            np.count_nonzero(sessions > params.break_threshold_seconds)
+        ),
+        "breaks": run_stats(breaks),
+        "standing": run_stats((stand_ends - stand_starts) * step),
+        "sitting": run_stats((sit_ends - sit_starts) * step),
+        "weeks": weekly,
+    }
+
+
+def add_arguments(parser):
+    """
+    add the analysis parameters to the argument parser
+    """
+    parser.add_argument(
+        "--secrets",
+        help="path to secrets.py of the device to take the thresholds "
+        "and working hours from",
+    )
+    parser.add_argument("--distance-threshold", type=float, default=90)
+    parser.add_argument("--power-threshold-watts", type=float, default=35)
+    parser.add_argument(
+        "--break-threshold-seconds",
+        type=float,
+        default=1800,
+        help="sessions longer than this are counted as overdue",
+    )
+    parser.add_argument("--tz-offset", type=int, default=1, help="hours from UTC")
+    parser.add_argument("--start-hr", type=int, default=8)
+    parser.add_argument("--end-hr", type=int, default=18)
+    parser.add_argument(
+        "--min-on",
+        type=float,
+        default=LIVE_DEFAULTS[MIN_ON],
+        help="minimum duration of power on period to start a session (seconds)",
+    )
+    parser.add_argument(
+        "--min-break",
+        type=float,
+        default=LIVE_DEFAULTS[MIN_BREAK],
+        help="minimum duration of power off period to end a session (seconds)",
+    )
+    parser.add_argument("--step", type=float, default=10, help="resampling step")
+    parser.add_argument(
+        "--max-age",
+        type=float,
+        default=60,
+        help="maximum age of a sample to be used for a grid point (seconds)",
+    )
+
+
+def parse_args(parser, argv=None):
+    """
+    Parse the arguments, with the defaults taken from the configuration
+    given with --secrets (if any).
+    """
+    args, _ = parser.parse_known_args(argv)
+    if args.secrets:
+        config = Config(runpy.run_path(args.secrets)["secrets"])
+        parser.set_defaults(
+            distance_threshold=config.distance_threshold,
+            power_threshold_watts=config.power_threshold_watts,
+            break_threshold_seconds=config.break_threshold_seconds,
+            tz_offset=config.tz_offset,
+            start_hr=config.start_hr,
+            end_hr=config.end_hr,
+            min_on=config.min_on_seconds,
+            min_break=config.min_break_seconds,
+        )
+    return parser.parse_args(argv)
+
+
+def print_report(result):
+    """
+    print the results in human readable form
+    """
+    for name in ["sessions", "breaks", "standing", "sitting"]:
+        stats = result[name]
+        print(
+            f"{name:10} {stats['count']:6} runs, mean {stats['mean'] / 60:7.1f} min, "
+            f"max {stats['max'] / 60:7.1f} min"
+        )
+    print(f"sessions longer than break threshold: {result['overdue_sessions']}")
+    print()
+    print("week         worked   sitting  standing  breaks")
+    for monday, totals in result["weeks"].items():
+        print(
+            f"{monday} {totals['worked'] / 3600:7.1f} h "
+            f"{totals['sitting'] / 3600:7.1f} h {totals['standing'] / 3600:7.1f} h "
+            f"{totals['breaks']:7}"
+        )
+
+
+def main():
+    """
+    command line interface
+    """
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--distance", required=True, help="distance series file")
+    parser.add_argument("--power", required=True, help="power series file")
+    parser.add_argument("--json", action="store_true", help="print JSON")
+    add_arguments(parser)
+    args = parse_args(parser)
+
+    result = analyze(load_series(args.distance), load_series(args.power), args)
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_report(result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""
+Compare the vectorized analysis in tools/analytics.py with pure Python loop
+over synthetic data.
+
+Run from the top level directory of the repository:
+
+    python -m tools.bench_analytics --days 90
+"""
+
+import argparse
+import math
+import time
+
+import numpy as np
+
+from clock import VirtualClock
+from session import SessionTracker
+from timeutil import dst_offset_eu
+from tools.analytics import SECONDS_PER_DAY, add_arguments, analyze, parse_args
+
+
+def synthesize(days, start=1704067200, seed=1):
+    """
+    Generate distance and power series sampled every 10 seconds with some jitter.
+    The power is on during working hours with random breaks,
+    the table moves up and down every now and then.
+    :return: tuple of distance and power series (tuples of arrays)
+    """
+    rng = np.random.default_rng(seed)
+    count = days * SECONDS_PER_DAY // 10
+    timestamps = start + np.arange(count) * 10.0 + rng.uniform(0, 1, count)
+
+    hour = timestamps // 3600 % 24
+    weekday = (timestamps // SECONDS_PER_DAY + 3) % 7
+    working = (hour >= 7) & (hour < 16) & (weekday < 5)
+    # Breaks and table position change in 10 minute blocks.
+    blocks = (timestamps - start) // 600
+    block_rng = rng.uniform(0, 1, int(blocks[-1]) + 1)
+    working &= block_rng[blocks.astype(np.int64)] > 0.1
+    standing = rng.uniform(0, 1, int(blocks[-1]) + 1)[blocks.astype(np.int64)] > 0.6
+
+    power = np.where(working, 50.0, 2.0) + rng.uniform(-1, 1, count)
+    distance = np.where(standing, 110.0, 75.0) + rng.uniform(-1, 1, count)
+    return (timestamps, distance), (timestamps.copy(), power)
+
+
+def _stats(durations):
+    if not durations:
+        return {"count": 0, "mean": 0.0, "max": 0.0}
+    return {
+        "count": len(durations),
+        "mean": sum(durations) / len(durations),
+        "max": float(max(durations)),
+    }
+
+
+def session_loop(working, params):
+    """
+    Run the on/off samples through session.SessionTracker.
+    :return: list with True for the samples in session
+    """
+    clock = VirtualClock()
+    tracker = SessionTracker(clock)
+    state = []
+    change = None
+    for on in working:
+        if on == tracker.in_session:
+            change = None
+        elif change is None:
+            change = len(state)
+        if tracker.update(on, params.min_on, params.min_break):
+            # The change is backdated to the first contradicting sample.
+            state[change:] = [on] * (len(state) - change)
+            change = None
+        state.append(tracker.in_session)
+        clock.advance(params.step)
+    return state
+
+
+# pylint: disable=too-many-locals,too-many-branches,too-many-statements
+def analyze_loop(distance_series, power_series, params):
+    """
+    The same as analytics.analyze() done sample by sample in pure Python.
+    """
+    step = params.step
+    d_times, d_values = list(distance_series[0]), list(distance_series[1])
+    p_times, p_values = list(power_series[0]), list(power_series[1])
+    start = min(d_times[0], p_times[0]) // step * step
+    end = max(d_times[-1], p_times[-1])
+
+    samples = []
+    d_idx = p_idx = 0
+    for i in range(int((end - start) // step) + 1):
+        now = start + i * step
+
+        # Find the last samples at or before now.
+        while d_idx < len(d_times) and d_times[d_idx] <= now:
+            d_idx += 1
+        while p_idx < len(p_times) and p_times[p_idx] <= now:
+            p_idx += 1
+        power = None
+        if p_idx > 0 and now - p_times[p_idx - 1] <= params.max_age:
+            power = p_values[p_idx - 1]
+        distance = None
+        if d_idx > 0 and now - d_times[d_idx - 1] <= params.max_age:
+            distance = d_values[d_idx - 1]
+
+        local = math.floor(now) + params.tz_offset * 3600
+        local += dst_offset_eu(time.gmtime(local)) * 3600
+        hour = local // 3600 % 24
+        days = local // SECONDS_PER_DAY
+        in_hours = params.start_hr <= hour < params.end_hr
+        power_on = (
+            power is not None and power > params.power_threshold_watts and in_hours
+        )
+        samples.append((distance, in_hours, power_on, days - (days + 3) % 7))
+
+    sessions, breaks, standing_runs, sitting_runs = [], [], [], []
+    weeks = {}
+    session = 0
+    gap = 0
+    gap_week = None
+    gap_in_hours = True
+    table_run = 0
+    table_up = None
+    in_session = session_loop([sample[2] for sample in samples], params)
+    for (distance, in_hours, _, monday), working in zip(samples, in_session):
+        totals = weeks.setdefault(
+            monday, {"worked": 0.0, "standing": 0.0, "sitting": 0.0, "breaks": 0}
+        )
+
+        if working:
+            if gap and gap_in_hours:
+                breaks.append(gap * step)
+                weeks[gap_week]["breaks"] += 1
+            session += 1
+            gap = 0
+            totals["worked"] += step
+        else:
+            if session:
+                sessions.append(session * step)
+                gap_week = monday
+                gap = 0
+                gap_in_hours = True
+            session = 0
+            if sessions:
+                gap += 1
+                gap_in_hours = gap_in_hours and in_hours
+
+        cur_up = None
+        if working and distance is not None:
+            cur_up = distance > params.distance_threshold
+            totals["standing" if cur_up else "sitting"] += step
+        if cur_up != table_up and table_run:
+            (standing_runs if table_up else sitting_runs).append(table_run * step)
+            table_run = 0
+        table_up = cur_up
+        if cur_up is not None:
+            table_run += 1
+
+    if session:
+        sessions.append(session * step)
+    if table_run:
+        (standing_runs if table_up else sitting_runs).append(table_run * step)
+
+    return {
+        "sessions": _stats(sessions),
+        "overdue_sessions": sum(
+            1 for s in sessions if s > params.break_threshold_seconds
+        ),
+        "breaks": _stats(breaks),
+        "standing": _stats(standing_runs),
+        "sitting": _stats(sitting_runs),
+        "weeks": {
+            time.strftime("%Y-%m-%d", time.gmtime(monday * SECONDS_PER_DAY)): totals
+            for monday, totals in sorted(weeks.items())
+            if totals["worked"]
+        },
+    }
+
+
+def main():
+    """
+    run the benchmark
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--days", type=int, default=90, help="days of data")
+    add_arguments(parser)
+    args = parse_args(parser)
+
+    distance_series, power_series = synthesize(args.days)
+    print(f"{len(distance_series[0])} distance and power samples each")
+
+    for name, func in [("numpy", analyze), ("loop", analyze_loop)]:
+        start = time.perf_counter()
+        result = func(distance_series, power_series, args)
+        elapsed = time.perf_counter() - start
+        print(
+            f"{name:6} {elapsed:8.3f} s, {result['sessions']['count']} sessions, "
+            f"{result['breaks']['count']} breaks"
+        )
+
+
+if __name__ == "__main__":
+    main()
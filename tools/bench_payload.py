@@ -0,0 +1,72 @@
+"""
+Compare json.loads() with PayloadDecoder in terms of time and allocations per message.
+
+Run from the top level directory of the repository:
+
+    python -m tools.bench_payload
+"""
+
+import json
+import time
+import tracemalloc
+
+from payload import PayloadDecoder, encode_compact
+
+ENV_MSG = b'{"co2_ppm": 812, "temperature": 23.4, "humidity": 41.5, "pressure": 1013.2}'
+POWER_MSG = (
+    b'{"device_on": true, "current_power": 57.3, "today_energy": 312, '
+    b'"month_energy": 9120, "today_runtime": 401}'
+)
+KEYS = ("co2_ppm", "temperature", "humidity")
+
+
+def decode_json(msg, keys):
+    """
+    the original way of decoding the messages
+    """
+    metrics = json.loads(msg)
+    return [metrics.get(k) for k in keys]
+
+
+def measure(name, func, iterations):
+    """
+    Print time and bytes allocated per call of func().
+    """
+    func()  # warm up
+
+    start = time.perf_counter_ns()
+    for _ in range(iterations):
+        func()
+    elapsed = time.perf_counter_ns() - start
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{name:24} {elapsed / iterations / 1000:8.2f} us/msg {peak:6} B peak/msg")
+
+
+def main():
+    """
+    run the benchmark
+    """
+    iterations = 100_000
+    env_decoder = PayloadDecoder(KEYS)
+    power_decoder = PayloadDecoder(("current_power",))
+    compact_msg = encode_compact(json.loads(ENV_MSG))
+
+    measure("env json.loads", lambda: decode_json(ENV_MSG, KEYS), iterations)
+    measure("env scan", lambda: env_decoder.decode(ENV_MSG), iterations)
+    measure("env compact", lambda: env_decoder.decode(compact_msg), iterations)
+    measure(
+        "power json.loads",
+        lambda: decode_json(POWER_MSG, ("current_power",)),
+        iterations,
+    )
+    measure("power scan", lambda: power_decoder.decode(POWER_MSG), iterations)
+
+
+if __name__ == "__main__":
+    main()
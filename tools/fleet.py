@@ -0,0 +1,379 @@
+"""
+Aggregate messages from many workmon devices (desks) and expose per-desk
+statistics as single Prometheus endpoint.
+
+Run from the top level directory of the repository, e.g.:
+
+    python -m tools.fleet --broker 172.40.0.3 \\
+        --distance-topic 'devices/+/featherTFT' --power-topic 'devices/plug/+'
+
+The '+' in the topic patterns is the desk name, it has to be the same
+for the distance and power topics of given desk.
+The per-desk state has constant size, the messages are processed in batches.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import time
+
+from binarystate import BinaryState
+from payload import COMPACT_VERSION, decode_compact
+
+UP = "up"
+DOWN = "down"
+ON = "on"
+OFF = "off"
+
+# Longest time (in seconds) between two messages of a desk that is accounted
+# to the daily totals. The devices publish every 10 seconds, longer gap means
+# the device was offline and its state in the meantime is not known.
+MAX_GAP = 120
+
+
+# pylint: disable=too-few-public-methods
+class MessageClock:
+    """
+    Clock driven by the timestamps of the messages being processed,
+    so that the BinaryState objects measure durations in message time.
+    """
+
+    def __init__(self):
+        self.now_ns = 0
+
+    def monotonic_ns(self):
+        """
+        :return: the timestamp of the message being processed
+        """
+        return self.now_ns
+
+
+# pylint: disable=too-many-instance-attributes,too-few-public-methods
+class Desk:
+    """
+    Per-desk state. Uses the BinaryState semantics of the device,
+    i.e. the duration of a state is reset whenever the state changes.
+    """
+
+    __slots__ = (
+        "table",
+        "power",
+        "table_state",
+        "power_on",
+        "sessions",
+        "day",
+        "seconds_up",
+        "seconds_down",
+        "seconds_power_on",
+        "last_ns",
+    )
+
+    def __init__(self, clock):
+        self.table = BinaryState(clock)
+        self.power = BinaryState(clock)
+        self.table_state = None
+        self.power_on = None
+        self.sessions = 0
+        self.day = None
+        self.seconds_up = 0.0
+        self.seconds_down = 0.0
+        self.seconds_power_on = 0.0
+        self.last_ns = None
+
+    def start_day(self, day):
+        """
+        Reset the daily totals.
+        """
+        self.day = day
+        self.seconds_up = self.seconds_down = self.seconds_power_on = 0.0
+        self.last_ns = None
+
+
+class Fleet:
+    """
+    Keeps the state of all desks and renders it in Prometheus text format.
+    """
+
+    def __init__(self, distance_threshold, power_threshold, max_gap=MAX_GAP):
+        """
+        :param max_gap: longest time between two messages of a desk (in seconds)
+        accounted to the daily totals
+        """
+        self.distance_threshold = distance_threshold
+        self.power_threshold = power_threshold
+        self.max_gap = max_gap
+        self.clock = MessageClock()
+        self.desks = {}
+        # The newest day seen in the messages as (year, day of the year) tuple.
+        self.day = None
+        self.messages = 0
+        self.errors = 0
+
+    def _desk(self, name):
+        desk = self.desks.get(name)
+        if desk is None:
+            desk = Desk(self.clock)
+            self.desks[name] = desk
+        return desk
+
+    def _start_day(self, day):
+        """
+        Reset the daily totals of all desks, including those that went silent.
+        """
+        if self.day is not None and day <= self.day:
+            return
+        self.day = day
+        for desk in self.desks.values():
+            desk.start_day(day)
+
+    def _advance(self, desk, stamp_ns, day):
+        """
+        Account the time since the previous message of the desk
+        (at most max_gap) to the daily totals.
+        """
+        self.clock.now_ns = stamp_ns
+        if desk.day is None or day > desk.day:
+            desk.start_day(day)
+        elif day < desk.day:
+            # Late message of the previous day.
+            return
+
+        if desk.last_ns is not None and stamp_ns > desk.last_ns:
+            delta = min((stamp_ns - desk.last_ns) / 1_000_000_000, self.max_gap)
+            if desk.power_on:
+                desk.seconds_power_on += delta
+                if desk.table_state == UP:
+                    desk.seconds_up += delta
+                elif desk.table_state == DOWN:
+                    desk.seconds_down += delta
+        desk.last_ns = stamp_ns
+
+    def handle_distance(self, name, distance, stamp_ns, day):
+        """
+        update the desk with distance reading
+        """
+        desk = self._desk(name)
+        self._advance(desk, stamp_ns, day)
+        desk.table_state = UP if distance > self.distance_threshold else DOWN
+        if desk.power_on:
+            desk.table.update(desk.table_state)
+
+    def handle_power(self, name, power, stamp_ns, day):
+        """
+        update the desk with power reading
+        """
+        desk = self._desk(name)
+        self._advance(desk, stamp_ns, day)
+        power_on = power > self.power_threshold
+        if power_on and not desk.power_on:
+            desk.sessions += 1
+        if not power_on:
+            # Same as on the device: the table position tracking restarts after a break.
+            desk.table.reset()
+        desk.power_on = power_on
+        desk.power.update(ON if power_on else OFF)
+
+    def process(self, batch):
+        """
+        Process batch of messages.
+        :param batch: list of (kind, desk name, payload, timestamp in seconds) tuples
+        where kind is "distance" or "power"
+        """
+        for kind, name, payload, stamp in batch:
+            self.messages += 1
+            try:
+                if len(payload) > 0 and payload[0] == COMPACT_VERSION:
+                    metrics = decode_compact(payload)
+                else:
+                    metrics = json.loads(payload)
+                    if not isinstance(metrics, dict):
+                        raise ValueError("not a JSON object")
+                local_time = time.localtime(stamp)
+                day = (local_time.tm_year, local_time.tm_yday)
+                self._start_day(day)
+                stamp_ns = int(stamp * 1_000_000_000)
+                if kind == "distance" and metrics.get("distance") is not None:
+                    self.handle_distance(name, metrics["distance"], stamp_ns, day)
+                elif kind == "power" and metrics.get("current_power") is not None:
+                    self.handle_power(name, metrics["current_power"], stamp_ns, day)
+            except (ValueError, TypeError) as error:
+                self.errors += 1
+                logging.getLogger(__name__).debug(f"cannot process {payload}: {error}")
+
+    def render(self):
+        """
+        :return: the metrics in Prometheus text exposition format
+        """
+        lines = [
+            "# TYPE workmon_fleet_messages_total counter",
+            f"workmon_fleet_messages_total {self.messages}",
+            "# TYPE workmon_fleet_errors_total counter",
+            f"workmon_fleet_errors_total {self.errors}",
+        ]
+        gauges = [
+            ("table_up", "gauge", lambda d: int(d.table_state == UP)),
+            ("table_state_duration_seconds", "gauge", lambda d: d.table.state_duration),
+            ("power_on", "gauge", lambda d: int(bool(d.power_on))),
+            ("power_duration_seconds", "gauge", lambda d: d.power.state_duration),
+            ("power_sessions_total", "counter", lambda d: d.sessions),
+            ("today_up_seconds", "gauge", lambda d: d.seconds_up),
+            ("today_down_seconds", "gauge", lambda d: d.seconds_down),
+            ("today_power_on_seconds", "gauge", lambda d: d.seconds_power_on),
+        ]
+        desks = [(escape_label(name), self.desks[name]) for name in sorted(self.desks)]
+        for metric, metric_type, func in gauges:
+            lines.append(f"# TYPE workmon_desk_{metric} {metric_type}")
+            for label, desk in desks:
+                lines.append(f'workmon_desk_{metric}{{desk="{label}"}} {func(desk)}')
+        return "\n".join(lines) + "\n"
+
+
+def escape_label(value):
+    """
+    :return: the value escaped for use as label value in the Prometheus text format
+    """
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def topic_desk(pattern, topic):
+    """
+    :return: the part of the topic matching '+' in the pattern or None if no match
+    """
+    pattern_parts = pattern.split("/")
+    topic_parts = topic.split("/")
+    if len(pattern_parts) != len(topic_parts):
+        return None
+    name = None
+    for pattern_part, topic_part in zip(pattern_parts, topic_parts):
+        if pattern_part == "+":
+            name = topic_part
+        elif pattern_part != topic_part:
+            return None
+    return name
+
+
+async def process_queue(fleet, queue, batch_size=1000):
+    """
+    Process the messages from the queue in batches.
+    """
+    while True:
+        batch = [await queue.get()]
+        while len(batch) < batch_size and not queue.empty():
+            batch.append(queue.get_nowait())
+        fleet.process(batch)
+
+
+async def serve_metrics(fleet, host, port):
+    """
+    Start HTTP server exposing the metrics.
+    :return: the server object
+    """
+
+    async def handle(reader, writer):
+        try:
+            await reader.readuntil(b"\r\n\r\n")
+            body = fleet.render().encode()
+            writer.write(
+                b"HTTP/1.1 200 OK\r\n"
+                b"Content-Type: text/plain; version=0.0.4\r\n"
+                + f"Content-Length: {len(body)}\r\n".encode()
+                + b"Connection: close\r\n\r\n"
+                + body
+            )
+            await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
+
+
+def parse_args():
+    """
+    parse command line arguments
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--broker", required=True, help="MQTT broker hostname/IP")
+    parser.add_argument("--port", type=int, default=1883, help="MQTT broker port")
+    parser.add_argument(
+        "--distance-topic",
+        default="devices/+/featherTFT",
+        help="topic pattern of the messages published by the devices",
+    )
+    parser.add_argument(
+        "--power-topic",
+        default="devices/plug/+",
+        help="topic pattern of the power messages",
+    )
+    parser.add_argument("--distance-threshold", type=float, default=90)
+    parser.add_argument("--power-threshold", type=float, default=35)
+    parser.add_argument(
+        "--max-gap",
+        type=float,
+        default=MAX_GAP,
+        help="longest time between two messages of a desk (in seconds) "
+        "accounted to the daily totals",
+    )
+    parser.add_argument("--listen", default="0.0.0.0", help="HTTP listen address")
+    parser.add_argument("--listen-port", type=int, default=9877, help="HTTP port")
+    parser.add_argument("--loglevel", default="INFO", help="log level")
+    return parser.parse_args()
+
+
+async def run(args):
+    """
+    subscribe to the topics and serve the metrics
+    """
+    logger = logging.getLogger(__name__)
+
+    # pylint: disable=import-outside-toplevel
+    import paho.mqtt.client as mqtt
+
+    fleet = Fleet(args.distance_threshold, args.power_threshold, args.max_gap)
+    queue = asyncio.Queue()
+    loop = asyncio.get_running_loop()
+
+    # pylint: disable=unused-argument
+    def on_connect(client, userdata, flags, reason_code, properties):
+        logger.info(f"connected to {args.broker}:{args.port}: {reason_code}")
+        client.subscribe([(args.distance_topic, 0), (args.power_topic, 0)])
+
+    # pylint: disable=unused-argument
+    def on_message(client, userdata, message):
+        # Called from the paho thread.
+        for kind, pattern in [
+            ("distance", args.distance_topic),
+            ("power", args.power_topic),
+        ]:
+            name = topic_desk(pattern, message.topic)
+            if name is not None:
+                loop.call_soon_threadsafe(
+                    queue.put_nowait, (kind, name, message.payload, time.time())
+                )
+                return
+
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+    client.on_connect = on_connect
+    client.on_message = on_message
+    client.connect(args.broker, args.port)
+    client.loop_start()
+
+    server = await serve_metrics(fleet, args.listen, args.listen_port)
+    logger.info(f"serving metrics on {args.listen}:{args.listen_port}")
+    async with server:
+        await process_queue(fleet, queue)
+
+
+def main():
+    """
+    command line interface
+    """
+    args = parse_args()
+    logging.basicConfig(level=args.loglevel.upper())
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
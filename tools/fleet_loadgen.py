@@ -0,0 +1,128 @@
+"""
+Synthetic fleet generator for load testing tools/fleet.py against local broker.
+
+Run from the top level directory of the repository, e.g.:
+
+    python -m tools.fleet_loadgen --broker localhost --desks 500 --speedup 10
+
+Each desk publishes distance every 10 seconds and power every 10 seconds
+(both divided by the speedup), switching between sitting and standing
+and taking breaks at random.
+"""
+
+import argparse
+import json
+import logging
+import random
+import time
+
+from payload import COMPACT, JSON, encode_message
+
+
+# pylint: disable=too-few-public-methods
+class SyntheticDesk:
+    """
+    Random walk of a single desk.
+    """
+
+    __slots__ = ("name", "standing", "power_on")
+
+    def __init__(self, name):
+        self.name = name
+        self.standing = random.random() < 0.5
+        self.power_on = True
+
+    def step(self):
+        """
+        :return: tuple of distance and power readings
+        """
+        if random.random() < 0.01:
+            self.standing = not self.standing
+        if random.random() < 0.005:
+            self.power_on = not self.power_on
+        distance = (110.0 if self.standing else 75.0) + random.uniform(-2, 2)
+        power = random.uniform(40, 60) if self.power_on else random.uniform(0, 5)
+        return distance, power
+
+
+def generate(desks, encoding=JSON):
+    """
+    Generator of (kind, desk name, payload) tuples for one round
+    of messages of all the desks.
+    """
+    for desk in desks:
+        distance, power = desk.step()
+        yield "distance", desk.name, encode_message({"distance": distance}, encoding)
+        yield "power", desk.name, json.dumps({"current_power": power})
+
+
+def parse_args():
+    """
+    parse command line arguments
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--broker", default="localhost", help="MQTT broker")
+    parser.add_argument("--port", type=int, default=1883, help="MQTT broker port")
+    parser.add_argument("--desks", type=int, default=100, help="number of desks")
+    parser.add_argument(
+        "--speedup", type=float, default=1, help="publish this many times faster"
+    )
+    parser.add_argument(
+        "--duration", type=float, default=60, help="how long to run (seconds)"
+    )
+    parser.add_argument(
+        "--encoding", choices=[JSON, COMPACT], default=JSON, help="distance encoding"
+    )
+    parser.add_argument(
+        "--distance-topic",
+        default="devices/+/featherTFT",
+        help="topic pattern, '+' is replaced with the desk name",
+    )
+    parser.add_argument(
+        "--power-topic",
+        default="devices/plug/+",
+        help="topic pattern, '+' is replaced with the desk name",
+    )
+    parser.add_argument("--loglevel", default="INFO", help="log level")
+    return parser.parse_args()
+
+
+def main():
+    """
+    publish the synthetic messages
+    """
+    args = parse_args()
+    logging.basicConfig(level=args.loglevel.upper())
+    logger = logging.getLogger(__name__)
+
+    # pylint: disable=import-outside-toplevel
+    import paho.mqtt.client as mqtt
+
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+    client.connect(args.broker, args.port)
+    client.loop_start()
+
+    desks = [SyntheticDesk(f"desk{i:04d}") for i in range(args.desks)]
+    topics = {"distance": args.distance_topic, "power": args.power_topic}
+    interval = 10 / args.speedup
+    start = time.monotonic()
+    count = 0
+    while time.monotonic() - start < args.duration:
+        round_start = time.monotonic()
+        for kind, name, payload in generate(desks, args.encoding):
+            client.publish(topics[kind].replace("+", name), payload)
+            count += 1
+        elapsed = time.monotonic() - round_start
+        logger.info(
+            f"published {2 * len(desks)} messages in {elapsed:.3f} s "
+            f"({count / (time.monotonic() - start):.0f} msg/s overall)"
+        )
+        if elapsed < interval:
+            time.sleep(interval - elapsed)
+
+    client.loop_stop()
+    client.disconnect()
+
+
+if __name__ == "__main__":
+    main()
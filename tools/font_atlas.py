@@ -0,0 +1,103 @@
+"""
+Generate glyph atlas file (see fontatlas.py) from a bitmap font (PCF or BDF).
+
+Run from the top level directory of the repository, e.g.:
+
+    python -m tools.font_atlas fonts/Inter-Regular-25.pcf
+
+This creates fonts/Inter-Regular-25.atlas which should be copied to the CIRCUITPY
+drive next to the font file.
+"""
+
+import argparse
+import struct
+
+from adafruit_bitmap_font import bitmap_font
+
+from fontatlas import (
+    CHARACTERS,
+    GLYPH_FMT,
+    GROUP_FMT,
+    HEADER_FMT,
+    MAGIC,
+    VERSION,
+    atlas_path,
+    row_size,
+)
+
+
+# pylint: disable=too-many-locals
+def build_atlas(font, characters=CHARACTERS):
+    """
+    :param font: font object as returned from bitmap_font.load_font()
+    :return: atlas contents as bytes
+    """
+    font.load_glyphs(characters)
+    groups = {}
+    for character in characters:
+        glyph = font.get_glyph(ord(character))
+        if glyph is None:
+            print(f"glyph for {character!r} not available in the font, skipping")
+            continue
+        groups.setdefault((glyph.width, glyph.height), []).append(
+            (ord(character), glyph)
+        )
+
+    # Use the bounding box of the original font, so that the text is laid out the same.
+    bbox = font.get_bounding_box()
+    ascent = getattr(font, "ascent", bbox[1])
+    descent = getattr(font, "descent", 0)
+    data = bytearray(
+        struct.pack(
+            HEADER_FMT, MAGIC, VERSION, len(groups), *bbox[0:4], ascent, descent
+        )
+    )
+
+    for width, height in sorted(groups):
+        glyphs = groups[(width, height)]
+        data += struct.pack(GROUP_FMT, width, height, len(glyphs))
+        for code_point, glyph in glyphs:
+            data += struct.pack(
+                GLYPH_FMT,
+                code_point,
+                glyph.dx,
+                glyph.dy,
+                glyph.shift_x,
+                glyph.shift_y,
+            )
+
+        if width == 0 or height == 0:
+            continue
+        stride = row_size(len(glyphs) * width)
+        pixels = bytearray(stride * height)
+        for i, (_, glyph) in enumerate(glyphs):
+            for y in range(height):
+                for x in range(width):
+                    if glyph.bitmap[x, y]:
+                        atlas_x = i * width + x
+                        pixels[y * stride + atlas_x // 8] |= 128 >> (atlas_x % 8)
+        data += pixels
+
+    return bytes(data)
+
+
+def main():
+    """
+    command line interface
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("font", help="path to the PCF/BDF font file")
+    parser.add_argument(
+        "-o", "--output", help="output file (default: font path with .atlas suffix)"
+    )
+    args = parser.parse_args()
+
+    output = args.output or atlas_path(args.font)
+    data = build_atlas(bitmap_font.load_font(args.font))
+    with open(output, "wb") as file:
+        file.write(data)
+    print(f"wrote {len(data)} bytes to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Republish messages in the compact binary format as JSON so that the existing
+consumers (mqtt-exporter, mq2anno) can process them.
+
+Run from the top level directory of the repository, e.g.:
+
+    python -m tools.mqtt_bridge --broker 172.40.0.3 --in-prefix compact/
+
+Devices configured with "publish_encoding": "compact" and "mqtt_topic" set to
+e.g. "compact/devices/pracovna/featherTFT" will have their messages republished
+to "devices/pracovna/featherTFT".
+"""
+
+import argparse
+import json
+import logging
+
+from payload import decode_compact
+
+
+def translate(topic, payload, in_prefix, out_prefix):
+    """
+    :return: tuple of topic and JSON string to be republished or None
+    if the message should not be republished
+    """
+    if not topic.startswith(in_prefix):
+        return None
+
+    suffix = topic[len(in_prefix) :]  # noqa: E203
+    # The devices fall back to JSON for messages that cannot be encoded
+    # in the compact format, these are republished as is.
+    if payload[:1] == b"{":
+        return out_prefix + suffix, payload.decode()
+
+    try:
+        metrics = decode_compact(payload)
+    except ValueError as value_error:
+        logging.getLogger(__name__).warning(
+            f"cannot decode message on {topic}: {value_error}"
+        )
+        return None
+
+    return out_prefix + suffix, json.dumps(metrics)
+
+
+def parse_args():
+    """
+    parse command line arguments
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--broker", required=True, help="MQTT broker hostname/IP")
+    parser.add_argument("--port", type=int, default=1883, help="MQTT broker port")
+    parser.add_argument(
+        "--in-prefix",
+        default="compact/",
+        help="topic prefix of the messages in compact format",
+    )
+    parser.add_argument(
+        "--out-prefix", default="", help="prefix to replace the input prefix with"
+    )
+    parser.add_argument("--loglevel", default="INFO", help="log level")
+    return parser.parse_args()
+
+
+def main():
+    """
+    subscribe to the compact topics and republish the messages as JSON
+    """
+    args = parse_args()
+    logging.basicConfig(level=args.loglevel.upper())
+    logger = logging.getLogger(__name__)
+
+    # pylint: disable=import-outside-toplevel
+    import paho.mqtt.client as mqtt
+
+    # pylint: disable=unused-argument
+    def on_connect(client, userdata, flags, reason_code, properties):
+        logger.info(f"connected to {args.broker}:{args.port}: {reason_code}")
+        client.subscribe(args.in_prefix + "#")
+
+    # pylint: disable=unused-argument
+    def on_message(client, userdata, message):
+        result = translate(
+            message.topic, message.payload, args.in_prefix, args.out_prefix
+        )
+        if result is None:
+            return
+        topic, data = result
+        logger.debug(f"{message.topic} -> {topic}: {data}")
+        client.publish(topic, data)
+
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+    client.on_connect = on_connect
+    client.on_message = on_message
+    client.connect(args.broker, args.port)
+    client.loop_forever()
+
+
+if __name__ == "__main__":
+    main()
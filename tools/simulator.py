@@ -0,0 +1,197 @@
+"""
+Simulation of the main loop logic on CPython with virtual clock
+and fake devices.
+"""
+
+from types import SimpleNamespace
+
+import terminalio
+
+from binarystate import BinaryState
+from blinker import Blinker
+from clock import VirtualClock
+from events import EventBus
+from handlers import (
+    CO2,
+    COLOR_PRIORITY,
+    EVENT_BUS,
+    TABLE_STATE_DURATION,
+    TEXT_COLOR_BASE,
+    handle_distance,
+    handle_power,
+    on_message_with_env_metrics,
+    on_message_with_power,
+    refresh_text,
+)
+from pages import CO2_SERIES, DISTANCE_SERIES, chart_page
+from session import SessionTracker
+from stallwatch import NVM_SIZE as STALL_NVM_SIZE
+from stallwatch import STAGE_DISPLAY, STAGE_LOOP, STAGE_MQTT, STAGE_NTP, StallWatch
+from timeutil import HourCache
+
+# Size of the display of the device.
+DISPLAY_WIDTH = 240
+DISPLAY_HEIGHT = 135
+
+
+# pylint: disable=too-few-public-methods
+class FakePixel:
+    """
+    neopixel stand-in recording the colors it was lit with
+    """
+
+    def __init__(self):
+        self.brightness = 0
+        self.colors = set()
+
+    def fill(self, color):
+        """
+        record the color
+        """
+        self.colors.add(color)
+
+
+class FakeMQTTClient:
+    """
+    MiniMQTT client stand-in recording the published messages
+    """
+
+    def __init__(self, user_data):
+        self.user_data = user_data
+        self.published = []
+
+    def publish(self, topic, msg, retain=False):  # pylint: disable=unused-argument
+        """
+        record the message
+        """
+        self.published.append((topic, msg))
+
+    def reconnect(self):
+        """
+        nothing to do
+        """
+
+
+# pylint: disable=too-many-instance-attributes
+class Simulator:
+    """
+    Mirrors what the main loop in code.py does with the inputs,
+    using virtual clock so that it can run much faster than real time.
+    """
+
+    def __init__(self, config, epoch=0):
+        """
+        :param config: Config instance
+        :param epoch: wall clock time (seconds since the Epoch) at the start
+        """
+        self.config = config
+        self.clock = VirtualClock(epoch=epoch)
+        self.user_data = {}
+        self.event_bus = EventBus(self.clock)
+        self.user_data[EVENT_BUS] = self.event_bus
+        self.mqtt_client = FakeMQTTClient(self.user_data)
+        self.labels = [SimpleNamespace(text="", color=0) for _ in range(4)]
+        self.pixel = FakePixel()
+        self.blinker = Blinker(self.pixel, priorities=COLOR_PRIORITY, clock=self.clock)
+        self.table_state = BinaryState(self.clock)
+        self.session = SessionTracker(self.clock)
+        self.table_state_val = None
+        self.last_distance = None
+        self.button_pressed_stamp = None
+        self.hours = HourCache(config.start_hr, clock=self.clock)
+        self.hours.ntp = self.clock
+        self.stall_watch = StallWatch(bytearray(STALL_NVM_SIZE), clock=self.clock)
+        _, self.sparkline = chart_page(
+            terminalio.FONT, DISPLAY_WIDTH, DISPLAY_HEIGHT, TEXT_COLOR_BASE
+        )
+        self.chart_interval_ns = 3600 * 1_000_000_000 // self.sparkline.width
+        self.chart_deadline = 0
+        self.display_update_stamp = self.clock.monotonic_ns() // 1_000_000_000 - 1
+
+    def distance(self, distance):
+        """
+        handle distance reading
+        """
+        self.last_distance = distance
+        self.table_state_val = handle_distance(
+            distance,
+            self.config,
+            self.mqtt_client,
+            self.config.mqtt_topic,
+            self.user_data,
+        )
+
+    def button(self, index):
+        """
+        handle button press
+        """
+        _ = index
+        self.button_pressed_stamp = self.clock.monotonic_ns() // 1_000_000_000
+
+    def message(self, topic, msg):
+        """
+        handle MQTT message
+        """
+        if topic == self.config.mqtt_topic_env:
+            on_message_with_env_metrics(self.mqtt_client, topic, msg, self.clock)
+        elif topic == self.config.mqtt_topic_power:
+            on_message_with_power(self.mqtt_client, topic, msg)
+
+    def display_on(self, now_ns, now_s):
+        """
+        :return: whether the display should be on
+        """
+        cur_hr = self.hours.update(now_ns)
+        if self.config.start_hr <= cur_hr < self.config.end_hr:
+            return True
+        return (
+            self.button_pressed_stamp is not None
+            and self.button_pressed_stamp >= now_s - 60
+        )
+
+    def tick(self):
+        """
+        one iteration of the main loop, the display is updated once a second
+        """
+        now_ns = self.clock.monotonic_ns()
+        now_s = now_ns // 1_000_000_000
+        self.stall_watch.enter(STAGE_LOOP, now_ns)
+        self.blinker.tick(now_ns)
+
+        if self.chart_deadline <= now_ns:
+            self.stall_watch.enter(STAGE_DISPLAY, now_ns)
+            self.sparkline.set(CO2_SERIES, self.user_data.get(CO2))
+            self.sparkline.set(DISTANCE_SERIES, self.last_distance)
+            self.sparkline.advance()
+            self.chart_deadline = now_ns + self.chart_interval_ns
+
+        self.stall_watch.enter(STAGE_NTP, now_ns)
+        if self.display_on(now_ns, now_s):
+            if self.display_update_stamp <= now_s - 1:
+                self.stall_watch.enter(STAGE_DISPLAY, now_ns)
+                refresh_text(
+                    *self.labels, self.user_data, self.config, self.blinker, self.clock
+                )
+                handle_power(
+                    self.blinker,
+                    None,
+                    None,
+                    self.table_state,
+                    self.table_state_val,
+                    self.session,
+                    self.user_data,
+                    self.config,
+                )
+                self.display_update_stamp = now_s
+        else:
+            self.table_state.reset()
+            self.user_data[TABLE_STATE_DURATION] = None
+            self.blinker.clear()
+
+        self.stall_watch.enter(STAGE_MQTT, now_ns)
+        self.event_bus.publish(
+            self.mqtt_client,
+            self.config.mqtt_topic_annotation,
+            self.config.event_window_seconds,
+            self.config.publish_encoding,
+        )
@@ -0,0 +1,124 @@
+"""
+Receive trace published by the device (mqtt_topic_trace) and store it into files.
+
+Run from the top level directory of the repository, e.g.:
+
+    python -m tools.trace_receiver --broker 172.40.0.3 \\
+        --topic devices/pracovna/featherTFT/trace --output desk
+
+Each device boot starts new trace, which is stored into new file
+named after the output prefix and the time of reception, e.g. desk-20240115-080000.trace
+"""
+
+import argparse
+import logging
+import os
+import time
+
+from tracelog import MAGIC, VERSION, split_chunk
+
+
+class TraceFiles:
+    """
+    Stores the trace chunks into files, one file per trace (device boot).
+    """
+
+    def __init__(self, prefix):
+        self._prefix = prefix
+        self._file = None
+        self._sequence = None
+        self.paths = []
+
+    def _open(self):
+        self.close()
+        path = self._prefix + time.strftime("-%Y%m%d-%H%M%S") + ".trace"
+        suffix = 1
+        while os.path.exists(path) or path in self.paths:
+            path = self._prefix + time.strftime("-%Y%m%d-%H%M%S") + f"-{suffix}.trace"
+            suffix += 1
+        logging.getLogger(__name__).info(f"new trace, writing to {path}")
+        # pylint: disable=consider-using-with
+        self._file = open(path, "wb")
+        self._file.write(MAGIC + bytes([VERSION]))
+        self.paths.append(path)
+
+    def write(self, chunk):
+        """
+        Append the records from the chunk to the current trace file.
+        Chunk with sequence number that does not follow the previous one starts
+        new file, unless it is just a gap caused by lost chunks.
+        """
+        logger = logging.getLogger(__name__)
+
+        try:
+            sequence, records = split_chunk(chunk)
+        except ValueError as value_error:
+            logger.warning(f"ignoring chunk: {value_error}")
+            return
+
+        if self._file is None or sequence == 0 or sequence <= self._sequence:
+            self._open()
+        elif sequence > self._sequence + 1:
+            logger.warning(f"lost {sequence - self._sequence - 1} chunk(s)")
+        self._sequence = sequence
+
+        self._file.write(records)
+        self._file.flush()
+
+    def close(self):
+        """
+        close the current file
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def parse_args():
+    """
+    parse command line arguments
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--broker", required=True, help="MQTT broker hostname/IP")
+    parser.add_argument("--port", type=int, default=1883, help="MQTT broker port")
+    parser.add_argument("--topic", required=True, help="trace topic")
+    parser.add_argument("--output", required=True, help="output file prefix")
+    parser.add_argument("--loglevel", default="INFO", help="log level")
+    return parser.parse_args()
+
+
+def main():
+    """
+    store the trace chunks into the output files
+    """
+    args = parse_args()
+    logging.basicConfig(level=args.loglevel.upper())
+    logger = logging.getLogger(__name__)
+
+    # pylint: disable=import-outside-toplevel
+    import paho.mqtt.client as mqtt
+
+    files = TraceFiles(args.output)
+
+    # pylint: disable=unused-argument
+    def on_connect(client, userdata, flags, reason_code, properties):
+        logger.info(f"connected to {args.broker}:{args.port}: {reason_code}")
+        client.subscribe(args.topic)
+
+    # pylint: disable=unused-argument
+    def on_message(client, userdata, message):
+        logger.debug(f"got {len(message.payload)} bytes")
+        files.write(message.payload)
+
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+    client.on_connect = on_connect
+    client.on_message = on_message
+    client.connect(args.broker, args.port)
+    try:
+        client.loop_forever()
+    finally:
+        files.close()
+
+
+if __name__ == "__main__":
+    main()
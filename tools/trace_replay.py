@@ -0,0 +1,76 @@
+"""
+Replay recorded trace through the main loop logic and report the alerts
+and published messages.
+
+Run from the top level directory of the repository, e.g.:
+
+    python -m tools.trace_replay --secrets secrets.py desk.trace
+
+The secrets file provides the configuration (thresholds, topics) to replay with.
+"""
+
+import argparse
+import runpy
+import time
+
+from config import Config
+from tools.simulator import Simulator
+from tracelog import read_trace, replay
+
+
+def parse_args():
+    """
+    parse command line arguments
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--secrets", required=True, help="path to secrets.py")
+    parser.add_argument(
+        "--epoch",
+        type=int,
+        default=int(time.time()),
+        help="wall clock time of the trace start in seconds since the Epoch "
+        "(including time zone offset)",
+    )
+    parser.add_argument(
+        "--speedup",
+        type=float,
+        help="replay speed relative to the recording (default: as fast as possible)",
+    )
+    parser.add_argument("trace", help="trace file")
+    return parser.parse_args()
+
+
+def main():
+    """
+    replay the trace and print summary
+    """
+    args = parse_args()
+    config = Config(runpy.run_path(args.secrets)["secrets"])
+    simulator = Simulator(config, epoch=args.epoch)
+
+    start = time.perf_counter()
+    with open(args.trace, "rb") as file:
+        count = replay(
+            read_trace(file),
+            simulator.clock,
+            simulator.distance,
+            simulator.button,
+            simulator.message,
+            on_tick=simulator.tick,
+            speedup=args.speedup,
+        )
+    elapsed = time.perf_counter() - start
+
+    trace_seconds = simulator.clock.monotonic_ns() / 1_000_000_000
+    print(
+        f"replayed {count} records spanning {trace_seconds:.0f} seconds "
+        f"in {elapsed:.3f} seconds"
+    )
+    print(f"neopixel colors: {sorted(simulator.pixel.colors)}")
+    for topic, msg in simulator.mqtt_client.published:
+        if "annotation" in str(msg):
+            print(f"annotation published to {topic}: {msg}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+"""
+Recording of sensor and MQTT input into compact append-only trace
+and replaying it back through the handlers.
+
+The trace starts with the magic and version and consists of records.
+Each recording starts with the magic and version, so that a file can hold
+the recordings of subsequent boots appended one after another.
+When published over MQTT, the trace is split into chunks (see MQTTTraceSink).
+Each record has a header (type, timestamp in milliseconds since the start
+of the recording, payload length) followed by the payload:
+  - distance: float (centimeters)
+  - button: index of the button pressed
+  - message: topic length, topic, message payload
+"""
+
+import struct
+import time
+
+import adafruit_logging as logging
+
+from clock import CLOCK
+from mqtt import mqtt_publish_robust
+
+MAGIC = b"WMTR"
+VERSION = 1
+
+DISTANCE = 1
+BUTTON = 2
+MESSAGE = 3
+
+RECORD_HEADER_FMT = "<BIH"
+RECORD_HEADER_SIZE = struct.calcsize(RECORD_HEADER_FMT)
+MAX_RECORD_SIZE = 0xFFFF
+MAX_TOPIC_SIZE = 0xFF
+DISTANCE_FMT = "<f"
+# Sequence number of the chunks published by MQTTTraceSink.
+CHUNK_SEQUENCE_FMT = "<I"
+CHUNK_SEQUENCE_SIZE = struct.calcsize(CHUNK_SEQUENCE_FMT)
+
+
+class TraceRecorder:
+    """
+    Records the input into a sink, i.e. object with write() method
+    (e.g. file open in binary write mode or MQTTTraceSink).
+    The trace header and then each record is written with single write() call.
+    """
+
+    def __init__(self, sink, clock=CLOCK):
+        self._sink = sink
+        self._clock = clock
+        self._start_ns = clock.monotonic_ns()
+        # Preallocated to avoid allocations for the most frequent records.
+        self._distance = bytearray(RECORD_HEADER_SIZE + struct.calcsize(DISTANCE_FMT))
+        self._button = bytearray(RECORD_HEADER_SIZE + 1)
+        sink.write(MAGIC + bytes([VERSION]))
+
+    def _record(self, record_type, record):
+        """
+        Fill in the header of the record (the payload follows the header) and write it.
+        """
+        stamp_ms = (self._clock.monotonic_ns() - self._start_ns) // 1_000_000
+        struct.pack_into(
+            RECORD_HEADER_FMT,
+            record,
+            0,
+            record_type,
+            stamp_ms & 0xFFFFFFFF,
+            len(record) - RECORD_HEADER_SIZE,
+        )
+        self._sink.write(record)
+
+    def record_distance(self, distance):
+        """
+        record distance reading (in centimeters)
+        """
+        struct.pack_into(DISTANCE_FMT, self._distance, RECORD_HEADER_SIZE, distance)
+        self._record(DISTANCE, self._distance)
+
+    def record_button(self, index):
+        """
+        record button press
+        """
+        self._button[RECORD_HEADER_SIZE] = index
+        self._record(BUTTON, self._button)
+
+    def record_message(self, topic, msg):
+        """
+        record received MQTT message, unless it does not fit into the record
+        """
+        if isinstance(msg, str):
+            msg = msg.encode()
+        topic = topic.encode()
+        if len(topic) > MAX_TOPIC_SIZE or 1 + len(topic) + len(msg) > MAX_RECORD_SIZE:
+            logging.getLogger(__name__).warning(
+                f"message of {len(msg)} bytes on {topic} too long to record, skipping"
+            )
+            return
+        record = bytearray(RECORD_HEADER_SIZE) + bytes([len(topic)]) + topic + msg
+        self._record(MESSAGE, record)
+
+    def flush(self):
+        """
+        flush the sink
+        """
+        self._sink.flush()
+
+
+class MQTTTraceSink:
+    """
+    Buffers the trace data and publishes it in chunks to MQTT topic
+    (see tools/trace_receiver.py).
+
+    Each write() is expected to be a whole record, the first one being
+    the trace header (this is what TraceRecorder does). Each chunk starts with
+    the trace header followed by the chunk sequence number (see split_chunk())
+    and contains whole records only, so that the receiver can detect new trace
+    (sequence number 0) and carry on after a chunk was lost.
+
+    The MQTT client can be set later via the mqtt_client attribute,
+    until then the data are kept in the buffer. If the buffer fills up
+    before that, the buffered records are dropped.
+    """
+
+    def __init__(self, mqtt_client, topic, chunk_size=1024):
+        self.mqtt_client = mqtt_client
+        self._topic = topic
+        self._buffer = bytearray(chunk_size)
+        self._size = 0
+        # Offset of the records in the buffer, set once the trace header is written.
+        self._start = 0
+        self._sequence = 0
+
+    def write(self, data):
+        """
+        Append record to the buffer. If it does not fit, publish the buffer first.
+        """
+        if self._start == 0:
+            # The trace header.
+            self._buffer[: len(data)] = data
+            self._size = len(data) + CHUNK_SEQUENCE_SIZE
+            self._start = self._size
+            return
+
+        if self._size + len(data) > len(self._buffer):
+            self._publish()
+        if self._start + len(data) > len(self._buffer):
+            logging.getLogger(__name__).warning(
+                f"trace record of {len(data)} bytes does not fit into chunk, dropping"
+            )
+            return
+        self._buffer[self._size : self._size + len(data)] = data  # noqa: E203
+        self._size += len(data)
+
+    def _publish(self):
+        if self._size == self._start:
+            return
+        if self.mqtt_client is None:
+            logging.getLogger(__name__).warning(
+                f"no MQTT client, dropping {self._size - self._start} bytes of trace"
+            )
+        else:
+            struct.pack_into(
+                CHUNK_SEQUENCE_FMT,
+                self._buffer,
+                self._start - CHUNK_SEQUENCE_SIZE,
+                self._sequence,
+            )
+            mqtt_publish_robust(
+                self.mqtt_client, self._topic, bytes(self._buffer[: self._size])
+            )
+        # The dropped chunk counts as well so that the receiver notices the gap.
+        self._sequence += 1
+        self._size = self._start
+
+    def flush(self):
+        """
+        Publish the buffered records. Without MQTT client, the records are kept.
+        """
+        if self.mqtt_client is not None:
+            self._publish()
+
+
+def split_chunk(chunk):
+    """
+    Split trace chunk published by MQTTTraceSink.
+    :return: tuple of sequence number and the records (bytes)
+    :raises ValueError: if the chunk is not valid
+    """
+    header_size = len(MAGIC) + 1
+    if (
+        len(chunk) < header_size + CHUNK_SEQUENCE_SIZE
+        or chunk[: len(MAGIC)] != MAGIC
+        or chunk[len(MAGIC)] != VERSION
+    ):
+        raise ValueError("not a trace chunk or unsupported version")
+    (sequence,) = struct.unpack_from(CHUNK_SEQUENCE_FMT, chunk, header_size)
+    return sequence, chunk[header_size + CHUNK_SEQUENCE_SIZE :]  # noqa: E203
+
+
+def read_trace(file):
+    """
+    Generator of the trace records. The trace can consist of several recordings
+    (e.g. appended to the file on each boot), the timestamps of each recording
+    continue from the last record of the previous one.
+    :param file: file like object open in binary mode
+    :return: tuples of record type, timestamp in milliseconds and the decoded payload
+    (distance as float, button index as int, message as (topic, payload) tuple)
+    :raises ValueError: if the file is not a trace
+    """
+    if not _valid_header(file.read(len(MAGIC) + 1)):
+        raise ValueError("not a trace file or unsupported version")
+
+    offset_ms = 0
+    last_ms = 0
+    while True:
+        # The record types differ from the first byte of the magic.
+        header = file.read(1)
+        if header == MAGIC[:1]:
+            # Start of the next recording.
+            header += file.read(len(MAGIC))
+            if len(header) < len(MAGIC) + 1:
+                return
+            if not _valid_header(header):
+                raise ValueError("unsupported version of appended trace")
+            offset_ms = last_ms
+            continue
+        header += file.read(RECORD_HEADER_SIZE - 1)
+        if len(header) < RECORD_HEADER_SIZE:
+            # Tolerate truncated last record (e.g. when the recording was interrupted).
+            return
+        record_type, stamp_ms, size = struct.unpack(RECORD_HEADER_FMT, header)
+        payload = file.read(size)
+        if len(payload) < size:
+            return
+        stamp_ms += offset_ms
+        last_ms = stamp_ms
+
+        if record_type == DISTANCE:
+            yield record_type, stamp_ms, struct.unpack(DISTANCE_FMT, payload)[0]
+        elif record_type == BUTTON:
+            yield record_type, stamp_ms, payload[0]
+        elif record_type == MESSAGE:
+            topic_end = 1 + payload[0]
+            topic = str(payload[1:topic_end], "utf-8")
+            yield record_type, stamp_ms, (topic, payload[topic_end:])
+
+
+def _valid_header(header):
+    """
+    :return: whether the header is valid trace header
+    """
+    return (
+        len(header) == len(MAGIC) + 1 and header[:-1] == MAGIC and header[-1] == VERSION
+    )
+
+
+# pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-locals
+def replay(
+    records,
+    clock,
+    on_distance,
+    on_button,
+    on_message,
+    on_tick=None,
+    tick_interval=1,
+    speedup=None,
+):
+    """
+    Feed the trace records to the callbacks, advancing the virtual clock
+    according to the timestamps.
+    :param records: iterable of records (see read_trace())
+    :param clock: VirtualClock instance
+    :param on_distance: function called with distance
+    :param on_button: function called with button index
+    :param on_message: function called with topic and message payload
+    :param on_tick: optional function called every tick_interval seconds
+    of the trace time to emulate the main loop
+    :param speedup: if None, replay as fast as possible, otherwise
+    sleep so that the replay runs speedup times faster than the recording
+    :return: number of records replayed
+    """
+    logger = logging.getLogger(__name__)
+
+    tick_interval_ms = int(tick_interval * 1000)
+    now_ms = 0
+    next_tick_ms = 0
+    count = 0
+    for record_type, stamp_ms, value in records:
+        # Run the ticks that happened before this record.
+        while on_tick is not None and next_tick_ms < stamp_ms:
+            _advance(clock, next_tick_ms - now_ms, speedup)
+            now_ms = max(now_ms, next_tick_ms)
+            on_tick()
+            next_tick_ms += tick_interval_ms
+
+        _advance(clock, stamp_ms - now_ms, speedup)
+        now_ms = max(now_ms, stamp_ms)
+
+        logger.debug(f"replaying record {record_type} at {stamp_ms} ms: {value}")
+        if record_type == DISTANCE:
+            on_distance(value)
+        elif record_type == BUTTON:
+            on_button(value)
+        elif record_type == MESSAGE:
+            on_message(*value)
+        count += 1
+
+    # The main loop handles the input before the periodic update.
+    if on_tick is not None and next_tick_ms <= now_ms:
+        _advance(clock, next_tick_ms - now_ms, speedup)
+        on_tick()
+
+    return count
+
+
+def _advance(clock, delta_ms, speedup):
+    if delta_ms <= 0:
+        return
+    if speedup is not None:
+        time.sleep(delta_ms / 1000 / speedup)
+    clock.advance(delta_ms / 1000)
@@ -0,0 +1,107 @@
+"""
+incremental trend estimation
+"""
+
+import math
+
+
+# pylint: disable=too-many-instance-attributes
+class Trend:
+    """
+    Linear regression over exponentially weighted sliding window,
+    updated incrementally in constant time and memory.
+
+    The weighted sums are kept relative to the time of the last sample
+    so that the values stay small and keep their precision.
+    """
+
+    def __init__(self, window, min_samples=3):
+        """
+        :param window: time constant of the window in seconds, samples older
+        than that have weight less than 1/e
+        :param min_samples: minimum number of samples for the estimate
+        """
+        self.window = window
+        self.min_samples = min_samples
+        self.reset()
+
+    def reset(self):
+        """
+        forget all the samples
+        """
+        self._stamp_ns = None
+        self._last = None
+        self._count = 0
+        # Weighted sums of 1, t, y, t*t, t*y
+        self._sw = 0.0
+        self._st = 0.0
+        self._sy = 0.0
+        self._stt = 0.0
+        self._sty = 0.0
+
+    def update(self, value, stamp_ns):
+        """
+        add sample
+        :param value: the sample value
+        :param stamp_ns: monotonic time of the sample in nanoseconds
+        """
+        if self._stamp_ns is not None:
+            delta = (stamp_ns - self._stamp_ns) / 1_000_000_000
+            if delta < 0 or delta > 3 * self.window:
+                # Either time went backwards or the samples are too old to matter.
+                self.reset()
+            else:
+                # Move the origin to the new sample and decay the weights.
+                decay = math.exp(-delta / self.window)
+                self._stt = decay * (
+                    self._stt - 2 * delta * self._st + delta * delta * self._sw
+                )
+                self._sty = decay * (self._sty - delta * self._sy)
+                self._st = decay * (self._st - delta * self._sw)
+                self._sw *= decay
+                self._sy *= decay
+
+        self._stamp_ns = stamp_ns
+        self._last = value
+        self._count += 1
+        # The new sample has t = 0 so it contributes only to the sums of 1 and y.
+        self._sw += 1
+        self._sy += value
+
+    def slope(self):
+        """
+        :return: slope in units per second or None if there is not enough samples
+        """
+        if self._count < self.min_samples:
+            return None
+        denominator = self._sw * self._stt - self._st * self._st
+        if denominator <= 0:
+            return None
+        return (self._sw * self._sty - self._st * self._sy) / denominator
+
+    def value(self):
+        """
+        :return: the estimated value at the time of the last sample or None
+        """
+        slope = self.slope()
+        if slope is None:
+            return None
+        return (self._sy - slope * self._st) / self._sw
+
+    def time_to(self, threshold, now_ns):
+        """
+        :param threshold: value to reach
+        :param now_ns: current monotonic time in nanoseconds
+        :return: estimated number of seconds until the value rises to the threshold
+        (0 if already above) or None if it is not rising or the trend is unknown
+        """
+        slope = self.slope()
+        if slope is None or slope <= 0:
+            return None
+        # Extrapolate from the last sample rather than from the regression
+        # so that sudden drop (e.g. window opened) is reflected immediately.
+        elapsed = (now_ns - self._stamp_ns) / 1_000_000_000
+        current = self._last + slope * elapsed
+        if current >= threshold:
+            return 0
+        return (threshold - current) / slope